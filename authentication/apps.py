@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class AuthConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'authentication'
+
+    def ready(self):
+        # Register the signal receivers
+        from authentication import authentication, blacklist  # noqa: F401
+        from drfbasis import search
+        search.register(
+            self, self.get_model('User'), ('username', 'alt_name', 'email')
+        )
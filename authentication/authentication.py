@@ -0,0 +1,121 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.functional import cached_property
+from rest_framework_simplejwt import models
+from rest_framework_simplejwt.authentication import (
+    JWTStatelessUserAuthentication
+)
+
+from authentication.models import User
+
+USER_CACHE_KEY = "auth:user:%s"
+
+
+def get_cached_user(user_id):
+    """
+    Get a user from the cache, loading it from the db when it's not there.
+    The entry expires after `AUTH_USER_CACHE_TTL` seconds and it's deleted
+    whenever the user is saved. The password hash isn't cached, it's read
+    from the db when it's used.
+    """
+    key = USER_CACHE_KEY % user_id
+    user = cache.get(key)
+    if user is None:
+        user = User.objects.defer("password").get(pk=user_id)
+        cache.set(key, user, settings.AUTH_USER_CACHE_TTL)
+    return user
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    cache.delete(USER_CACHE_KEY % instance.pk)
+
+
+class TokenUser(models.TokenUser):
+    """
+    User built from the claims embedded in the token at login.
+    Any attribute not included in the token is read from the full `User`,
+    which is loaded through the cache the first time it's needed. That
+    includes the groups and permissions, which `models.TokenUser` stubs.
+    """
+
+    @cached_property
+    def uid(self):
+        return self.token.get("uid")
+
+    @cached_property
+    def alt_name(self):
+        return self.token.get("alt_name", "")
+
+    @cached_property
+    def username(self):
+        return self.claim("username")
+
+    @cached_property
+    def is_superuser(self):
+        return self.claim("is_superuser")
+
+    @cached_property
+    def user(self):
+        return get_cached_user(self.id)
+
+    def claim(self, name):
+        # Tokens issued before the claim was added
+        if name in self.token:
+            return self.token[name]
+        return getattr(self.user, name)
+
+    def __getattr__(self, name):
+        if name.startswith("_") or name == "token":
+            raise AttributeError(name)
+        return getattr(self.user, name)
+
+    @property
+    def groups(self):
+        return self.user.groups
+
+    @property
+    def user_permissions(self):
+        return self.user.user_permissions
+
+    def get_group_permissions(self, obj=None):
+        return self.user.get_group_permissions(obj)
+
+    def get_all_permissions(self, obj=None):
+        return self.user.get_all_permissions(obj)
+
+    def has_perm(self, perm, obj=None):
+        return self.user.has_perm(perm, obj)
+
+    def has_perms(self, perm_list, obj=None):
+        return self.user.has_perms(perm_list, obj)
+
+    def has_module_perms(self, module):
+        return self.user.has_module_perms(module)
+
+    def check_password(self, raw_password):
+        return self.user.check_password(raw_password)
+
+    def set_password(self, raw_password):
+        self.user.set_password(raw_password)
+
+    def save(self, *args, **kwargs):
+        self.user.save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        return self.user.delete(*args, **kwargs)
+
+
+class StatelessJWTAuthentication(JWTStatelessUserAuthentication):
+    """
+    JWT authentication that does not fetch the user on every request.
+    Users deactivated after login keep access until their token expires.
+    """
+
+    def get_user(self, validated_token):
+        # Make sure the user id claim is there
+        super().get_user(validated_token)
+        return TokenUser(validated_token)
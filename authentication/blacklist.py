@@ -0,0 +1,199 @@
+"""
+Helpers around the simplejwt token blacklist tables.
+"""
+import datetime
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt import tokens
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import (
+    OutstandingToken,
+    BlacklistedToken
+)
+from rest_framework_simplejwt.utils import aware_utcnow
+
+EXPIRES_AT_INDEX = "token_blacklist_outstandingtoken_expires_at_brin"
+BLACKLISTED_AT_INDEX = "token_blacklist_blacklistedtoken_blacklisted_at_brin"
+VERSION_KEY = "token_blacklist:version"
+GENERATION_KEY = "token_blacklist:generation"
+
+
+class BlacklistCache:
+    """
+    Set of the blacklisted JTIs kept in memory by each process.
+
+    A version stored in the shared cache (`CACHES`) changes every time the
+    blacklist changes. Each lookup compares it with the local copy and, when
+    it differs or every `TOKEN_BLACKLIST_CACHE_TTL` seconds, loads the rows
+    blacklisted since the last one loaded, so checking a token that was not
+    revoked costs a cache read and no database query. Concurrent logouts
+    commit their rows out of order, so every load starts
+    `TOKEN_BLACKLIST_SYNC_OVERLAP` seconds earlier. Deleting rows changes
+    the generation, which reloads the whole set, as it's done every
+    `TOKEN_BLACKLIST_CACHE_RELOAD` seconds. A hit is always confirmed
+    against the database.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.jtis = set()
+        self.version = None
+        self.generation = None
+        # Time of the last row loaded
+        self.since = None
+        self.synced = 0
+        self.reloaded = 0
+
+    def sync(self):
+        keys = cache.get_many([VERSION_KEY, GENERATION_KEY])
+        version, generation = keys.get(VERSION_KEY), keys.get(GENERATION_KEY)
+        now = time.monotonic()
+        if (version == self.version and generation == self.generation
+                and now - self.synced <= settings.TOKEN_BLACKLIST_CACHE_TTL):
+            return
+
+        with self.lock:
+            # Read before the rows: a later change bumps them again
+            reload = (
+                generation != self.generation
+                or self.since is None
+                or now - self.reloaded > settings.TOKEN_BLACKLIST_CACHE_RELOAD
+            )
+            rows = BlacklistedToken.objects.all()
+            if reload:
+                jtis, since = set(), None
+            else:
+                jtis, since = self.jtis, self.since
+                overlap = datetime.timedelta(seconds=settings.TOKEN_BLACKLIST_SYNC_OVERLAP)
+                rows = rows.filter(blacklisted_at__gte=since - overlap)
+            for jti, blacklisted_at in rows.values_list("token__jti", "blacklisted_at").iterator():
+                jtis.add(jti)
+                if since is None or blacklisted_at > since:
+                    since = blacklisted_at
+            self.jtis = jtis
+            self.since = since
+            self.version = version
+            self.generation = generation
+            self.synced = now
+            if reload:
+                self.reloaded = now
+
+    def contains(self, jti):
+        self.sync()
+        if jti not in self.jtis:
+            return False
+        return BlacklistedToken.objects.filter(token__jti=jti).exists()
+
+
+blacklist_cache = BlacklistCache()
+
+
+def invalidate(deleted=False):
+    """
+    Tell every process that the blacklist changed, once the current
+    transaction commits: loading earlier would miss the new rows. When rows
+    were `deleted`, the processes reload the whole blacklist.
+    """
+    def notify():
+        keys = {VERSION_KEY: uuid.uuid4().hex}
+        if deleted:
+            keys[GENERATION_KEY] = uuid.uuid4().hex
+        cache.set_many(keys, None)
+    transaction.on_commit(notify)
+
+
+@receiver(post_save, sender=BlacklistedToken)
+def blacklisted_token_saved(sender, instance, created, **kwargs):
+    if created:
+        invalidate()
+
+
+class RefreshToken(tokens.RefreshToken):
+    """
+    Refresh token checking the blacklist through `blacklist_cache`.
+    It includes the user claims needed to authenticate without a query,
+    copied to its access tokens too.
+    """
+    user_claims = ("uid", "username", "alt_name", "is_staff", "is_superuser")
+
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        for claim in cls.user_claims:
+            token[claim] = getattr(user, claim)
+        return token
+
+    def check_blacklist(self):
+        if not settings.TOKEN_BLACKLIST_CACHE:
+            return super().check_blacklist()
+
+        jti = self.payload[api_settings.JTI_CLAIM]
+        if blacklist_cache.contains(jti):
+            raise TokenError(_("Token is blacklisted"))
+
+
+def prune_expired_tokens(chunk_size=None, pause=0):
+    """
+    Delete the expired outstanding tokens and their blacklist entries.
+    Rows are deleted in chunks of `chunk_size`, each one in its own short
+    transaction, so the tables are never locked for long. It can be
+    scheduled as is (e.g. Heroku Scheduler running `prune_tokens`).
+    Returns the number of outstanding tokens deleted.
+    """
+    chunk_size = chunk_size or settings.TOKEN_PRUNE_CHUNK_SIZE
+    now = aware_utcnow()
+    deleted = 0
+    while True:
+        ids = list(
+            OutstandingToken.objects
+            .filter(expires_at__lte=now)
+            .order_by("id")
+            .values_list("id", flat=True)[:chunk_size]
+        )
+        if not ids:
+            break
+
+        with transaction.atomic():
+            BlacklistedToken.objects.filter(token_id__in=ids).delete()
+            OutstandingToken.objects.filter(id__in=ids).delete()
+        deleted += len(ids)
+
+        if pause:
+            time.sleep(pause)
+
+    if deleted:
+        invalidate(deleted=True)
+    return deleted
+
+
+def create_indexes():
+    """
+    Create BRIN indexes on the outstanding token expiry date and on the
+    blacklisting date (PostgreSQL). Rows are inserted in that order, so the
+    indexes are tiny and let the pruning find the expired range and the
+    blacklist cache the new rows without scanning the whole tables.
+    """
+    if connection.vendor != "postgresql":
+        return False
+    with connection.cursor() as cursor:
+        for name, model, column in (
+            (EXPIRES_AT_INDEX, OutstandingToken, "expires_at"),
+            (BLACKLISTED_AT_INDEX, BlacklistedToken, "blacklisted_at"),
+        ):
+            cursor.execute(
+                "CREATE INDEX CONCURRENTLY IF NOT EXISTS %s "
+                "ON %s USING brin (%s)" % (name, model._meta.db_table, column)
+            )
+    return True
@@ -0,0 +1,65 @@
+"""
+Rendering of the account emails.
+
+The compiled templates and the site context (protocol, domain and app
+title) are cached per process, so rendering an email is a single template
+render. `render_many` renders a batch sharing one context.
+"""
+from django.conf import settings
+from django.contrib.sites import shortcuts
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.template import Context, loader
+
+templates = {}
+site_contexts = {}
+
+# Hosts with their site context cached
+MAX_SITES = 32
+
+
+def get_template(name):
+    """The engine independent `django.template.Template`"""
+    template = templates.get(name)
+    if template is None:
+        template = templates[name] = loader.get_template(name).template
+    return template
+
+
+def site_context(request):
+    # The raw host, get_host() validates it against ALLOWED_HOSTS the
+    # first time it's seen
+    host = request.META.get("HTTP_HOST") or request.META.get("SERVER_NAME")
+    context = site_contexts.get(host)
+    if context is None:
+        context = {
+            "protocol": settings.PROTOCOL,
+            "domain": shortcuts.get_current_site(request).domain,
+            "app_title": settings.APP_TITLE,
+        }
+        if len(site_contexts) < MAX_SITES:
+            site_contexts[host] = context
+    return context
+
+
+def render(request, template_name, context):
+    return render_many(request, template_name, [context])[0]
+
+
+def render_many(request, template_name, contexts):
+    """Render the template once per context of `contexts`"""
+    template = get_template(template_name)
+    context = Context(site_context(request), autoescape=template.engine.autoescape)
+    rendered = []
+    with context.bind_template(template):
+        for values in contexts:
+            with context.push(values):
+                rendered.append(template.render(context))
+    return rendered
+
+
+@receiver(setting_changed)
+def clear_caches(setting, **kwargs):
+    if setting in ("TEMPLATES", "PROTOCOL", "APP_TITLE", "ALLOWED_HOSTS"):
+        templates.clear()
+        site_contexts.clear()
@@ -0,0 +1,196 @@
+"""
+Password hashing service.
+
+Hashing is CPU bound (PBKDF2), so every hash of the API runs in a pool of
+`PASSWORD_HASHING_WORKERS` threads and the views wait for it. When more than
+`PASSWORD_HASHING_QUEUE_SIZE` hashes are waiting for a worker, new ones
+are rejected with a 503 and a `Retry-After`, so a login storm doesn't
+starve the rest of the endpoints.
+"""
+import collections
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import get_user_model, hashers
+from rest_framework import exceptions, status
+
+from drfbasis.metrics import Gauge, Histogram, registry
+
+HASH_DURATION = registry.register(Histogram(
+    "password_hash_duration_seconds",
+    "Time hashing a password, without the queue wait",
+    buckets=(0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1, 2, 5)
+))
+HASH_QUEUE_WAIT = registry.register(Histogram(
+    "password_hash_queue_wait_seconds",
+    "Time a hash waits for a worker"
+))
+
+
+class PBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    """
+    PBKDF2 with `PASSWORD_HASH_ITERATIONS`. Hashes with other iterations
+    are hashed again on login.
+    """
+
+    @property
+    def iterations(self):
+        return settings.PASSWORD_HASH_ITERATIONS
+
+
+class HashingBusy(exceptions.APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "Too many password checks in progress, try again later."
+    default_code = "hashing_busy"
+
+    def __init__(self, wait):
+        super().__init__()
+        # Sent as Retry-After by the exception handler
+        self.wait = wait
+
+
+class HashingService:
+
+    def __init__(self, workers, queue_size, samples=1000):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers,
+            thread_name_prefix="password-hashing"
+        )
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.max_pending = 0
+        self.completed = 0
+        self.rejected = 0
+        # Seconds waiting for a worker and hashing of the last hashes
+        self.waits = collections.deque(maxlen=samples)
+        self.latencies = collections.deque(maxlen=samples)
+
+    def submit(self, func, *args):
+        with self.lock:
+            if self.pending >= self.workers + self.queue_size:
+                self.rejected += 1
+                raise HashingBusy(self.retry_after())
+            self.pending += 1
+            self.max_pending = max(self.max_pending, self.pending)
+        return self.executor.submit(self.measure, time.perf_counter(), func, *args)
+
+    def measure(self, submitted, func, *args):
+        started = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            finished = time.perf_counter()
+            with self.lock:
+                self.pending -= 1
+                self.completed += 1
+                self.waits.append(started - submitted)
+                self.latencies.append(finished - started)
+            HASH_DURATION.observe(finished - started)
+            HASH_QUEUE_WAIT.observe(started - submitted)
+
+    def run(self, func, *args):
+        return self.submit(func, *args).result()
+
+    def retry_after(self):
+        """Seconds to drain the queue at the current hash latency"""
+        latency = self.mean(self.latencies) or 1
+        return max(1, math.ceil(latency * self.pending / self.workers))
+
+    @staticmethod
+    def mean(values):
+        return sum(values) / len(values) if values else None
+
+    @staticmethod
+    def percentile(values, percent):
+        if not values:
+            return None
+        values = sorted(values)
+        return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+    def metrics(self):
+        with self.lock:
+            latencies = list(self.latencies)
+            waits = list(self.waits)
+            return {
+                "workers": self.workers,
+                "queue_size": self.queue_size,
+                "queue_depth": max(0, self.pending - self.workers),
+                "in_progress": min(self.pending, self.workers),
+                "max_pending": self.max_pending,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "latency": {
+                    "mean": self.mean(latencies),
+                    "p50": self.percentile(latencies, 50),
+                    "p95": self.percentile(latencies, 95),
+                    "max": max(latencies, default=None),
+                },
+                "queue_wait": {
+                    "mean": self.mean(waits),
+                    "p95": self.percentile(waits, 95),
+                },
+            }
+
+
+service = HashingService(
+    settings.PASSWORD_HASHING_WORKERS,
+    settings.PASSWORD_HASHING_QUEUE_SIZE
+)
+registry.register(Gauge(
+    "password_hash_queue_depth",
+    "Hashes waiting for a worker",
+    lambda: service.metrics()["queue_depth"]
+))
+registry.register(Gauge(
+    "password_hash_rejected",
+    "Hashes rejected because the queue was full",
+    lambda: service.rejected
+))
+
+
+def _check_password(password, encoded):
+    """
+    Whether the password is valid and, when the hasher or its parameters
+    changed, its new hash as Django's `check_password` setter would do
+    """
+    must_update = []
+    valid = hashers.check_password(password, encoded, must_update.append)
+    if valid and must_update:
+        return valid, hashers.make_password(password)
+    return valid, None
+
+
+def make_password(password):
+    return service.run(hashers.make_password, password)
+
+
+def check_password(user, password):
+    """`user.check_password` in the hashing service"""
+    valid, encoded = service.run(_check_password, password, user.password)
+    if encoded:
+        user.password = encoded
+        get_user_model().objects.filter(pk=user.pk).update(password=encoded)
+    return valid
+
+
+def authenticate(username, password):
+    """The `ModelBackend.authenticate` checks with `check_password`"""
+    User = get_user_model()
+    if username is None or password is None:
+        return None
+    try:
+        user = User._default_manager.get(
+            **{User.USERNAME_FIELD: username}
+        )
+    except User.DoesNotExist:
+        # Hash anyway, so the time doesn't tell whether the user exists
+        make_password(password)
+        return None
+    if check_password(user, password) and user.is_active:
+        return user
+    return None
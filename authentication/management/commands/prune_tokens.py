@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from authentication import blacklist
+
+
+class Command(BaseCommand):
+    help = "Deletes the expired outstanding and blacklisted tokens in chunks"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=settings.TOKEN_PRUNE_CHUNK_SIZE,
+            help="Maximum number of tokens deleted per transaction"
+        )
+        parser.add_argument(
+            "--pause",
+            type=float,
+            default=0,
+            help="Seconds to wait between chunks to reduce the load"
+        )
+        parser.add_argument(
+            "--create-index",
+            action="store_true",
+            help="Create BRIN indexes on the token expiry and blacklisting dates (PostgreSQL)"
+        )
+
+    def handle(self, *args, **options):
+        if options["create_index"]:
+            if blacklist.create_indexes():
+                self.stdout.write("Indexes %s and %s ready" % (
+                    blacklist.EXPIRES_AT_INDEX,
+                    blacklist.BLACKLISTED_AT_INDEX
+                ))
+            else:
+                self.stdout.write("The indexes are only available with PostgreSQL")
+
+        deleted = blacklist.prune_expired_tokens(
+            options["chunk_size"],
+            options["pause"]
+        )
+        self.stdout.write(self.style.SUCCESS("%d expired tokens deleted" % deleted))
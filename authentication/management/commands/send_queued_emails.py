@@ -0,0 +1,43 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from authentication import outbox
+
+
+class Command(BaseCommand):
+    help = "Sends the emails waiting in the outbox"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=settings.EMAIL_QUEUE_BATCH_SIZE,
+            help="Maximum number of emails sent over one connection"
+        )
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep polling the outbox instead of exiting when it is empty"
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=settings.EMAIL_QUEUE_POLL_INTERVAL,
+            help="Seconds to wait between polls when the outbox is empty"
+        )
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            sent = outbox.send_pending(options["batch_size"])
+            total += sent
+            if sent:
+                self.stdout.write("%d emails sent" % sent)
+                continue
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
+
+        self.stdout.write(self.style.SUCCESS("%d emails sent in total" % total))
@@ -2,6 +2,8 @@ import uuid
 
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.db.models.functions import Lower
+from django.utils import timezone
 from django.utils.translation import gettext as _
 
 
@@ -14,18 +16,11 @@ class User(AbstractUser):
         editable=False,
         unique=True
     )
+    # Unique ignoring the case, see Meta.constraints
     alt_name = models.CharField(
         default="master",
         max_length=25,
         null=False,
-        unique=True,
-        editable=True
-    )
-    i_alt_name = models.CharField(
-        default="master",
-        max_length=25,
-        null=False,
-        unique=True,
         editable=True
     )
     email = models.EmailField(
@@ -43,8 +38,116 @@ class User(AbstractUser):
     class Meta:
         app_label = "authentication"
         ordering = ["id"]
+        indexes = [
+            # Keyset pagination
+            models.Index(fields=["date_joined", "id"]),
+        ]
+        constraints = [
+            # Also the index used by find_conflicts
+            models.UniqueConstraint(
+                Lower("alt_name"),
+                name="user_alt_name_ci_unique"
+            ),
+        ]
 
     def save(self, *args, **kwargs):
         if not self.uid:
             self.uid = str(uuid.uuid4())
-        super().save(*args, **kwargs)
\ No newline at end of file
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def find_conflicts(cls, exclude=None, **values):
+        """
+        Names of the fields among `email`, `username` and `alt_name` (case
+        insensitive) already used by another user, with a single query.
+        """
+        lookups = {
+            "email": "email",
+            "username": "username",
+            "alt_name": "lower_alt_name",
+        }
+        values = {k: v for k, v in values.items() if v is not None}
+        if "alt_name" in values:
+            values["alt_name"] = values["alt_name"].lower()
+
+        condition = models.Q()
+        for field, value in values.items():
+            condition |= models.Q(**{lookups[field]: value})
+        if not condition:
+            return set()
+
+        users = cls.objects.annotate(
+            lower_alt_name=Lower("alt_name")
+        ).filter(condition)
+        if exclude is not None:
+            users = users.exclude(pk=exclude)
+        users = users.values_list("email", "username", "lower_alt_name")
+
+        conflicts = set()
+        for email, username, alt_name in users:
+            found = {"email": email, "username": username, "alt_name": alt_name}
+            conflicts.update(
+                field for field, value in values.items() if found[field] == value
+            )
+        return conflicts
+
+
+class OutboundEmail(models.Model):
+    """Email waiting in the outbox to be delivered by the mail worker."""
+
+    PENDING = "pending"
+    SENT = "sent"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, _("Pending")),
+        (SENT, _("Sent")),
+        (FAILED, _("Failed")),
+    ]
+
+    subject = models.CharField(
+        max_length=255
+    )
+    body = models.TextField()
+    from_email = models.CharField(
+        max_length=254
+    )
+    to = models.TextField(
+        help_text="Comma separated list of recipients"
+    )
+    status = models.CharField(
+        max_length=10,
+        choices=STATUS_CHOICES,
+        default=PENDING
+    )
+    attempts = models.PositiveSmallIntegerField(
+        default=0
+    )
+    last_error = models.TextField(
+        blank=True,
+        default=""
+    )
+    next_attempt = models.DateTimeField(
+        default=timezone.now,
+        help_text="The worker will not try to send the email before this date"
+    )
+    created = models.DateTimeField(
+        auto_now_add=True
+    )
+    sent = models.DateTimeField(
+        null=True,
+        blank=True
+    )
+
+    def __str__(self):
+        return f"{self.id}: {self.subject} - {self.to} ({self.status})"
+
+    class Meta:
+        app_label = "authentication"
+        ordering = ["next_attempt", "id"]
+        indexes = [
+            models.Index(fields=["status", "next_attempt"]),
+        ]
+
+    @property
+    def recipients(self):
+        return [r for r in self.to.split(",") if r]
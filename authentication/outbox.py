@@ -0,0 +1,125 @@
+"""
+Durable outbound email queue.
+
+Views call `enqueue` to store the email in the database and return straight
+away; the `send_queued_emails` command delivers the pending emails in batches
+reusing a single connection to the email backend.
+"""
+import datetime
+import logging
+
+from django.conf import settings
+from django.core import mail
+from django.db import transaction
+from django.utils import timezone
+
+from authentication.models import OutboundEmail
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue(subject, message, recipient_list, from_email=None):
+    """Store an email in the outbox. It will be sent by the mail worker."""
+    return OutboundEmail.objects.create(
+        subject=subject,
+        body=message,
+        from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+        to=",".join(recipient_list)
+    )
+
+
+def enqueue_many(subject, messages, recipient_lists, from_email=None):
+    """Store a batch of emails, e.g. rendered with `emails.render_many`"""
+    return OutboundEmail.objects.bulk_create([
+        OutboundEmail(
+            subject=subject,
+            body=message,
+            from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+            to=",".join(recipient_list)
+        ) for message, recipient_list in zip(messages, recipient_lists)
+    ])
+
+
+def backoff(attempts):
+    """Seconds to wait before retrying an email that failed `attempts` times"""
+    delay = settings.EMAIL_QUEUE_RETRY_DELAY * 2 ** max(attempts - 1, 0)
+    return min(delay, settings.EMAIL_QUEUE_MAX_RETRY_DELAY)
+
+
+def claim(batch_size):
+    """
+    Lock a batch of due emails for this worker. The emails are leased
+    pushing `next_attempt` forward, so other workers skip them while
+    they are being sent, and the row locks are released straight away.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        batch = list(
+            OutboundEmail.objects
+            .select_for_update(skip_locked=True)
+            .filter(status=OutboundEmail.PENDING, next_attempt__lte=now)
+            .order_by("next_attempt", "id")[:batch_size]
+        )
+        OutboundEmail.objects.filter(
+            pk__in=[email.pk for email in batch]
+        ).update(
+            next_attempt=now + datetime.timedelta(
+                seconds=settings.EMAIL_QUEUE_LEASE
+            )
+        )
+    return batch
+
+
+def send_pending(batch_size=None, connection=None):
+    """
+    Send a batch of due emails over one connection.
+    Returns the number of emails sent.
+    """
+    batch = claim(batch_size or settings.EMAIL_QUEUE_BATCH_SIZE)
+    if not batch:
+        return 0
+
+    connection = connection or mail.get_connection(fail_silently=False)
+    sent = 0
+    failed = []
+    try:
+        connection.open()
+        for email in batch:
+            message = mail.EmailMessage(
+                email.subject,
+                email.body,
+                email.from_email,
+                email.recipients,
+                connection=connection
+            )
+            try:
+                message.send()
+            except Exception as e:
+                logger.warning("Error sending the email %s: %s", email.pk, e)
+                failed.append((email, e))
+            else:
+                email.sent = timezone.now()
+                email.status = OutboundEmail.SENT
+                sent += 1
+    except Exception as e:
+        # The connection could not be opened, retry the whole batch
+        logger.warning("Error connecting to the email backend: %s", e)
+        failed = [(email, e) for email in batch if email.status != OutboundEmail.SENT]
+    finally:
+        connection.close()
+
+    now = timezone.now()
+    for email, error in failed:
+        email.attempts += 1
+        email.last_error = str(error)
+        if email.attempts >= settings.EMAIL_QUEUE_MAX_ATTEMPTS:
+            email.status = OutboundEmail.FAILED
+        email.next_attempt = now + datetime.timedelta(
+            seconds=backoff(email.attempts)
+        )
+
+    OutboundEmail.objects.bulk_update(
+        batch,
+        ["status", "sent", "attempts", "last_error", "next_attempt"]
+    )
+    return sent
@@ -1,12 +1,17 @@
 import re
-from django.contrib.auth.models import Group
+from django.contrib.auth.models import Group, update_last_login
+from django.contrib.auth.validators import UnicodeUsernameValidator
 from authentication.models import User
 from django.contrib.auth.password_validation import validate_password
-from rest_framework import serializers, validators
-from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework import exceptions, serializers
+from rest_framework_simplejwt import serializers as jwt_serializers
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from authentication import hashing
+from authentication.blacklist import RefreshToken
+from drfbasis.relations import HyperlinkedModelSerializer
 
 
-class UserSerializer(serializers.HyperlinkedModelSerializer):
+class UserSerializer(HyperlinkedModelSerializer):
     class Meta:
         model = User
         fields = [
@@ -14,35 +19,42 @@ class UserSerializer(serializers.HyperlinkedModelSerializer):
             'uid',
             'username',
             'alt_name',
-            'i_alt_name',
             'email',
             'is_staff',
             'groups'
         ]
 
 
-class GroupSerializer(serializers.HyperlinkedModelSerializer):
+class GroupSerializer(HyperlinkedModelSerializer):
     class Meta:
         model = Group
         fields = ['url', 'name']
 
 
-class RegisterSerializer(serializers.ModelSerializer):
-    email = serializers.EmailField(
-        required=True,
-        validators=[validators.UniqueValidator(
-            queryset=User.objects.all(),
-            message="This email address is already in use"
-        )]
-    )
-    alt_name = serializers.CharField(
-        min_length=3,
-        max_length=25,
-        validators=[validators.UniqueValidator(
-            queryset=User.objects.all(),
-            message="This alternative name is already in use"
-        )]
+def check_conflicts(attrs, messages, exclude=None):
+    """
+    Raise a validation error with every field of `attrs` already in use
+    by another user, found with a single query.
+    """
+    conflicts = User.find_conflicts(
+        exclude=exclude,
+        **{field: attrs.get(field) for field in messages}
     )
+    if conflicts:
+        raise serializers.ValidationError({
+            field: messages[field] for field in messages if field in conflicts
+        })
+
+
+class RegisterSerializer(serializers.ModelSerializer):
+    # Uniqueness is checked for all the fields at once in validate()
+    conflict_messages = {
+        'username': "A user with that username already exists.",
+        'email': "This email address is already in use",
+        'alt_name': "This alternative name is already in use",
+    }
+    email = serializers.EmailField(required=True)
+    alt_name = serializers.CharField(min_length=3, max_length=25)
     password = serializers.CharField(write_only=True, required=True, validators=[validate_password])
     password2 = serializers.CharField(write_only=True, required=True)
 
@@ -52,20 +64,21 @@ class RegisterSerializer(serializers.ModelSerializer):
 
         #We can add extra validations with extra_kwargs option
         extra_kwargs = {
-            'alt_name': {'required': True}
+            'alt_name': {'required': True},
+            # Without the UniqueValidator
+            'username': {'validators': [UnicodeUsernameValidator()]},
         }
 
     def validate(self, attrs):
         if attrs['password'] != attrs['password2']:
             raise serializers.ValidationError({"password": "Passwords didn't match."})
 
+        check_conflicts(attrs, self.conflict_messages)
         return attrs
 
     def validate_alt_name(self, value):
         if not re.match("^[A-Za-z0-9 _-]*$", value):
             raise serializers.ValidationError({"alt_name": "Please, use only letters and numbers"})
-        if User.objects.filter(i_alt_name=value.lower()).exists():
-            raise serializers.ValidationError({"alt_name": "This alternative name is already in use"})
         return value
     
 
@@ -89,7 +102,7 @@ class ChangePasswordSerializer(serializers.ModelSerializer):
 
     def validate_old_password(self, value):
         user = self.context['request'].user
-        if not user.check_password(value):
+        if not hashing.check_password(user, value):
             raise serializers.ValidationError({
                 "old_password": "Old password is not correct"
             })
@@ -103,36 +116,33 @@ class ChangePasswordSerializer(serializers.ModelSerializer):
                 "authorize": "You dont have permission to update this user."
             })
 
-        instance.set_password(validated_data['password'])
+        instance.password = hashing.make_password(validated_data['password'])
         instance.save()
         return instance
 
 
 class UpdateUserSerializer(serializers.ModelSerializer):
+    conflict_messages = {
+        'username': "This username is already in use.",
+        'email': "This email is already in use.",
+        'alt_name': "This alternative name is already in use.",
+    }
     email = serializers.EmailField(required=False)
 
     class Meta:
         model = User
         fields = ('username', 'email', 'alt_name')
         extra_kwargs = {
-            'username': {'required': False},
+            'username': {
+                'required': False,
+                'validators': [UnicodeUsernameValidator()]
+            },
             'alt_name': {'required': False},
         }
 
-    def validate_email(self, value):
-        user = self.context['request'].user
-        if User.objects.exclude(pk=user.pk).filter(email=value).exists():
-            raise serializers.ValidationError({"email": "This email is already in use."})
-        return value
-
     def validate(self, attrs):
         user = self.context['request'].user
-        if ('username' in attrs
-                and User.objects.exclude(pk=user.pk).filter(username=attrs['username']).exists()):
-            raise serializers.ValidationError({"username": "This username is already in use."})
-        if ('alt_name' in attrs
-                and User.objects.exclude(pk=user.pk).filter(username=attrs['alt_name']).exists()):
-            raise serializers.ValidationError({"alt_name": "This alternative name is already in use."})
+        check_conflicts(attrs, self.conflict_messages, exclude=user.pk)
         return attrs
 
     # PUT request
@@ -143,8 +153,6 @@ class UpdateUserSerializer(serializers.ModelSerializer):
 
         for k in validated_data:
             setattr(instance, k, validated_data[k])
-            if k == 'alt_name':
-                setattr(instance, 'i_alt_name', validated_data[k].lower())
 
         instance.save()
         return instance
@@ -171,3 +179,31 @@ class ForgotPasswordSerializer(serializers.Serializer):
         if User.objects.filter(email=value).exists():
             return value
         raise serializers.ValidationError({"message": "This email does not exist."})
+
+
+class TokenRefreshSerializer(jwt_serializers.TokenRefreshSerializer):
+    # Checks the blacklist through the in-memory blacklist cache
+    token_class = RefreshToken
+
+
+class TokenObtainPairSerializer(jwt_serializers.TokenObtainPairSerializer):
+    # Adds the user claims used by StatelessJWTAuthentication
+    token_class = RefreshToken
+
+    def validate(self, attrs):
+        """The tokens of the credentials, checking the password in the hashing service"""
+        self.user = hashing.authenticate(
+            attrs[self.username_field],
+            attrs["password"]
+        )
+        if not jwt_settings.USER_AUTHENTICATION_RULE(self.user):
+            raise exceptions.AuthenticationFailed(
+                self.error_messages["no_active_account"],
+                "no_active_account",
+            )
+
+        refresh = self.get_token(self.user)
+        data = {"refresh": str(refresh), "access": str(refresh.access_token)}
+        if jwt_settings.UPDATE_LAST_LOGIN:
+            update_last_login(None, self.user)
+        return data
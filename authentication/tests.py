@@ -1,3 +1,613 @@
-from django.test import TestCase
+import datetime
+import io
+import math
+import threading
+import uuid
 
-# Create your tests here.
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group, Permission
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management import call_command
+from django.template import loader
+from django.db import IntegrityError, connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, APITestCase
+from unittest import mock
+from rest_framework_simplejwt.token_blacklist.models import (
+    BlacklistedToken,
+    OutstandingToken
+)
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from authentication import blacklist, emails, hashing, outbox
+from authentication.authentication import USER_CACHE_KEY, StatelessJWTAuthentication
+from authentication.models import OutboundEmail, User
+from authentication.serializers import RegisterSerializer, UpdateUserSerializer
+from drfbasis.throttling import SlidingWindowThrottle
+
+
+class FailingEmailBackend(EmailBackend):
+    def send_messages(self, messages):
+        raise ConnectionError("SMTP server unavailable")
+
+
+class OutboxTests(TestCase):
+
+    def test_enqueue_does_not_send(self):
+        outbox.enqueue('Subject', 'Body', ['user@test.com'])
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(OutboundEmail.objects.get().status, OutboundEmail.PENDING)
+
+    def test_send_pending_in_batches(self):
+        for i in range(5):
+            outbox.enqueue('Subject', 'Body', [f'user{i}@test.com'])
+
+        self.assertEqual(outbox.send_pending(batch_size=3), 3)
+        self.assertEqual(outbox.send_pending(batch_size=3), 2)
+        self.assertEqual(outbox.send_pending(batch_size=3), 0)
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertFalse(
+            OutboundEmail.objects.exclude(status=OutboundEmail.SENT).exists()
+        )
+
+    @override_settings(
+        EMAIL_BACKEND='authentication.tests.FailingEmailBackend',
+        EMAIL_QUEUE_MAX_ATTEMPTS=2
+    )
+    def test_retry_with_backoff(self):
+        email = outbox.enqueue('Subject', 'Body', ['user@test.com'])
+
+        self.assertEqual(outbox.send_pending(), 0)
+        email.refresh_from_db()
+        self.assertEqual(email.status, OutboundEmail.PENDING)
+        self.assertEqual(email.attempts, 1)
+        self.assertGreater(email.next_attempt, timezone.now())
+        # Not due yet
+        self.assertEqual(outbox.send_pending(), 0)
+        email.refresh_from_db()
+        self.assertEqual(email.attempts, 1)
+
+        OutboundEmail.objects.update(next_attempt=timezone.now())
+        outbox.send_pending()
+        email.refresh_from_db()
+        self.assertEqual(email.status, OutboundEmail.FAILED)
+        self.assertIn("SMTP server unavailable", email.last_error)
+
+    def test_command(self):
+        outbox.enqueue('Subject', 'Body', ['user@test.com'])
+        OutboundEmail.objects.update(
+            next_attempt=timezone.now() - datetime.timedelta(minutes=1)
+        )
+        call_command('send_queued_emails', stdout=io.StringIO())
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['user@test.com'])
+
+
+class RegisterViewTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_register_queues_activation_email(self):
+        res = self.client.post('/auth/register/', {
+            'username': 'john',
+            'email': 'john@test.com',
+            'alt_name': 'Johnny',
+            'password': 'A-str0ng-pwd!',
+            'password2': 'A-str0ng-pwd!'
+        })
+        self.assertEqual(res.status_code, 202)
+        self.assertEqual(len(mail.outbox), 0)
+
+        email = OutboundEmail.objects.get()
+        self.assertEqual(email.to, 'john@test.com')
+        self.assertIn('/auth/activate-account/', email.body)
+        self.assertFalse(User.objects.get(username='john').is_active)
+
+        outbox.send_pending()
+        self.assertEqual(len(mail.outbox), 1)
+
+
+class LogoutViewTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(
+            username='john',
+            alt_name='Johnny',
+            email='john@test.com'
+        )
+        self.client.force_authenticate(self.user)
+
+    def create_tokens(self, n):
+        expires = timezone.now() + datetime.timedelta(days=1)
+        OutstandingToken.objects.bulk_create([
+            OutstandingToken(
+                user=self.user,
+                jti=uuid.uuid4().hex,
+                token='token',
+                expires_at=expires
+            ) for _ in range(n)
+        ])
+
+    def expected_queries(self, n):
+        # One SELECT for the tokens plus the INSERT batches the backend needs
+        fields = [BlacklistedToken._meta.get_field(f) for f in ('token', 'blacklisted_at')]
+        batch_size = connection.ops.bulk_batch_size(fields, range(n)) or n
+        return 1 + math.ceil(n / batch_size)
+
+    def assert_logout_queries(self, n):
+        self.create_tokens(n)
+        with CaptureQueriesContext(connection) as ctx:
+            res = self.client.post('/auth/logout/')
+        self.assertEqual(res.status_code, 205)
+        self.assertEqual(len(ctx), self.expected_queries(n))
+        self.assertEqual(
+            BlacklistedToken.objects.filter(token__user=self.user).count(), n
+        )
+
+    def test_logout_queries_10(self):
+        self.assert_logout_queries(10)
+
+    def test_logout_queries_1k(self):
+        self.assert_logout_queries(1000)
+
+    def test_logout_queries_10k(self):
+        self.assert_logout_queries(10000)
+
+    def test_logout_skips_blacklisted_tokens(self):
+        self.create_tokens(10)
+        BlacklistedToken.objects.create(token=OutstandingToken.objects.first())
+        res = self.client.post('/auth/logout/')
+        self.assertEqual(res.status_code, 205)
+        self.assertEqual(BlacklistedToken.objects.count(), 10)
+
+    def test_logout_current_token_only(self):
+        self.create_tokens(5)
+        refresh = RefreshToken.for_user(self.user)
+        res = self.client.post('/auth/logout/', {'refresh': str(refresh)})
+        self.assertEqual(res.status_code, 205)
+        self.assertEqual(
+            list(BlacklistedToken.objects.values_list('token__jti', flat=True)),
+            [refresh['jti']]
+        )
+
+    def test_logout_token_of_another_user(self):
+        other = User.objects.create(
+            username='jane',
+            alt_name='Janey',
+            email='jane@test.com'
+        )
+        res = self.client.post('/auth/logout/', {
+            'refresh': str(RefreshToken.for_user(other))
+        })
+        self.assertEqual(res.status_code, 400)
+        self.assertFalse(BlacklistedToken.objects.exists())
+
+
+class PruneTokensTests(TestCase):
+
+    def test_prune_expired_tokens(self):
+        user = User.objects.create(
+            username='john',
+            alt_name='Johnny',
+            email='john@test.com'
+        )
+        now = timezone.now()
+        OutstandingToken.objects.bulk_create([
+            OutstandingToken(
+                user=user,
+                jti=uuid.uuid4().hex,
+                token='token',
+                expires_at=now + datetime.timedelta(days=-1 if i < 25 else 1)
+            ) for i in range(30)
+        ])
+        BlacklistedToken.objects.bulk_create([
+            BlacklistedToken(token=token)
+            for token in OutstandingToken.objects.all()[::2]
+        ])
+
+        self.assertEqual(blacklist.prune_expired_tokens(chunk_size=10), 25)
+        self.assertEqual(OutstandingToken.objects.count(), 5)
+        self.assertFalse(OutstandingToken.objects.filter(expires_at__lte=now).exists())
+        self.assertEqual(BlacklistedToken.objects.count(), 2)
+
+    def test_command(self):
+        out = io.StringIO()
+        call_command('prune_tokens', stdout=out)
+        self.assertIn('0 expired tokens deleted', out.getvalue())
+
+
+@override_settings(TOKEN_BLACKLIST_CACHE=True)
+class BlacklistCacheTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        blacklist.blacklist_cache.reset()
+        self.user = User.objects.create(
+            username='john',
+            alt_name='Johnny',
+            email='john@test.com'
+        )
+
+    def refresh(self, token):
+        return self.client.post('/auth/login/refresh/', {'refresh': str(token)})
+
+    def test_not_blacklisted_without_queries(self):
+        token = blacklist.RefreshToken.for_user(self.user)
+        self.assertEqual(self.refresh(token).status_code, 200)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.refresh(token).status_code, 200)
+
+    def test_blacklisted_after_logout(self):
+        token = blacklist.RefreshToken.for_user(self.user)
+        self.assertEqual(self.refresh(token).status_code, 200)
+
+        self.client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/auth/logout/')
+        self.client.force_authenticate(None)
+        self.assertEqual(self.refresh(token).status_code, 401)
+
+    def test_blacklisted_with_token_blacklist(self):
+        token = blacklist.RefreshToken.for_user(self.user)
+        self.assertEqual(self.refresh(token).status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            token.blacklist()
+        self.assertEqual(self.refresh(token).status_code, 401)
+
+    def test_rows_committed_out_of_order(self):
+        tokens = [blacklist.RefreshToken.for_user(self.user) for _ in range(2)]
+        outstanding = [
+            OutstandingToken.objects.get(jti=token['jti']) for token in tokens
+        ]
+        # The later row commits and is loaded first
+        with self.captureOnCommitCallbacks(execute=True):
+            BlacklistedToken.objects.create(id=100, token=outstanding[1])
+        self.assertEqual(self.refresh(tokens[1]).status_code, 401)
+        with self.captureOnCommitCallbacks(execute=True):
+            row = BlacklistedToken.objects.create(id=50, token=outstanding[0])
+            BlacklistedToken.objects.filter(pk=row.pk).update(
+                blacklisted_at=row.blacklisted_at - datetime.timedelta(seconds=30)
+            )
+        self.assertEqual(self.refresh(tokens[0]).status_code, 401)
+
+    def test_logouts_load_the_new_rows_only(self):
+        tokens = [blacklist.RefreshToken.for_user(self.user) for _ in range(3)]
+        for token in tokens[:2]:
+            with self.captureOnCommitCallbacks(execute=True):
+                token.blacklist()
+            with CaptureQueriesContext(connection) as ctx:
+                self.assertEqual(self.refresh(token).status_code, 401)
+            loads = [q['sql'] for q in ctx.captured_queries if '"blacklisted_at"' in q['sql']]
+            self.assertEqual(len(loads), 1)
+        # The first logout loads the whole blacklist, the second one only
+        # the rows since the last one loaded
+        self.assertIn('"blacklisted_at" >=', loads[0])
+        self.assertEqual(self.refresh(tokens[2]).status_code, 200)
+
+    def test_invalidated_on_commit(self):
+        token = blacklist.RefreshToken.for_user(self.user)
+        self.assertEqual(self.refresh(token).status_code, 200)
+        with self.captureOnCommitCallbacks() as callbacks:
+            token.blacklist()
+            self.assertIsNone(cache.get(blacklist.VERSION_KEY))
+        self.assertEqual(len(callbacks), 1)
+
+    def test_pruned_tokens_reload_the_cache(self):
+        token = blacklist.RefreshToken.for_user(self.user)
+        token.blacklist()
+        self.assertTrue(blacklist.blacklist_cache.contains(token['jti']))
+        BlacklistedToken.objects.all().delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            blacklist.invalidate(deleted=True)
+        self.assertFalse(blacklist.blacklist_cache.contains(token['jti']))
+        self.assertEqual(blacklist.blacklist_cache.jtis, set())
+
+
+class StatelessJWTAuthenticationTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(
+            username='john',
+            alt_name='Johnny',
+            email='john@test.com',
+            is_staff=True
+        )
+        self.user.set_password('A-str0ng-pwd!')
+        self.user.save()
+
+    def authenticate(self, token):
+        request = APIRequestFactory().get(
+            '/api/users/',
+            HTTP_AUTHORIZATION='Bearer %s' % token
+        )
+        return StatelessJWTAuthentication().authenticate(request)[0]
+
+    def test_login_embeds_user_claims(self):
+        res = self.client.post('/auth/login/', {
+            'username': 'john',
+            'password': 'A-str0ng-pwd!'
+        })
+        self.assertEqual(res.status_code, 200)
+        with self.assertNumQueries(0):
+            user = self.authenticate(res.data['access'])
+            self.assertEqual(user.id, self.user.id)
+            self.assertEqual(user.uid, self.user.uid)
+            self.assertEqual(user.alt_name, 'Johnny')
+            self.assertEqual(user.username, 'john')
+            self.assertTrue(user.is_staff)
+            self.assertFalse(user.is_superuser)
+            self.assertTrue(user.is_authenticated)
+
+    def test_full_user_is_cached(self):
+        token = blacklist.RefreshToken.for_user(self.user).access_token
+        user = self.authenticate(token)
+        with self.assertNumQueries(1):
+            self.assertEqual(user.email, 'john@test.com')
+            self.assertEqual(self.authenticate(token).email, 'john@test.com')
+
+        self.user.email = 'johnny@test.com'
+        self.user.save()
+        self.assertEqual(self.authenticate(token).email, 'johnny@test.com')
+
+    def test_superuser(self):
+        self.user.is_superuser = True
+        self.user.save()
+        user = self.authenticate(blacklist.RefreshToken.for_user(self.user).access_token)
+        self.assertEqual(user.username, 'john')
+        self.assertTrue(user.is_superuser)
+        self.assertTrue(user.has_perm('entities.delete_entity'))
+        self.assertTrue(user.has_perms(['entities.add_entity', 'entities.change_entity']))
+        self.assertTrue(user.has_module_perms('entities'))
+
+    def test_group_permissions(self):
+        group = Group.objects.create(name='editors')
+        group.permissions.add(Permission.objects.get(codename='change_entity'))
+        self.user.groups.add(group)
+        user = self.authenticate(blacklist.RefreshToken.for_user(self.user).access_token)
+        self.assertEqual(list(user.groups.all()), [group])
+        self.assertTrue(user.has_perm('entities.change_entity'))
+        self.assertFalse(user.has_perm('entities.delete_entity'))
+        self.assertEqual(user.get_all_permissions(), {'entities.change_entity'})
+
+    def test_token_without_user_claims(self):
+        token = blacklist.RefreshToken.for_user(self.user).access_token
+        del token['username']
+        self.assertEqual(self.authenticate(token).username, 'john')
+
+    def test_password_is_not_cached(self):
+        token = blacklist.RefreshToken.for_user(self.user).access_token
+        self.authenticate(token).email
+        cached = cache.get(USER_CACHE_KEY % self.user.pk)
+        self.assertIn('password', cached.get_deferred_fields())
+
+    def test_check_password(self):
+        token = blacklist.RefreshToken.for_user(self.user).access_token
+        user = self.authenticate(token)
+        self.assertTrue(user.check_password('A-str0ng-pwd!'))
+        self.assertFalse(user.check_password('wrong'))
+
+
+class UniquenessTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(
+            username='john',
+            alt_name='Johnny',
+            email='john@test.com'
+        )
+
+    def register_data(self, **kwargs):
+        data = {
+            'username': 'jane',
+            'email': 'jane@test.com',
+            'alt_name': 'Janey',
+            'password': 'A-str0ng-pwd!',
+            'password2': 'A-str0ng-pwd!'
+        }
+        data.update(kwargs)
+        return data
+
+    def test_register_validation_single_query(self):
+        serializer = RegisterSerializer(data=self.register_data())
+        with self.assertNumQueries(1):
+            self.assertTrue(serializer.is_valid())
+
+    def test_register_reports_every_conflict(self):
+        serializer = RegisterSerializer(data=self.register_data(
+            username='john',
+            email='john@test.com',
+            alt_name='JOHNNY'
+        ))
+        with self.assertNumQueries(1):
+            self.assertFalse(serializer.is_valid())
+        self.assertEqual(
+            set(serializer.errors),
+            {'username', 'email', 'alt_name'}
+        )
+
+    def test_alt_name_unique_ignoring_case(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            User.objects.create(username='jane', alt_name='johnny', email='jane@test.com')
+
+    def test_update_excludes_the_user(self):
+        User.objects.create(username='jane', alt_name='Janey', email='jane@test.com')
+        request = APIRequestFactory().patch('/')
+        request.user = self.user
+        serializer = UpdateUserSerializer(
+            self.user,
+            data={'username': 'john', 'alt_name': 'janey'},
+            partial=True,
+            context={'request': request}
+        )
+        with self.assertNumQueries(1):
+            self.assertFalse(serializer.is_valid())
+        self.assertEqual(set(serializer.errors), {'alt_name'})
+
+
+class LoginViewTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(
+            username='john',
+            alt_name='Johnny',
+            email='john@test.com',
+            password=make_password('A-str0ng-pwd!', hasher='pbkdf2_sha1')
+        )
+
+    def login(self, password):
+        return self.client.post('/auth/login/', {
+            'username': 'john', 'password': password
+        })
+
+    def test_login_and_refresh(self):
+        self.assertEqual(self.login('wrong').status_code, 401)
+        res = self.login('A-str0ng-pwd!')
+        self.assertEqual(res.status_code, 200)
+        # Hashed again with the default hasher
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$'))
+
+        res = self.client.post('/auth/login/refresh/', {'refresh': res.data['refresh']})
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('access', res.data)
+        res = self.client.post('/auth/login/refresh/', {'refresh': 'invalid'})
+        self.assertEqual(res.status_code, 401)
+
+    def test_inactive_user(self):
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.login('A-str0ng-pwd!').status_code, 401)
+
+    @override_settings(PASSWORD_HASH_ITERATIONS=1000)
+    def test_hash_iterations_upgraded(self):
+        self.assertEqual(self.login('A-str0ng-pwd!').status_code, 200)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$1000$'))
+
+    def test_busy_hashing(self):
+        release = threading.Event()
+        service = hashing.HashingService(workers=1, queue_size=0)
+        service.submit(release.wait)
+        with mock.patch.object(hashing, 'service', service):
+            res = self.login('A-str0ng-pwd!')
+        release.set()
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(res['Retry-After'], '1')
+
+
+class HashingServiceTests(SimpleTestCase):
+
+    def test_queue_limit_and_metrics(self):
+        release = threading.Event()
+        service = hashing.HashingService(workers=1, queue_size=1)
+        first = service.submit(release.wait)
+        second = service.submit(lambda: 'hash')
+        self.assertEqual(service.metrics()['queue_depth'], 1)
+        with self.assertRaises(hashing.HashingBusy):
+            service.submit(lambda: 'hash')
+
+        release.set()
+        first.result()
+        self.assertEqual(second.result(), 'hash')
+        metrics = service.metrics()
+        self.assertEqual(metrics['completed'], 2)
+        self.assertEqual(metrics['rejected'], 1)
+        self.assertEqual(metrics['queue_depth'], 0)
+        self.assertIsNotNone(metrics['latency']['p95'])
+
+
+@mock.patch.object(SlidingWindowThrottle, 'THROTTLE_RATES', {
+    'auth_ip': '5/min', 'auth_account': '2/min', 'auth_email': '1/hour'
+})
+class ThrottlingTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        User.objects.create(username='john', alt_name='Johnny', email='john@test.com')
+
+    def login(self, username):
+        return self.client.post('/auth/login/', {
+            'username': username, 'password': 'wrong'
+        })
+
+    def test_login_per_account_and_ip(self):
+        self.assertEqual(self.login('john').status_code, 401)
+        self.assertEqual(self.login('JOHN').status_code, 401)
+        with mock.patch.object(hashing.service, 'submit') as submit:
+            res = self.login('john')
+        # Rejected before checking the password
+        self.assertEqual(res.status_code, 429)
+        self.assertTrue(0 < int(res['Retry-After']) <= 60)
+        submit.assert_not_called()
+
+        self.assertEqual(self.login('jane').status_code, 401)
+        self.assertEqual(self.login('mary').status_code, 401)
+        self.assertEqual(self.login('anne').status_code, 429)
+
+    def test_forgot_password_per_email(self):
+        res = self.client.post('/auth/forgot-password/', {'email': 'john@test.com'})
+        self.assertEqual(res.status_code, 200)
+        res = self.client.post('/auth/forgot-password/', {'email': 'John@test.com '})
+        self.assertEqual(res.status_code, 429)
+        self.assertEqual(OutboundEmail.objects.count(), 1)
+
+    def test_sliding_window(self):
+        class KeyThrottle(SlidingWindowThrottle):
+            scope = 'auth_account'
+
+            def get_key(self, request, view):
+                return 'key'
+
+        throttle = KeyThrottle()
+
+        def allow(at):
+            with mock.patch.object(throttle, 'timer', return_value=at):
+                return throttle.allow_request(None, None)
+
+        self.assertTrue(allow(6000))
+        self.assertTrue(allow(6030))
+        self.assertFalse(allow(6059))
+        # The previous window weights 2 * 3/4
+        self.assertTrue(allow(6075))
+        # 2 * 2/3 + 1
+        self.assertFalse(allow(6080))
+        self.assertAlmostEqual(throttle.wait(), 10)
+        self.assertTrue(allow(6091))
+
+
+class EmailRenderTests(SimpleTestCase):
+
+    def test_render_many(self):
+        request = APIRequestFactory().get('/', HTTP_HOST='api.test.com')
+        users = [User(username='john'), User(username='jane')]
+        expected = [
+            loader.render_to_string('emails/password_reset.html', {
+                'user': user,
+                'protocol': 'http://',
+                'domain': 'api.test.com',
+                'app_title': 'my app',
+                'url_reset': '/reset/%s/' % user.username
+            }) for user in users
+        ]
+        contexts = [
+            {'user': user, 'url_reset': '/reset/%s/' % user.username}
+            for user in users
+        ]
+        with override_settings(PROTOCOL='http://', APP_TITLE='my app'):
+            self.assertEqual(
+                emails.render_many(request, 'emails/password_reset.html', contexts),
+                expected
+            )
+            with mock.patch.object(loader, 'get_template') as get_template:
+                self.assertEqual(
+                    emails.render(request, 'emails/password_reset.html', contexts[1]),
+                    expected[1]
+                )
+            get_template.assert_not_called()
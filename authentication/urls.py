@@ -6,13 +6,15 @@ from authentication.views import (
   UpdateProfileView,
   ForgotPasswordRequest,
   ResetPasswordRequest,
-  LogoutView
+  LogoutView,
+  TokenObtainPairView,
+  HashingMetricsView
 )
 from rest_framework_simplejwt import views as jwt_views
 
 
 urlpatterns = [
-    path('login/', jwt_views.TokenObtainPairView.as_view(),
+    path('login/', TokenObtainPairView.as_view(),
          name='token_obtain_pair'),
     path('login/refresh/', jwt_views.TokenRefreshView.as_view(),
          name='token_refresh'),
@@ -29,4 +31,6 @@ urlpatterns = [
     path("reset-password/<uidb64>/<token>/", ResetPasswordRequest.as_view(),
          name="auth_reset_password"),
     path('logout/', LogoutView.as_view(), name='auth_logout'),
+    path('hashing-metrics/', HashingMetricsView.as_view(),
+         name='auth_hashing_metrics'),
 ]
@@ -1,12 +1,10 @@
 import base64
 from django.contrib.auth.models import Group
+from django.db.models import Prefetch
 from authentication.models import User
 from django.utils import http, encoding
 from django.contrib.auth import tokens
-from django.template import loader
-from django.core import mail, serializers
-from django.contrib.sites import shortcuts
-from django.conf import settings
+from django.core import serializers
 from rest_framework import (
     permissions,
     viewsets,
@@ -18,7 +16,14 @@ from rest_framework_simplejwt.token_blacklist.models import (
     OutstandingToken,
     BlacklistedToken
 )
-from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt import views as jwt_views
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from authentication import blacklist, emails, hashing, outbox
+from drfbasis.export import ExportMixin
+from drfbasis.fastlist import FastListMixin
+from drfbasis.pagination import HybridPagination
+from drfbasis.throttling import AccountThrottle, EmailThrottle, IPThrottle
+from authentication.blacklist import RefreshToken
 from authentication.serializers import (
     UserSerializer,
     GroupSerializer,
@@ -30,13 +35,23 @@ from authentication.serializers import (
 )
 
 
-class UserViewSet(viewsets.ModelViewSet):
+class UserPagination(HybridPagination):
+    ordering = ("-date_joined", "-id")
+
+
+class UserViewSet(FastListMixin, ExportMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows users to be viewed or edited.
     """
-    queryset = User.objects.all().order_by('-date_joined')
+    # Groups ordered as the fast list path returns them
+    queryset = User.objects.prefetch_related(
+        Prefetch('groups', queryset=Group.objects.order_by('id'))
+    ).order_by('-date_joined')
     serializer_class = UserSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = UserPagination
+    export_watermark = 'date_joined'
+    read_from_replica = True
 
     # method to get an user
     '''def get_object(self):
@@ -61,28 +76,30 @@ class GroupViewSet(viewsets.ModelViewSet):
     queryset = Group.objects.all()
     serializer_class = GroupSerializer
     permission_classes = [permissions.IsAuthenticated]
+    read_from_replica = True
 
 
 #CreateAPIView used for create-only endpoints only POST
 class RegisterView(generics.CreateAPIView):
     permission_classes = [permissions.AllowAny]
     serializer_class = RegisterSerializer
+    throttle_classes = [IPThrottle, AccountThrottle, EmailThrottle]
 
     def post(self, request):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
 
+        # Out of the try, it answers 503 when the hashing queue is full
+        password = hashing.make_password(serializer.validated_data['password'])
         try:
             user = User.objects.create(
                 username=serializer.validated_data['username'],
                 alt_name=serializer.validated_data['alt_name'],
-                i_alt_name=serializer.validated_data['alt_name'].lower(),
-                email=serializer.validated_data['email']
+                email=serializer.validated_data['email'],
+                password=password,
+                is_active=False
             )
-            user.set_password(serializer.validated_data['password'])
-            user.is_active = False
-            user.save()
-        except Exception:
+        except Exception as e:
             return response.Response({
                 "message":"An error happened creating the user: %s"
                 % e
@@ -90,20 +107,15 @@ class RegisterView(generics.CreateAPIView):
 
         token = tokens.PasswordResetTokenGenerator().make_token(user)
         user_idb64 = http.urlsafe_base64_encode(encoding.smart_bytes(user.id))
-        message = loader.render_to_string('emails/account_activation.html', {
+        message = emails.render(request, 'emails/account_activation.html', {
             'user': user,
-            'protocol': settings.PROTOCOL,
-            'domain': shortcuts.get_current_site(request).domain,
-            'app_title': settings.APP_TITLE,
             "url_reset": f"/auth/activate-account/{user_idb64}/{token}/"
         })
 
-        mail.send_mail(
+        outbox.enqueue(
             'Activate your account',
             message,
-            settings.DEFAULT_FROM_EMAIL,
-            [user.email],
-            fail_silently=False,
+            [user.email]
         )
 
         return response.Response({
@@ -182,32 +194,27 @@ class UpdateProfileView(generics.UpdateAPIView):
 class ForgotPasswordRequest(generics.GenericAPIView):
     permission_classes = []
     serializer_class = ForgotPasswordSerializer
+    throttle_classes = [IPThrottle, EmailThrottle]
 
     def post(self, request):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
 
         # Validated in serializer
-        users = User.objects.filter(email=serializer.data.get("email", ""))
-        user = users.first()
+        user = User.objects.filter(email=serializer.data.get("email", "")).first()
 
         token = tokens.PasswordResetTokenGenerator().make_token(user)
         user_idb64 = http.urlsafe_base64_encode(encoding.smart_bytes(user.id))
 
-        message = loader.render_to_string('emails/password_reset.html', {
+        message = emails.render(request, 'emails/password_reset.html', {
             'user': user,
-            'protocol': settings.PROTOCOL,
-            'domain': shortcuts.get_current_site(request).domain,
-            'app_title': settings.APP_TITLE,
             "url_reset": f"/auth/reset-password/{user_idb64}/{token}/"
         })
 
-        mail.send_mail(
+        outbox.enqueue(
             'Reset your password',
             message,
-            settings.DEFAULT_FROM_EMAIL,
-            [user.email],
-            fail_silently=False,
+            [user.email]
         )
 
         return response.Response({
@@ -218,6 +225,7 @@ class ForgotPasswordRequest(generics.GenericAPIView):
 class ResetPasswordRequest(generics.GenericAPIView):
     permission_classes = []
     serializer_class = ResetPasswordSerializer
+    throttle_classes = [IPThrottle, AccountThrottle]
 
     def post(self, request, uidb64, token):
         serializer = self.get_serializer(data=request.data)
@@ -232,12 +240,14 @@ class ResetPasswordRequest(generics.GenericAPIView):
                 }, status=status.HTTP_400_BAD_REQUEST)
 
             pwd = serializer.data.get("password")
-            user.set_password(pwd)
+            user.password = hashing.make_password(pwd)
             user.is_active = True
             user.save()
 
             # generate new token
             token = RefreshToken.for_user(user)
+        except hashing.HashingBusy:
+            raise
         except Exception as e:
             return response.Response({
                 "message":"An error happened trying to reset the password: %s"
@@ -253,11 +263,31 @@ class ResetPasswordRequest(generics.GenericAPIView):
 
 class LogoutView(generics.GenericAPIView):
     permission_classes = [permissions.IsAuthenticated]
+
     def post(self, request):
         try:
-            tokens = OutstandingToken.objects.filter(user_id=request.user.id)
-            for token in tokens:
-                t, _ = BlacklistedToken.objects.get_or_create(token=token)
+            # Only the refresh token sent is invalidated
+            if request.data.get("refresh"):
+                # Checks the blacklist
+                token = RefreshToken(request.data["refresh"])
+                if token[jwt_settings.USER_ID_CLAIM] != request.user.id:
+                    return response.Response({
+                        "message": "The token does not belong to the user"
+                    }, status=status.HTTP_400_BAD_REQUEST)
+                token.blacklist()
+                return response.Response(status=status.HTTP_205_RESET_CONTENT)
+
+            # Otherwise every token of the user not blacklisted yet
+            token_ids = OutstandingToken.objects.filter(
+                user_id=request.user.id,
+                blacklistedtoken__isnull=True
+            ).values_list("id", flat=True)
+            BlacklistedToken.objects.bulk_create(
+                [BlacklistedToken(token_id=token_id) for token_id in token_ids],
+                ignore_conflicts=True
+            )
+            # bulk_create does not send post_save signals
+            blacklist.invalidate()
             return response.Response(status=status.HTTP_205_RESET_CONTENT)
         except Exception as e:
             return response.Response(
@@ -265,3 +295,15 @@ class LogoutView(generics.GenericAPIView):
                  "An error happened invalidating the token: %s" % e},
                 status=status.HTTP_400_BAD_REQUEST
             )
+
+
+class TokenObtainPairView(jwt_views.TokenObtainPairView):
+    """Login, checking the password in the hashing service"""
+    throttle_classes = [IPThrottle, AccountThrottle]
+
+
+class HashingMetricsView(generics.GenericAPIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return response.Response(hashing.service.metrics())
@@ -0,0 +1,121 @@
+"""
+Benchmarks of the API hot paths.
+
+Run them as modules from the project root, e.g.
+`python -m benchmarks.serializers`. They create and destroy a test
+database on the configured database server, as `manage.py test` does.
+
+Each run is compared with the last one saved in `benchmarks/results/`,
+flagging the rows more than REGRESSION_THRESHOLD percent slower. Add
+`--save` to record the run.
+"""
+import datetime
+import json
+import os
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+REGRESSION_THRESHOLD = 10
+
+
+def setup():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'drfbasis.settings')
+    import django
+    django.setup()
+
+
+@contextmanager
+def test_database():
+    from django.db import connection
+    from django.test.utils import (
+        setup_test_environment,
+        teardown_test_environment
+    )
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+def timeit(func, number=None, duration=1.0):
+    """
+    Run `func` `number` times (or for about `duration` seconds) and return
+    the mean seconds per call.
+    """
+    func()  # warm up
+    if number is None:
+        start = time.perf_counter()
+        number = 0
+        while time.perf_counter() - start < duration:
+            func()
+            number += 1
+        return (time.perf_counter() - start) / number
+
+    start = time.perf_counter()
+    for _ in range(number):
+        func()
+    return (time.perf_counter() - start) / number
+
+
+def args():
+    """Positional command line arguments"""
+    return [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+
+
+def results_path(name):
+    return os.path.join(RESULTS_DIR, "%s.jsonl" % name)
+
+
+def last_results(name, title):
+    if not os.path.exists(results_path(name)):
+        return {}
+    results = {}
+    with open(results_path(name)) as f:
+        for line in f:
+            record = json.loads(line)
+            if record["title"] == title:
+                results = record["results"]
+    return results
+
+
+def save_results(name, title, rows):
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    with open(results_path(name), "a") as f:
+        f.write(json.dumps({
+            "date": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "commit": commit,
+            "title": title,
+            "results": dict(rows),
+        }) + "\n")
+
+
+def report(title, rows, name=None):
+    """
+    Print the rows, compared with the last saved results of the `name`
+    benchmark when given
+    """
+    previous = last_results(name, title) if name else {}
+    print(title)
+    for label, seconds in rows:
+        line = "  %-40s %10.3f ms" % (label, seconds * 1000)
+        if previous.get(label):
+            change = (seconds - previous[label]) / previous[label] * 100
+            line += "  %+6.1f%%" % change
+            if change > REGRESSION_THRESHOLD:
+                line += "  REGRESSION"
+        print(line)
+    if name and "--save" in sys.argv:
+        save_results(name, title, rows)
@@ -0,0 +1,57 @@
+"""
+Cost of the database connection per request: a new connection per request
+(`CONN_MAX_AGE = 0`), persistent connections with health checks and, on
+PostgreSQL, the pool of `drfbasis.db.postgresql_pool`.
+
+    python -m benchmarks.connections
+"""
+from benchmarks import report, setup, timeit
+
+
+def wrapper(engine=None, **options):
+    from django.db import connection
+    from django.db.utils import load_backend
+
+    settings_dict = {**connection.settings_dict, **options}
+    if engine:
+        settings_dict['ENGINE'] = engine
+    backend = load_backend(settings_dict['ENGINE'])
+    return backend.DatabaseWrapper(settings_dict, alias='benchmark')
+
+
+def run():
+    from django.db import connection
+
+    modes = [
+        ('new connection per request', wrapper(CONN_MAX_AGE=0)),
+        ('persistent, health checks', wrapper(
+            CONN_MAX_AGE=600, CONN_HEALTH_CHECKS=True
+        )),
+    ]
+    if connection.vendor == 'postgresql':
+        modes.append(('pool', wrapper(
+            'drfbasis.db.postgresql_pool', CONN_MAX_AGE=0,
+            CONN_HEALTH_CHECKS=False
+        )))
+        modes.append(('pool, health checks', wrapper(
+            'drfbasis.db.postgresql_pool', CONN_MAX_AGE=0,
+            CONN_HEALTH_CHECKS=True
+        )))
+
+    rows = []
+    for label, db in modes:
+        def request():
+            # What the request_started and request_finished signals do
+            db.close_if_unusable_or_obsolete()
+            with db.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            db.close_if_unusable_or_obsolete()
+
+        rows.append((label, timeit(request)))
+        db.close()
+    report('Query per request on %s' % connection.vendor, rows, 'connections')
+
+
+if __name__ == '__main__':
+    setup()
+    run()
@@ -0,0 +1,53 @@
+"""
+Render step of the account emails: `render_to_string` with the site
+resolved per call, as the views did, against `authentication.emails`.
+
+    python -m benchmarks.emails
+"""
+from benchmarks import report, setup, timeit
+
+TEMPLATE = 'emails/account_activation.html'
+BATCH = 100
+
+
+def run():
+    from django.conf import settings
+    from django.contrib.sites import shortcuts
+    from django.template import loader
+    from rest_framework.test import APIRequestFactory
+    from authentication import emails
+    from authentication.models import User
+
+    request = APIRequestFactory().get('/', HTTP_HOST='api.test.com')
+    users = [User(id=i, username=f'user{i}') for i in range(BATCH)]
+    contexts = [
+        {'user': user, 'url_reset': f'/auth/activate-account/{user.id}/token/'}
+        for user in users
+    ]
+
+    def render_to_string():
+        for context in contexts:
+            loader.render_to_string(TEMPLATE, {
+                **context,
+                'protocol': settings.PROTOCOL,
+                'domain': shortcuts.get_current_site(request).domain,
+                'app_title': settings.APP_TITLE,
+            })
+
+    def render():
+        for context in contexts:
+            emails.render(request, TEMPLATE, context)
+
+    def render_many():
+        emails.render_many(request, TEMPLATE, contexts)
+
+    report('%d emails' % BATCH, [
+        ('render_to_string + get_current_site', timeit(render_to_string)),
+        ('emails.render', timeit(render)),
+        ('emails.render_many', timeit(render_many)),
+    ], 'emails')
+
+
+if __name__ == '__main__':
+    setup()
+    run()
@@ -0,0 +1,82 @@
+"""
+Load test of the API with locust, against a running server filled with the
+`seed_data` command:
+
+    python manage.py seed_data --users 1000 --entities 10000
+    gunicorn drfbasis.wsgi -w 4
+    pip install locust
+    locust -f benchmarks/locustfile.py --host http://localhost:8000
+
+Throttling limits the logins per IP, raise its rates for the run, e.g.
+`THROTTLE_AUTH_IP=100000/min THROTTLE_AUTH_EMAIL=100000/min`.
+"""
+import base64
+import json
+import random
+import uuid
+
+from locust import HttpUser, between, task
+
+USERS = 1000
+PREFIX = 'seed'
+PASSWORD = 'seed-password'
+
+
+def user_id(access):
+    payload = access.split('.')[1]
+    payload += '=' * (-len(payload) % 4)
+    return json.loads(base64.urlsafe_b64decode(payload))['user_id']
+
+
+class ApiUser(HttpUser):
+    wait_time = between(0.5, 2)
+    weight = 10
+
+    def on_start(self):
+        username = '%s%d' % (PREFIX, random.randrange(USERS))
+        res = self.client.post('/auth/login/', json={
+            'username': username, 'password': PASSWORD
+        })
+        tokens = res.json()
+        self.refresh = tokens['refresh']
+        self.client.headers['Authorization'] = 'Bearer ' + tokens['access']
+        self.author = '%s/api/users/%d/' % (self.host, user_id(tokens['access']))
+
+    def on_stop(self):
+        self.client.post('/auth/logout/', json={'refresh': self.refresh})
+
+    @task(10)
+    def list_entities(self):
+        self.client.get('/api/entities/?page=%d' % random.randint(1, 10),
+                        name='/api/entities/')
+
+    @task(2)
+    def search_entities(self):
+        self.client.get('/api/entities/?search=entity %d' % random.randrange(1000),
+                        name='/api/entities/?search')
+
+    @task(1)
+    def create_entity(self):
+        uid = uuid.uuid4().hex
+        self.client.post('/api/entities/', json={
+            'name': 'load ' + uid[:8],
+            'link': 'https://load.test/' + uid,
+            'author': self.author
+        })
+
+
+class NewUser(HttpUser):
+    """Registrations, the password hashing and the email outbox"""
+    wait_time = between(5, 15)
+    weight = 1
+
+    @task
+    def register(self):
+        uid = uuid.uuid4().hex[:12]
+        self.client.post('/auth/register/', json={
+            'username': 'load' + uid,
+            'alt_name': 'load' + uid,
+            'email': 'load%s@load.test' % uid,
+            'password': 'A-str0ng-pwd!',
+            'password2': 'A-str0ng-pwd!'
+        })
@@ -0,0 +1,57 @@
+"""
+Compare the ranked search of `drfbasis.search` with the plain `icontains`
+scan it replaces, over 1M entities by default.
+
+    python -m benchmarks.search [rows] [--save]
+"""
+from benchmarks import args, report, setup, test_database, timeit
+
+ROWS = 1000000
+BATCH = 10000
+TERMS = ('entity 4242', 'alpha', 'test.com/99999')
+
+
+def seed(n):
+    from authentication.models import User
+    from entities.models import Entity
+
+    author = User.objects.create(username='author', email='author@test.com')
+    for start in range(0, n, BATCH):
+        Entity.objects.bulk_create([
+            Entity(
+                uid=f'uid-{i}',
+                name=f'entity {i}',
+                link=f'https://test.com/{i}',
+                views=i,
+                author=author
+            ) for i in range(start, min(start + BATCH, n))
+        ])
+    Entity.objects.create(
+        uid='uid-alpha', name='alpha', link='https://alpha.com', author=author
+    )
+
+
+def run(rows):
+    from drfbasis.search import contains_filter, search
+    from entities.models import Entity
+
+    seed(rows)
+    fields = ('name', 'link')
+    queryset = Entity.objects.all()
+    results = []
+    for term in TERMS:
+        def indexed():
+            list(search(queryset, term)[:20])
+
+        def scan():
+            list(queryset.filter(contains_filter(fields, term))[:20])
+
+        results.append(("%r search" % term, timeit(indexed, number=5)))
+        results.append(("%r icontains" % term, timeit(scan, number=5)))
+    report("Entity search, %d rows" % rows, results, "search")
+
+
+if __name__ == '__main__':
+    setup()
+    with test_database():
+        run(int(args()[0]) if args() else ROWS)
@@ -0,0 +1,77 @@
+"""
+Compare the default serializer path with the fast list path of
+`drfbasis.fastlist` for pages of 20, 200 and 2000 rows.
+
+    python -m benchmarks.serializers
+"""
+from benchmarks import report, setup, test_database, timeit
+
+SIZES = (20, 200, 2000)
+
+
+def seed(n):
+    from django.contrib.auth.models import Group
+    from authentication.models import User
+    from entities.models import Entity
+
+    groups = Group.objects.bulk_create([Group(name=f'group{i}') for i in range(3)])
+    users = User.objects.bulk_create([
+        User(
+            uid=f'uid-{i}',
+            username=f'user{i}',
+            alt_name=f'user{i}',
+            email=f'user{i}@test.com'
+        ) for i in range(n)
+    ])
+    User.groups.through.objects.bulk_create([
+        User.groups.through(user_id=user.pk, group_id=group.pk)
+        for user in users for group in groups[:user.pk % 3]
+    ])
+    Entity.objects.bulk_create([
+        Entity(
+            uid=f'uid-{i}',
+            name=f'entity {i}',
+            link=f'https://test.com/{i}',
+            views=i,
+            author=users[i % len(users)]
+        ) for i in range(n)
+    ])
+
+
+def run():
+    from django.core.cache import cache
+    from django.test import override_settings
+    from rest_framework.test import APIRequestFactory, force_authenticate
+    from authentication.models import User
+    from authentication.views import UserViewSet
+    from entities.views import EntityViewSet
+
+    factory = APIRequestFactory()
+    seed(max(SIZES))
+    user = User.objects.first()
+
+    for viewset, url in ((EntityViewSet, '/api/entities/'),
+                         (UserViewSet, '/api/users/')):
+        view = viewset.as_view({'get': 'list'})
+        rows = []
+        for size in SIZES:
+            for fast in (False, True):
+                def call():
+                    cache.clear()
+                    request = factory.get(url)
+                    force_authenticate(request, user)
+                    view(request).render()
+
+                viewset.pagination_class.page_size = size
+                with override_settings(FAST_LIST_SERIALIZATION=fast):
+                    rows.append((
+                        "%d rows %s" % (size, "fast" if fast else "serializer"),
+                        timeit(call)
+                    ))
+        report(viewset.__name__, rows, 'serializers')
+
+
+if __name__ == '__main__':
+    setup()
+    with test_database():
+        run()
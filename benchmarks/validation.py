@@ -0,0 +1,72 @@
+"""
+Validations per second of an entity payload: the serializer with the
+default DRF fields and unique validator, and `EntitySerializer` with the
+cached link validation and the Bloom filter of the links.
+
+    python -m benchmarks.validation [--save]
+"""
+from benchmarks import report, setup, test_database, timeit
+
+ENTITIES = 10000
+
+
+def run():
+    import io
+    import itertools
+    from django.core.management import call_command
+    from rest_framework import serializers
+    from authentication.models import User
+    from entities.models import Entity
+    from entities.serializers import EntitySerializer
+    from drfbasis.relations import HyperlinkedModelSerializer
+    from entities.validation import link_filter
+
+    class DefaultEntitySerializer(HyperlinkedModelSerializer):
+        class Meta:
+            model = Entity
+            fields = ['name', 'author', 'views', 'link']
+
+        def validate_name(self, value):
+            if ' ' not in value.lower():
+                raise serializers.ValidationError("error message")
+            return value
+
+        def validate(self, data):
+            if int(data.get('views', 0)) < 0:
+                raise serializers.ValidationError("finish must occur after start")
+            return data
+
+    call_command('seed_data', users=10, entities=ENTITIES, stdout=io.StringIO())
+    user = User.objects.first()
+    author = 'http://testserver/api/users/%d/' % user.pk
+    existing = Entity.objects.values_list('link', flat=True).first()
+    link_filter.get_filter()
+    counter = itertools.count()
+
+    def validate(serializer_class, link=None):
+        def call():
+            payload = {
+                'name': 'bench entity',
+                'author': author,
+                'views': 10,
+                'link': link or 'https://bench.test/%d' % next(counter)
+            }
+            serializer = serializer_class(data=payload)
+            assert serializer.is_valid() is (link is None), serializer.errors
+        return call
+
+    rows = [
+        ('new link, default', timeit(validate(DefaultEntitySerializer))),
+        ('new link, filter', timeit(validate(EntitySerializer))),
+        ('existing link, default', timeit(validate(DefaultEntitySerializer, existing))),
+        ('existing link, filter', timeit(validate(EntitySerializer, existing))),
+    ]
+    report('Entity validation, %d links' % ENTITIES, rows, 'validation')
+    for label, seconds in rows:
+        print('  %-40s %10.0f /s' % (label, 1 / seconds))
+
+
+if __name__ == '__main__':
+    setup()
+    with test_database():
+        run()
@@ -0,0 +1,92 @@
+"""
+Latency of the API hot paths through the full request stack: login,
+register, entity list and create, and logout. The database is filled with
+the `seed_data` command. Throttling is disabled.
+
+    python -m benchmarks.views [--save]
+"""
+import io
+import itertools
+
+from benchmarks import report, setup, test_database, timeit
+
+USERS = 1000
+ENTITIES = 10000
+PASSWORD = 'seed-password'
+CALLS = 20
+
+
+def run():
+    from unittest import mock
+    from django.core.cache import cache
+    from django.core.management import call_command
+    from rest_framework.test import APIClient
+    from authentication.blacklist import RefreshToken
+    from authentication.models import User
+    from drfbasis.throttling import SlidingWindowThrottle
+
+    call_command(
+        'seed_data', users=USERS, entities=ENTITIES, password=PASSWORD,
+        stdout=io.StringIO()
+    )
+    user = User.objects.get(username='seed0')
+    client = APIClient()
+    counter = itertools.count()
+
+    def login():
+        res = client.post('/auth/login/', {'username': 'seed0', 'password': PASSWORD})
+        assert res.status_code == 200, res.status_code
+
+    def register():
+        i = next(counter)
+        res = client.post('/auth/register/', {
+            'username': f'bench{i}',
+            'alt_name': f'bench{i}',
+            'email': f'bench{i}@test.com',
+            'password': 'A-str0ng-pwd!',
+            'password2': 'A-str0ng-pwd!'
+        })
+        assert res.status_code == 202, res.status_code
+
+    def entity_list():
+        cache.clear()
+        res = client.get('/api/entities/')
+        assert res.status_code == 200, res.status_code
+
+    def entity_list_cached():
+        res = client.get('/api/entities/')
+        assert res.status_code == 200, res.status_code
+
+    def entity_create():
+        i = next(counter)
+        res = client.post('/api/entities/', {
+            'name': f'bench entity {i}',
+            'link': f'https://bench.test/{i}',
+            'author': f'http://testserver/api/users/{user.pk}/'
+        })
+        assert res.status_code == 201, res.status_code
+
+    refresh_tokens = [str(RefreshToken.for_user(user)) for _ in range(CALLS + 1)]
+
+    def logout():
+        res = client.post('/auth/logout/', {'refresh': refresh_tokens.pop()})
+        assert res.status_code == 205, res.status_code
+
+    rows = []
+    with mock.patch.object(SlidingWindowThrottle, 'THROTTLE_RATES', {
+        'auth_ip': None, 'auth_account': None, 'auth_email': None
+    }):
+        rows.append(('login', timeit(login, number=CALLS)))
+        rows.append(('register', timeit(register, number=CALLS)))
+        client.force_authenticate(user)
+        rows.append(('entity list', timeit(entity_list)))
+        rows.append(('entity list, cached', timeit(entity_list_cached)))
+        rows.append(('entity create', timeit(entity_create, number=CALLS)))
+        rows.append(('logout', timeit(logout, number=CALLS)))
+    report('API views, %d users, %d entities' % (USERS, ENTITIES), rows, 'views')
+
+
+if __name__ == '__main__':
+    setup()
+    with test_database():
+        run()
@@ -12,5 +12,8 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'drfbasis.settings')
+# The sync code runs in a thread pool, share the connections between them.
+# Set DATABASE_POOL=0 to keep the per thread persistent connections
+os.environ.setdefault('DATABASE_POOL', '1')
 
 application = get_asgi_application()
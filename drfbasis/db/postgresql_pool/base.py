@@ -0,0 +1,114 @@
+"""
+PostgreSQL backend keeping a per process pool of connections.
+
+Django opens a connection per request and thread, and with `CONN_MAX_AGE`
+keeps it in that thread. The ASGI server runs the sync code in a thread
+pool, so those connections are not reused by the next requests. With this
+engine closing a connection returns it to a pool of up to
+`DATABASE_POOL_SIZE` connections shared by the threads of the process.
+When all of them are in use, getting one waits up to
+`DATABASE_POOL_TIMEOUT` seconds.
+"""
+import collections
+import threading
+
+import psycopg2
+from psycopg2 import extensions
+from django.conf import settings
+from django.db import OperationalError
+from django.db.backends.postgresql import base
+
+pools = {}
+pools_lock = threading.Lock()
+
+
+class ConnectionPool:
+
+    def __init__(self, connect, size, timeout):
+        self.connect = connect
+        self.timeout = timeout
+        self.slots = threading.BoundedSemaphore(size)
+        self.idle = collections.deque()
+        self.lock = threading.Lock()
+
+    def get(self, health_check=False):
+        if not self.slots.acquire(timeout=self.timeout):
+            raise OperationalError(
+                "No database connection available after %ss" % self.timeout
+            )
+        try:
+            while True:
+                with self.lock:
+                    connection = self.idle.pop() if self.idle else None
+                if connection is None:
+                    return self.connect()
+                if self.usable(connection, health_check):
+                    return connection
+                connection.close()
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def put(self, connection, discard=False):
+        try:
+            if not discard and not connection.closed:
+                status = connection.info.transaction_status
+                if status != extensions.TRANSACTION_STATUS_IDLE:
+                    connection.rollback()
+                with self.lock:
+                    self.idle.append(connection)
+                return
+            connection.close()
+        except psycopg2.Error:
+            connection.close()
+        finally:
+            self.slots.release()
+
+    @staticmethod
+    def usable(connection, health_check):
+        if connection.closed:
+            return False
+        if not health_check:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            return True
+        except psycopg2.Error:
+            return False
+
+    def clear(self):
+        with self.lock:
+            while self.idle:
+                self.idle.pop().close()
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def get_pool(self):
+        pool = pools.get(self.alias)
+        if pool is None:
+            with pools_lock:
+                pool = pools.get(self.alias)
+                if pool is None:
+                    pool = pools[self.alias] = ConnectionPool(
+                        super().get_new_connection,
+                        settings.DATABASE_POOL_SIZE,
+                        settings.DATABASE_POOL_TIMEOUT
+                    )
+        return pool
+
+    def get_new_connection(self, conn_params):
+        connection = self.get_pool().get(self.settings_dict["CONN_HEALTH_CHECKS"])
+        options = self.settings_dict["OPTIONS"]
+        self.isolation_level = options.get(
+            "isolation_level", connection.isolation_level
+        )
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            # A connection closed in the middle of a transaction block is
+            # still used by it, so it isn't shared
+            with self.wrap_database_errors:
+                self.get_pool().put(self.connection, discard=self.in_atomic_block)
@@ -0,0 +1,149 @@
+"""
+Read-only fast path for list endpoints.
+
+Instead of building a model instance per row and running every serializer
+field through `get_attribute`, the rows are read with `.values()` for the
+columns the serializer declares and the output is built in one pass. The
+field `to_representation` methods are still used for every value, so the
+output is the same as the serializer's one.
+"""
+from django.conf import settings
+from django.db import models
+from rest_framework import fields as drf_fields, relations, response
+from rest_framework.relations import PKOnlyObject
+
+
+class ListPlan:
+    """
+    How to build the representation of the rows of a serializer from
+    `.values()`. `build` returns None when a field can't be read that way
+    (nested serializers, method fields, dotted sources...).
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.columns = []
+        # (name, column, field, kind) in the serializer order
+        self.fields = []
+        # name: (through model, source field, target field)
+        self.many = {}
+
+    @classmethod
+    def build(cls, serializer):
+        model = serializer.Meta.model
+        plan = cls(model)
+        pk_column = model._meta.pk.attname
+        for field in serializer._readable_fields:
+            if isinstance(field, relations.HyperlinkedIdentityField):
+                if field.lookup_field != "pk":
+                    return None
+                plan.add(field, pk_column, "related")
+                continue
+
+            source = field.source
+            if source == "*" or "." in source:
+                return None
+            try:
+                model_field = model._meta.get_field(source)
+            except Exception:
+                return None
+
+            if isinstance(field, relations.ManyRelatedField):
+                child = field.child_relation
+                if (not isinstance(model_field, models.ManyToManyField)
+                        or not child.use_pk_only_optimization()):
+                    return None
+                plan.many[field.field_name] = (
+                    model_field.remote_field.through,
+                    model_field.m2m_field_name(),
+                    model_field.m2m_reverse_field_name()
+                )
+                plan.add(child, pk_column, "many", field.field_name)
+            elif isinstance(field, relations.RelatedField):
+                if (not model_field.many_to_one
+                        or not field.use_pk_only_optimization()):
+                    return None
+                plan.add(field, model_field.attname, "related")
+            elif isinstance(field, drf_fields.Field) and model_field.concrete:
+                if isinstance(field, drf_fields.SerializerMethodField):
+                    return None
+                plan.add(field, model_field.attname, "value")
+            else:
+                return None
+        return plan
+
+    def add_column(self, column):
+        if column not in self.columns:
+            self.columns.append(column)
+
+    def add(self, field, column, kind, name=None):
+        self.add_column(column)
+        self.fields.append((name or field.field_name, column, field, kind))
+
+    def render(self, rows):
+        rows = list(rows)
+        pk_column = self.model._meta.pk.attname
+        related = {}
+        for name, (through, source, target) in self.many.items():
+            # One query per many to many field for the whole page
+            related[name] = links = {}
+            values = (
+                through.objects
+                .filter(**{"%s__in" % source: [row[pk_column] for row in rows]})
+                .order_by(target)
+                .values_list(source, target)
+            )
+            for row_pk, target_pk in values:
+                links.setdefault(row_pk, []).append(target_pk)
+
+        data = []
+        for row in rows:
+            item = {}
+            for name, column, field, kind in self.fields:
+                value = row[column]
+                if kind == "many":
+                    item[name] = [
+                        field.to_representation(PKOnlyObject(pk=pk))
+                        for pk in related[name].get(value, [])
+                    ]
+                elif value is None:
+                    item[name] = None
+                elif kind == "related":
+                    item[name] = field.to_representation(PKOnlyObject(pk=value))
+                else:
+                    item[name] = field.to_representation(value)
+            data.append(item)
+        return data
+
+
+class FastListMixin:
+    """
+    Serve the list action through `ListPlan` when the serializer allows it.
+    Enabled with the `FAST_LIST_SERIALIZATION` setting.
+    """
+
+    def list(self, request, *args, **kwargs):
+        serializer = self.get_serializer()
+        plan = None
+        if settings.FAST_LIST_SERIALIZATION:
+            plan = ListPlan.build(serializer)
+        if plan is None:
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        # The keyset pagination reads its position from the rows, ordered
+        # by the paginator or by the ordering filter
+        ordering = list(getattr(self.paginator, "ordering", ())) + [
+            field for field in queryset.query.order_by if isinstance(field, str)
+        ]
+        for field in ordering:
+            plan.add_column(field.lstrip("-"))
+
+        rows = self.get_fast_list_rows(queryset, plan)
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(plan.render(page))
+        return response.Response(plan.render(rows))
+
+    def get_fast_list_rows(self, queryset, plan):
+        return queryset.prefetch_related(None).values(*plan.columns)
@@ -0,0 +1,28 @@
+"""
+Filter backends shared by the API viewsets.
+"""
+from rest_framework import filters
+
+
+class OrderingFilter(filters.OrderingFilter):
+    """
+    `?ordering=` with the primary key appended in the direction of the last
+    field: the order is total, so the pages don't overlap, and it matches
+    the `(field, id)` indexes.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        # A sliced queryset can't be reordered, it keeps its order
+        if queryset.query.is_sliced:
+            return queryset
+        return super().filter_queryset(request, queryset, view)
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        if not ordering:
+            return ordering
+        names = {field.lstrip("-") for field in ordering}
+        if names.isdisjoint(("pk", "id")):
+            direction = "-" if ordering[-1].startswith("-") else ""
+            ordering = list(ordering) + [direction + "id"]
+        return ordering
@@ -0,0 +1,191 @@
+"""
+Per request instrumentation.
+
+`InstrumentationMiddleware` records for every route the latency, the
+database queries and their time, and the time spent in serializers and
+template rendering. They are exposed at `/metrics` (`drfbasis.metrics`)
+and returned in a `Server-Timing` header to staff users, or to everyone
+when `DEBUG`.
+
+Staff users can profile a request sending the `X-Profile` header when
+`PROFILING_ENABLED`: the response is replaced by the cProfile stats of the
+thread serving it.
+"""
+import contextvars
+import cProfile
+import functools
+import io
+import math
+import pstats
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse
+from django.template.base import Template
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.serializers import BaseSerializer
+
+from drfbasis.fastlist import ListPlan
+from drfbasis.metrics import Histogram, registry
+
+PROFILE_HEADER = "HTTP_X_PROFILE"
+# Method labels, any other method is "other" so clients can't add series
+METHODS = frozenset(("GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"))
+
+REQUEST_DURATION = registry.register(Histogram(
+    "http_request_duration_seconds",
+    "Request latency by route",
+    ("route", "method", "status")
+))
+DB_QUERIES = registry.register(Histogram(
+    "http_request_db_queries",
+    "Database queries per request",
+    ("route",),
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 500, math.inf)
+))
+DB_DURATION = registry.register(Histogram(
+    "http_request_db_duration_seconds",
+    "Time running database queries per request",
+    ("route",)
+))
+SERIALIZER_DURATION = registry.register(Histogram(
+    "http_request_serializer_duration_seconds",
+    "Time serializing per request",
+    ("route",)
+))
+TEMPLATE_DURATION = registry.register(Histogram(
+    "http_request_template_duration_seconds",
+    "Time rendering templates per request",
+    ("route",)
+))
+
+
+class RequestStats:
+
+    def __init__(self):
+        self.queries = 0
+        self.db = 0.0
+        self.timers = {"serializer": 0.0, "template": 0.0}
+        # Kinds being timed, to time only the outer call of nested ones
+        self.active = set()
+
+
+request_stats = contextvars.ContextVar("request_stats", default=None)
+
+
+def query_wrapper(execute, sql, params, many, context):
+    stats = request_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.db += time.perf_counter() - start
+
+
+def timed(kind, func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        stats = request_stats.get()
+        if stats is None or kind in stats.active:
+            return func(*args, **kwargs)
+        stats.active.add(kind)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            stats.active.discard(kind)
+            stats.timers[kind] += time.perf_counter() - start
+    wrapper.instrumented = True
+    return wrapper
+
+
+def add_query_wrapper(connection, **kwargs):
+    if query_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(query_wrapper)
+
+
+def instrument():
+    """Wrap the database connections, serializers and templates, once"""
+    if getattr(Template.render, "instrumented", False):
+        return
+    connection_created.connect(add_query_wrapper)
+    for connection in connections.all():
+        add_query_wrapper(connection)
+    BaseSerializer.data = property(timed("serializer", BaseSerializer.data.fget))
+    ListPlan.render = timed("serializer", ListPlan.render)
+    Template.render = timed("template", Template.render)
+
+
+def is_staff(request):
+    user = getattr(request, "user", None)
+    if user is not None and user.is_authenticated:
+        return user.is_staff
+    # The JWT claims, without querying the user
+    from authentication.authentication import StatelessJWTAuthentication
+    try:
+        result = StatelessJWTAuthentication().authenticate(Request(request))
+    except APIException:
+        return False
+    return bool(result and result[0].is_staff)
+
+
+class InstrumentationMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        instrument()
+
+    def __call__(self, request):
+        stats = RequestStats()
+        token = request_stats.set(stats)
+        start = time.perf_counter()
+        try:
+            if (settings.PROFILING_ENABLED
+                    and PROFILE_HEADER in request.META
+                    and is_staff(request)):
+                response = self.profile(request)
+            else:
+                response = self.get_response(request)
+        finally:
+            request_stats.reset(token)
+        duration = time.perf_counter() - start
+
+        match = request.resolver_match
+        route = (match.view_name or match.route) if match else "unmatched"
+        method = request.method if request.method in METHODS else "other"
+        REQUEST_DURATION.observe(duration, route, method, str(response.status_code))
+        DB_QUERIES.observe(stats.queries, route)
+        DB_DURATION.observe(stats.db, route)
+        SERIALIZER_DURATION.observe(stats.timers["serializer"], route)
+        TEMPLATE_DURATION.observe(stats.timers["template"], route)
+
+        if settings.DEBUG or is_staff(request):
+            response["Server-Timing"] = ", ".join(
+                "%s;dur=%.1f" % (name, seconds * 1000) for name, seconds in (
+                    ("db", stats.db),
+                    ("serializer", stats.timers["serializer"]),
+                    ("template", stats.timers["template"]),
+                    ("total", duration),
+                )
+            )
+        return response
+
+    def profile(self, request):
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.disable()
+        output = io.StringIO()
+        stats = pstats.Stats(profiler, stream=output)
+        stats.sort_stats("cumulative").print_stats(settings.PROFILING_LINES)
+        profile = HttpResponse(output.getvalue(), content_type="text/plain")
+        profile["X-Profiled-Status"] = str(response.status_code)
+        return profile
@@ -0,0 +1,106 @@
+"""
+Minimal metrics registry with the Prometheus text exposition format.
+
+Metrics live in the memory of each process: with several workers, every
+scrape of `/metrics` returns the metrics of the worker serving it.
+"""
+import bisect
+import math
+import threading
+
+# Seconds
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, math.inf
+)
+
+
+def escape(value):
+    return str(value).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (n, escape(v)) for n, v in pairs)
+
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        if self.buckets[-1] != math.inf:
+            self.buckets += (math.inf,)
+        self.lock = threading.Lock()
+        # labels: [count per bucket..., sum]
+        self.values = {}
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            data = self.values.get(labels)
+            if data is None:
+                data = self.values[labels] = [0] * len(self.buckets) + [0.0]
+            data[index] += 1
+            data[-1] += value
+
+    def collect(self):
+        yield "# HELP %s %s" % (self.name, self.documentation)
+        yield "# TYPE %s histogram" % self.name
+        with self.lock:
+            values = {labels: list(data) for labels, data in self.values.items()}
+        for labels, data in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, data):
+                cumulative += count
+                yield "%s_bucket%s %d" % (
+                    self.name,
+                    format_labels(self.labelnames, labels, [("le", format_value(bound))]),
+                    cumulative
+                )
+            label_text = format_labels(self.labelnames, labels)
+            yield "%s_sum%s %s" % (self.name, label_text, format_value(data[-1]))
+            yield "%s_count%s %d" % (self.name, label_text, cumulative)
+
+
+class Gauge:
+    """Value read from `func` when collected"""
+
+    def __init__(self, name, documentation, func):
+        self.name = name
+        self.documentation = documentation
+        self.func = func
+
+    def collect(self):
+        yield "# HELP %s %s" % (self.name, self.documentation)
+        yield "# TYPE %s gauge" % self.name
+        value = self.func()
+        yield "%s %s" % (self.name, format_value(0 if value is None else value))
+
+
+class Registry:
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
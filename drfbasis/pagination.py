@@ -0,0 +1,276 @@
+"""
+Pagination classes shared by the API viewsets.
+"""
+import base64
+import datetime
+import json
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.paginator import EmptyPage, Page, PageNotAnInteger, Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+from rest_framework import pagination, response
+from rest_framework.exceptions import NotFound
+from rest_framework.utils.urls import replace_query_param
+
+from drfbasis.filters import OrderingFilter
+
+
+def estimate_count(queryset):
+    """
+    Number of rows of an unfiltered queryset from the PostgreSQL statistics
+    (`pg_class.reltuples`), kept up to date by autovacuum. Returns None when
+    there's no estimation available.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != "postgresql" or queryset.query.where:
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT reltuples FROM pg_class WHERE oid = %s::regclass",
+            [queryset.model._meta.db_table]
+        )
+        row = cursor.fetchone()
+    if not row or row[0] < 0:
+        # Never analyzed
+        return None
+    return int(row[0])
+
+
+class EstimatedCountPage(Page):
+    """Page whose neighbours are known from the rows read, not from the count"""
+
+    def __init__(self, object_list, number, paginator, has_next):
+        super().__init__(object_list, number, paginator)
+        self._has_next = has_next
+
+    def has_next(self):
+        return self._has_next
+
+    def next_page_number(self):
+        return self.number + 1
+
+    def previous_page_number(self):
+        return self.number - 1
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator using the estimated count for big tables, where an exact
+    `COUNT(*)` would scan the whole table on every page.
+    The estimation is only reported: the pages are bounded by the rows read,
+    one more than the page size, so they don't depend on how far off it is.
+    """
+
+    @cached_property
+    def estimation(self):
+        """The estimated count, None when the rows are counted"""
+        threshold = settings.PAGINATION_ESTIMATE_COUNT_ABOVE
+        if threshold is not None and hasattr(self.object_list, "query"):
+            estimation = estimate_count(self.object_list)
+            if estimation is not None and estimation > threshold:
+                return estimation
+        return None
+
+    @cached_property
+    def count(self):
+        if self.estimation is not None:
+            return self.estimation
+        return super().count
+
+    def page(self, number):
+        if self.estimation is None:
+            return super().page(number)
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger(_("That page number is not an integer"))
+        if number < 1:
+            raise EmptyPage(_("That page number is less than 1"))
+        bottom = (number - 1) * self.per_page
+        rows = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not rows and number > 1:
+            raise EmptyPage(_("That page contains no results"))
+        return EstimatedCountPage(
+            rows[:self.per_page], number, self, len(rows) > self.per_page
+        )
+
+
+class KeysetPagination(pagination.BasePagination):
+    """
+    Cursor pagination over a unique composite key (`ordering`).
+    Every page is a `WHERE (key) > (position)` range read through the
+    matching index, so deep pages cost the same as the first one.
+    The total count is only returned when `?count=exact|estimate` is sent.
+    """
+    ordering = ("id",)
+    page_size = settings.REST_FRAMEWORK["PAGE_SIZE"]
+    cursor_query_param = "cursor"
+    count_query_param = "count"
+    invalid_cursor_message = "Invalid cursor"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = request.build_absolute_uri()
+        position, self.reverse = self.decode_cursor(request, queryset.model)
+
+        ordering = [self.order(f, self.reverse) for f in self.ordering]
+        queryset = queryset.order_by(*ordering)
+        self.count = self.get_count(queryset, request)
+        if position is not None:
+            queryset = queryset.filter(self.position_filter(position))
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if self.reverse:
+            results.reverse()
+
+        self.page = results
+        if self.reverse:
+            self.has_next = position is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+        return results
+
+    def get_paginated_response(self, data):
+        content = [
+            ("next", self.get_next_link()),
+            ("previous", self.get_previous_link()),
+            ("results", data),
+        ]
+        if self.count is not None:
+            content.insert(0, ("count", self.count))
+        return response.Response(OrderedDict(content))
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.get_position(self.page[-1]), False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.get_position(self.page[0]), True)
+
+    def get_count(self, queryset, request):
+        mode = request.query_params.get(self.count_query_param)
+        if mode == "estimate":
+            estimation = estimate_count(queryset)
+            if estimation is not None:
+                return estimation
+        if mode in ("exact", "estimate"):
+            return queryset.count()
+        return None
+
+    @staticmethod
+    def order(field, reverse):
+        descending = field.startswith("-")
+        if descending == reverse:
+            return field.lstrip("-")
+        return "-" + field.lstrip("-")
+
+    def position_filter(self, position):
+        """
+        Lexicographic comparison of the ordering fields with the position:
+        (a > x) OR (a = x AND b > y) OR ...
+        """
+        condition = Q()
+        equal = {}
+        for field, value in zip(self.ordering, position):
+            name = field.lstrip("-")
+            lookup = "lt" if self.order(field, self.reverse).startswith("-") else "gt"
+            condition |= Q(**equal, **{"%s__%s" % (name, lookup): value})
+            equal[name] = value
+        return condition
+
+    def get_position(self, row):
+        values = []
+        for field in self.ordering:
+            name = field.lstrip("-")
+            value = row[name] if isinstance(row, dict) else getattr(row, name)
+            if isinstance(value, (datetime.date, datetime.datetime)):
+                value = value.isoformat()
+            values.append(value)
+        return values
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode("ascii")))
+            position = cursor["p"]
+            if len(position) != len(self.ordering):
+                raise ValueError
+            # The values are filtered on, with the types of their fields
+            position = [
+                self.to_python(model, field, value)
+                for field, value in zip(self.ordering, position)
+            ]
+            return position, bool(cursor.get("r"))
+        except (TypeError, ValueError, KeyError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    @staticmethod
+    def to_python(model, field, value):
+        name = field.lstrip("-")
+        try:
+            model_field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            if name != "pk":
+                raise
+            model_field = model._meta.pk
+        value = model_field.to_python(value)
+        if value is None:
+            raise ValueError
+        return value
+
+    def encode_cursor(self, position, reverse):
+        cursor = {"p": position}
+        if reverse:
+            cursor["r"] = 1
+        encoded = base64.urlsafe_b64encode(
+            json.dumps(cursor, separators=(",", ":")).encode("ascii")
+        ).decode("ascii")
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+
+class HybridPagination(pagination.PageNumberPagination):
+    """
+    Page number pagination that switches to `KeysetPagination` when the
+    client asks for it sending `?cursor` (empty for the first page).
+    The keyset is the `?ordering=` of the view, or `ordering` without it.
+    """
+    django_paginator_class = EstimatedCountPaginator
+    keyset_class = KeysetPagination
+    ordering = ("id",)
+    keyset = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        cursor_param = self.keyset_class.cursor_query_param
+        if cursor_param in request.query_params and not queryset.query.is_sliced:
+            self.keyset = self.keyset_class()
+            self.keyset.ordering = self.get_keyset_ordering(queryset, request, view)
+            self.keyset.page_size = self.get_page_size(request)
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_keyset_ordering(self, queryset, request, view):
+        # Only the filter that makes the ordering unique, ending in the id
+        for backend in getattr(view, "filter_backends", ()):
+            if issubclass(backend, OrderingFilter):
+                ordering = backend().get_ordering(request, queryset, view)
+                if ordering:
+                    return tuple(ordering)
+        return self.ordering
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
@@ -0,0 +1,102 @@
+"""
+Hyperlinked fields reversing each route once per request.
+
+`reverse()` walks the URL resolver for every row of a page. These fields
+reverse the route with a placeholder for the lookup value the first time
+and then only replace the placeholder, producing the same URLs.
+"""
+from urllib.parse import quote, unquote, urlparse
+
+from django.urls import NoReverseMatch, Resolver404, get_script_prefix, resolve
+from django.utils.http import RFC3986_SUBDELIMS
+from rest_framework import relations, serializers
+
+PLACEHOLDER = "9753186420"
+
+
+class TemplateHyperlinkMixin:
+
+    def get_url_template(self, view_name, request, format):
+        templates = self.context.setdefault("url_templates", {})
+        key = (view_name, self.lookup_url_kwarg, format)
+        if key not in templates:
+            try:
+                template = self.reverse(
+                    view_name,
+                    kwargs={self.lookup_url_kwarg: PLACEHOLDER},
+                    request=request,
+                    format=format
+                )
+            except NoReverseMatch:
+                template = None
+            if template is not None and template.count(PLACEHOLDER) != 1:
+                template = None
+            templates[key] = template
+        return templates[key]
+
+    def get_url(self, obj, view_name, request, format):
+        # Unsaved objects will not yet have a valid URL.
+        if hasattr(obj, "pk") and obj.pk in (None, ""):
+            return None
+
+        template = self.get_url_template(view_name, request, format)
+        if template is None:
+            return super().get_url(obj, view_name, request, format)
+        lookup_value = getattr(obj, self.lookup_field)
+        # Quoted as django.urls.reverse does
+        return template.replace(
+            PLACEHOLDER,
+            quote(str(lookup_value), safe=RFC3986_SUBDELIMS + "/~:@")
+        )
+
+
+class HyperlinkedRelatedField(TemplateHyperlinkMixin,
+                              relations.HyperlinkedRelatedField):
+
+    def prefetch(self, values):
+        """
+        Load the objects linked by many hyperlinks with one query. Used
+        before validating a list of items, `get_object` then takes them
+        from the serializer context.
+        """
+        if self.lookup_field != "pk":
+            return
+        prefix = get_script_prefix()
+        lookups = []
+        for value in values:
+            if not isinstance(value, str):
+                continue
+            path = unquote(urlparse(value).path)
+            if path.startswith(prefix):
+                path = "/" + path[len(prefix):]
+            try:
+                match = resolve(path)
+            except Resolver404:
+                continue
+            if match.view_name == self.view_name:
+                lookups.append(match.kwargs.get(self.lookup_url_kwarg))
+
+        objects = self.get_queryset().in_bulk(
+            [lookup for lookup in lookups if lookup is not None]
+        )
+        self.context.setdefault("related_objects", {})[self.view_name] = {
+            str(pk): obj for pk, obj in objects.items()
+        }
+
+    def get_object(self, view_name, view_args, view_kwargs):
+        objects = self.context.get("related_objects", {}).get(view_name)
+        if objects is not None:
+            lookup_value = str(view_kwargs.get(self.lookup_url_kwarg))
+            if lookup_value in objects:
+                return objects[lookup_value]
+        return super().get_object(view_name, view_args, view_kwargs)
+
+
+class HyperlinkedIdentityField(TemplateHyperlinkMixin,
+                               relations.HyperlinkedIdentityField):
+    pass
+
+
+class HyperlinkedModelSerializer(serializers.HyperlinkedModelSerializer):
+    serializer_related_field = HyperlinkedRelatedField
+    serializer_url_field = HyperlinkedIdentityField
@@ -0,0 +1,144 @@
+"""
+Read replica routing.
+
+`ReplicaMiddleware` sends the safe requests (GET, HEAD, OPTIONS) of the
+views with `read_from_replica = True` to one of the `DATABASE_REPLICAS`
+aliases through `ReplicaRouter`. Everything else uses the primary:
+
+- Once a request writes, the rest of it reads from the primary and the
+  client gets a cookie that keeps its reads on the primary for
+  `DATABASE_REPLICA_STICKY_SECONDS`, so it reads its own writes.
+- Replicas lagging more than `DATABASE_REPLICA_MAX_LAG` seconds, or not
+  answering, are skipped until the next check.
+"""
+import contextvars
+import logging
+import random
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+# State of the request being served: {"alias": ..., "wrote": ...}
+request_state = contextvars.ContextVar("db_request_state", default=None)
+
+STICKY_COOKIE = "db_primary"
+
+# PostgreSQL standby lag in seconds, 0 when all the received WAL is replayed
+PG_LAG_QUERY = (
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() "
+    "THEN 0 ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) "
+    "END"
+)
+
+
+class LagMonitor:
+    """Per process replica lag, checked every `DATABASE_REPLICA_LAG_CHECK_INTERVAL`"""
+
+    def __init__(self):
+        # alias: (checked at, usable)
+        self.checks = {}
+
+    def usable(self, alias):
+        checked, usable = self.checks.get(alias, (None, False))
+        now = time.monotonic()
+        if checked is None or now - checked >= settings.DATABASE_REPLICA_LAG_CHECK_INTERVAL:
+            lag = self.get_lag(alias)
+            usable = lag is not None and lag <= settings.DATABASE_REPLICA_MAX_LAG
+            if not usable:
+                logger.warning("Replica %s skipped, lag: %s", alias, lag)
+            self.checks[alias] = (now, usable)
+        return usable
+
+    def get_lag(self, alias):
+        """Seconds the replica is behind, None when it can't be reached"""
+        connection = connections[alias]
+        if connection.vendor != "postgresql":
+            return 0
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(PG_LAG_QUERY)
+                lag = cursor.fetchone()[0]
+        except DatabaseError:
+            return None
+        # NULL when the server isn't a standby
+        return float(lag or 0)
+
+    def reset(self):
+        self.checks.clear()
+
+
+lag_monitor = LagMonitor()
+
+
+def choose_replica():
+    replicas = [a for a in settings.DATABASE_REPLICAS if lag_monitor.usable(a)]
+    return random.choice(replicas) if replicas else None
+
+
+def current_alias():
+    """The database the reads of the current request go to"""
+    state = request_state.get()
+    return (state and state["alias"]) or DEFAULT_DB_ALIAS
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        state = request_state.get()
+        return state and state["alias"]
+
+    def db_for_write(self, model, **hints):
+        state = request_state.get()
+        if state is not None:
+            # Read the rest of the request from the primary
+            state["alias"] = None
+            state["wrote"] = True
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        aliases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if {obj1._state.db, obj2._state.db} <= aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get the schema from the primary
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
+
+
+class ReplicaMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        state = {"alias": None, "wrote": False}
+        token = request_state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            request_state.reset(token)
+        if state["wrote"]:
+            response.set_cookie(
+                STICKY_COOKIE, "1",
+                max_age=settings.DATABASE_REPLICA_STICKY_SECONDS,
+                httponly=True,
+                samesite="Lax"
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view = getattr(view_func, "cls", None)
+        if (settings.DATABASE_REPLICAS
+                and getattr(view, "read_from_replica", False)
+                and request.method in ("GET", "HEAD", "OPTIONS")
+                and STICKY_COOKIE not in request.COOKIES):
+            state = request_state.get()
+            if state is not None:
+                state["alias"] = choose_replica()
+        return None
@@ -0,0 +1,149 @@
+"""
+Ranked text search for the list endpoints: `?search=<term>`.
+
+The searchable fields of a model are registered with `register` from its
+app `ready()`, which creates the indexes after every migration:
+
+- PostgreSQL: a `pg_trgm` GIN index on `UPPER(field)` for each field, used
+  by the `icontains` filter. Results are ranked by the best
+  `TrigramSimilarity` of the fields, computed from the trigrams of the
+  matched rows only: a `SearchVector` would parse every matched row on each
+  request, with no index behind it.
+- SQLite: an FTS5 table with the trigram tokenizer kept in sync by
+  triggers, ranked with `bm25`. Used by the local and test databases.
+"""
+from django.contrib.postgres.search import TrigramSimilarity
+from django.db import connections
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Greatest
+from django.db.models.signals import post_migrate
+from rest_framework.filters import BaseFilterBackend
+
+registry = {}
+
+# FTS5 trigram tokenizer can't match shorter terms
+FTS_MIN_LENGTH = 3
+
+
+def register(app_config, model, fields):
+    registry[model] = tuple(fields)
+    post_migrate.connect(
+        create_search_indexes,
+        sender=app_config,
+        dispatch_uid="search_indexes_%s" % model._meta.label_lower
+    )
+
+
+def fts_table(model):
+    return "%s_search" % model._meta.db_table
+
+
+def create_search_indexes(sender, using="default", **kwargs):
+    connection = connections[using]
+    for model in sender.get_models():
+        fields = registry.get(model)
+        if not fields:
+            continue
+        table = model._meta.db_table
+        columns = [model._meta.get_field(f).column for f in fields]
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+                for column in columns:
+                    cursor.execute(
+                        'CREATE INDEX IF NOT EXISTS "%s_%s_trgm" ON "%s" '
+                        'USING gin (UPPER("%s") gin_trgm_ops)'
+                        % (table, column, table, column)
+                    )
+            elif connection.vendor == "sqlite":
+                create_fts_table(cursor, model, columns)
+
+
+def create_fts_table(cursor, model, columns):
+    table = model._meta.db_table
+    fts = fts_table(model)
+    pk = model._meta.pk.column
+    names = ", ".join(columns)
+    new = ", ".join("new.%s" % c for c in columns)
+    old = ", ".join("old.%s" % c for c in columns)
+    cursor.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5(%s, content='%s', "
+        "content_rowid='%s', tokenize='trigram')" % (fts, names, table, pk)
+    )
+    cursor.execute(
+        "CREATE TRIGGER IF NOT EXISTS %s_ai AFTER INSERT ON %s BEGIN "
+        "INSERT INTO %s(rowid, %s) VALUES (new.%s, %s); END"
+        % (fts, table, fts, names, pk, new)
+    )
+    cursor.execute(
+        "CREATE TRIGGER IF NOT EXISTS %s_ad AFTER DELETE ON %s BEGIN "
+        "INSERT INTO %s(%s, rowid, %s) VALUES ('delete', old.%s, %s); END"
+        % (fts, table, fts, fts, names, pk, old)
+    )
+    cursor.execute(
+        "CREATE TRIGGER IF NOT EXISTS %s_au AFTER UPDATE ON %s BEGIN "
+        "INSERT INTO %s(%s, rowid, %s) VALUES ('delete', old.%s, %s); "
+        "INSERT INTO %s(rowid, %s) VALUES (new.%s, %s); END"
+        % (fts, table, fts, fts, names, pk, old, fts, names, pk, new)
+    )
+    cursor.execute("INSERT INTO %s(%s) VALUES ('rebuild')" % (fts, fts))
+
+
+def contains_filter(fields, term):
+    condition = Q()
+    for field in fields:
+        condition |= Q(**{"%s__icontains" % field: term})
+    return condition
+
+
+def search(queryset, term):
+    """
+    Filter the queryset by `term` in its model registered fields and order
+    it by relevance, annotated as `search_rank`.
+    """
+    fields = registry[queryset.model]
+    vendor = connections[queryset.db].vendor
+
+    if vendor == "postgresql":
+        similarities = [TrigramSimilarity(f, term) for f in fields]
+        rank = Greatest(*similarities) if len(similarities) > 1 else similarities[0]
+        queryset = queryset.filter(contains_filter(fields, term)).annotate(
+            search_rank=rank
+        )
+    elif vendor == "sqlite" and len(term) >= FTS_MIN_LENGTH:
+        fts = fts_table(queryset.model)
+        match = '"%s"' % term.replace('"', '""')
+        queryset = queryset.filter(
+            pk__in=RawSQL(
+                "SELECT rowid FROM %s WHERE %s MATCH %%s" % (fts, fts),
+                [match]
+            )
+        ).annotate(search_rank=RawSQL(
+            # bm25 is lower for better matches
+            "SELECT -bm25(%s) FROM %s WHERE %s MATCH %%s AND rowid = %s.%s" % (
+                fts, fts, fts,
+                queryset.model._meta.db_table,
+                queryset.model._meta.pk.column
+            ),
+            [match],
+            output_field=FloatField()
+        ))
+    else:
+        queryset = queryset.filter(contains_filter(fields, term)).annotate(
+            search_rank=Value(0.0, output_field=FloatField())
+        )
+    return queryset.order_by(F("search_rank").desc(), "pk")
+
+
+class RankedSearchFilter(BaseFilterBackend):
+    """Apply `search` to the models registered when `?search` is sent"""
+    search_param = "search"
+
+    def filter_queryset(self, request, queryset, view):
+        term = request.query_params.get(self.search_param, "").strip()
+        if not term or queryset.model not in registry:
+            return queryset
+        if queryset.query.is_sliced:
+            return queryset
+        return search(queryset, term)
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/4.1/ref/settings/
 """
 
 import os
+import dj_database_url
 import django_heroku
 
 from pathlib import Path
@@ -55,8 +56,11 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # After the authentication, to let staff sessions use the profiler
+    'drfbasis.instrumentation.InstrumentationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'drfbasis.routers.ReplicaMiddleware',
 ]
 
 ROOT_URLCONF = 'drfbasis.urls'
@@ -84,6 +88,17 @@ CORS_ALLOW_ALL_ORIGINS = True
 
 DEFAULT_FROM_EMAIL='felix.ml.1990@gmail.com'
 
+# ##### Email queue ########
+# Emails are stored in the outbox and sent by `manage.py send_queued_emails`
+EMAIL_QUEUE_BATCH_SIZE = int(os.getenv('EMAIL_QUEUE_BATCH_SIZE', 50))
+EMAIL_QUEUE_MAX_ATTEMPTS = 5
+# Seconds before the first retry, doubled on every failed attempt
+EMAIL_QUEUE_RETRY_DELAY = 30
+EMAIL_QUEUE_MAX_RETRY_DELAY = 3600
+# Seconds a worker holds a batch before other workers can claim it again
+EMAIL_QUEUE_LEASE = 300
+EMAIL_QUEUE_POLL_INTERVAL = 5
+
 # Run with ngrok
 if os.getenv('NGROK', False):
     DEBUG = False
@@ -112,6 +127,74 @@ DATABASES = {
     }
 }
 
+# Heroku database, configured here instead of by django_heroku to keep the
+# connection settings below
+if 'DATABASE_URL' in os.environ:
+    DATABASES['default'] = dj_database_url.config(ssl_require=True)
+    if 'CI' in os.environ:
+        DATABASES['default']['TEST'] = DATABASES['default']
+
+# Read replicas, comma separated database urls in REPLICA_DATABASE_URLS.
+# The safe requests of the views with `read_from_replica` are served by them
+DATABASE_REPLICAS = []
+for i, url in enumerate(filter(None, os.getenv('REPLICA_DATABASE_URLS', '').split(','))):
+    DATABASES['replica%d' % i] = dj_database_url.parse(url, ssl_require='DATABASE_URL' in os.environ)
+    DATABASE_REPLICAS.append('replica%d' % i)
+DATABASE_ROUTERS = ['drfbasis.routers.ReplicaRouter']
+# Seconds a client reads from the primary after writing
+DATABASE_REPLICA_STICKY_SECONDS = 10
+# Replicas behind the primary more than these seconds are skipped
+DATABASE_REPLICA_MAX_LAG = 5
+# Seconds between replica lag checks, per process
+DATABASE_REPLICA_LAG_CHECK_INTERVAL = 10
+
+# Connections
+# Seconds a connection is kept open between the requests of a thread, it's
+# checked before being reused
+CONN_MAX_AGE = int(os.getenv('CONN_MAX_AGE', 600))
+# Share the PostgreSQL connections between the threads of the process
+# instead (see drfbasis.db.postgresql_pool), used by the ASGI entry point
+DATABASE_POOL = os.getenv('DATABASE_POOL') == '1'
+# Connections per process and database, and seconds waiting for a free one
+DATABASE_POOL_SIZE = int(os.getenv('DATABASE_POOL_SIZE', 10))
+DATABASE_POOL_TIMEOUT = float(os.getenv('DATABASE_POOL_TIMEOUT', 10))
+for database in DATABASES.values():
+    database['CONN_HEALTH_CHECKS'] = True
+    if DATABASE_POOL and database['ENGINE'] == 'django.db.backends.postgresql':
+        database['ENGINE'] = 'drfbasis.db.postgresql_pool'
+        # Returned to the pool at the end of every request
+        database['CONN_MAX_AGE'] = 0
+    else:
+        database['CONN_MAX_AGE'] = CONN_MAX_AGE
+
+# Cache
+REDIS_URL = os.getenv('REDIS_URL')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Password hashing
+# PBKDF2 iterations of the new hashes. The stored ones are hashed again on
+# login when they differ, so it can be lowered or raised at any time
+PASSWORD_HASH_ITERATIONS = int(os.getenv('PASSWORD_HASH_ITERATIONS', 390000))
+PASSWORD_HASHERS = [
+    'authentication.hashing.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
@@ -134,15 +217,43 @@ AUTH_USER_MODEL = "authentication.User"
 # Pagination
 REST_FRAMEWORK = {
     'DEFAULT_FILTER_BACKENDS': [
-        'django_filters.rest_framework.DjangoFilterBackend'
+        'django_filters.rest_framework.DjangoFilterBackend',
+        # Ranked ?search= on the models registered in drfbasis.search
+        'drfbasis.search.RankedSearchFilter'
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
+        # Use 'authentication.authentication.StatelessJWTAuthentication' to
+        # build the user from the token claims without querying the db
         'rest_framework_simplejwt.authentication.JWTAuthentication',
         'rest_framework.authentication.SessionAuthentication'
     ],
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    'DEFAULT_PAGINATION_CLASS': 'drfbasis.pagination.HybridPagination',
+    # Used by the authentication views (drfbasis.throttling)
+    'DEFAULT_THROTTLE_RATES': {
+        'auth_ip': os.getenv('THROTTLE_AUTH_IP', '30/min'),
+        'auth_account': os.getenv('THROTTLE_AUTH_ACCOUNT', '10/min'),
+        'auth_email': os.getenv('THROTTLE_AUTH_EMAIL', '5/hour'),
+    },
+    # Proxies in front of the app, the client IP is taken from X-Forwarded-For
+    'NUM_PROXIES': int(os.getenv('NUM_PROXIES', 1 if 'DYNO' in os.environ else 0)),
     'PAGE_SIZE': 20
 }
+# Token of the Prometheus scraper for /metrics, sent as
+# `Authorization: Token <METRICS_TOKEN>`. Staff users can read it anyway
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+# Let staff users profile a request sending the X-Profile header
+PROFILING_ENABLED = DEBUG or os.getenv('PROFILING_ENABLED') == '1'
+# Functions listed in the profiles
+PROFILING_LINES = 50
+# Build the list responses from .values() rows instead of model instances
+FAST_LIST_SERIALIZATION = True
+# Rows written per statement by the bulk endpoints
+BULK_BATCH_SIZE = 1000
+# Rows fetched per round trip by the streaming exports
+EXPORT_CHUNK_SIZE = 2000
+# Tables with more rows than this get an estimated count in page number
+# pagination (PostgreSQL only). None to always count them
+PAGINATION_ESTIMATE_COUNT_ABOVE = 100000
 
 REFRESH_TOKEN_DAYS=7
 ACCESS_TOKEN_DAYS=7
@@ -150,8 +261,61 @@ SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(days=int(ACCESS_TOKEN_DAYS)),
     "REFRESH_TOKEN_LIFETIME": timedelta(days=int(REFRESH_TOKEN_DAYS)),
     "ROTATE_REFRESH_TOKENS": False,
-    "BLACKLIST_AFTER_ROTATION": False
+    "BLACKLIST_AFTER_ROTATION": False,
+    "TOKEN_OBTAIN_SERIALIZER": "authentication.serializers.TokenObtainPairSerializer",
+    "TOKEN_REFRESH_SERIALIZER": "authentication.serializers.TokenRefreshSerializer"
+}
+# Threads hashing the passwords (authentication.hashing)
+PASSWORD_HASHING_WORKERS = int(os.getenv('PASSWORD_HASHING_WORKERS', os.cpu_count() or 2))
+# Hashes waiting for a worker before answering 503 to the new ones
+PASSWORD_HASHING_QUEUE_SIZE = int(os.getenv('PASSWORD_HASHING_QUEUE_SIZE', 32))
+# Seconds the users loaded by StatelessJWTAuthentication stay in the cache
+AUTH_USER_CACHE_TTL = 30
+# Check the refresh tokens against an in-memory copy of the blacklist.
+# Processes are notified of changes through the cache, so it must be
+# shared between them (Redis)
+TOKEN_BLACKLIST_CACHE = bool(REDIS_URL)
+# Seconds before the in-memory blacklist is synced even without changes
+TOKEN_BLACKLIST_CACHE_TTL = 60
+# Seconds each sync reloads before the last token loaded, for the logouts
+# committed out of order
+TOKEN_BLACKLIST_SYNC_OVERLAP = 60
+# Seconds before the whole in-memory blacklist is reloaded
+TOKEN_BLACKLIST_CACHE_RELOAD = 3600
+# Expired tokens deleted per transaction by `manage.py prune_tokens`
+TOKEN_PRUNE_CHUNK_SIZE = 1000
+
+
+# Entity views are buffered by each process and written every
+# ENTITY_VIEWS_FLUSH_INTERVAL seconds or when ENTITY_VIEWS_FLUSH_SIZE
+# entities have pending views
+ENTITY_VIEWS_FLUSH_INTERVAL = 5
+ENTITY_VIEWS_FLUSH_SIZE = 1000
+# Seconds the minute, hour and day view buckets are kept
+ENTITY_VIEWS_RETENTION = {
+    60: 2 * 86400,
+    3600: 35 * 86400,
+    86400: 400 * 86400,
 }
+# Seconds between the rollups of `manage.py rollup_views --loop`
+ENTITY_VIEWS_ROLLUP_INTERVAL = 60
+# Entities ranked per trending window, cached for
+# ENTITY_TRENDING_CACHE_TIMEOUT seconds
+ENTITY_TRENDING_SIZE = 100
+ENTITY_TRENDING_CACHE_TIMEOUT = 300
+# Most viewed entities kept in the cache for the first page of
+# ?ordering=-views, rebuilt at least every ENTITY_LEADERBOARD_TIMEOUT seconds
+ENTITY_LEADERBOARD_SIZE = 100
+ENTITY_LEADERBOARD_TIMEOUT = 3600
+# Seconds the entity list responses are cached, and the view counts of the
+# lists lag behind at most
+ENTITY_LIST_CACHE_TIMEOUT = 300
+# Bloom filter of the entity links checked before querying them: rebuilt
+# every ENTITY_LINK_FILTER_REFRESH seconds, sized for twice the links or
+# at least ENTITY_LINK_FILTER_CAPACITY with that false positive rate
+ENTITY_LINK_FILTER_REFRESH = 300
+ENTITY_LINK_FILTER_CAPACITY = 100000
+ENTITY_LINK_FILTER_ERROR_RATE = 0.01
 
 
 # Internationalization
@@ -181,7 +345,6 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 '''
 Configure Django App for Heroku.
-This will automatically configure DATABASE_URL, ALLOWED_HOSTS,
-WhiteNoise (for static assets), Logging, and Heroku CI for your application.
+This will automatically configure ALLOWED_HOSTS, WhiteNoise (for static assets), Logging, and Heroku CI for your application.
 '''
-django_heroku.settings(locals())
+django_heroku.settings(locals(), databases=False)
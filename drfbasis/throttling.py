@@ -0,0 +1,111 @@
+"""
+Throttles of the authentication endpoints.
+
+The counters are kept in the default cache, shared by every process when
+it's Redis. Throttles run in `APIView.initial`, before the serializer
+validation and the password hashing, so a rejected request costs two cache
+round trips.
+"""
+import hashlib
+
+from rest_framework.throttling import SimpleRateThrottle
+
+
+class SlidingWindowThrottle(SimpleRateThrottle):
+    """
+    Sliding window counter: the requests of the current fixed window plus
+    the ones of the previous window weighted by how much of it is still
+    inside the sliding window. Unlike the request history of DRF throttles,
+    it's two counters per key whatever the rate, updated atomically.
+    """
+    cache_format = "throttle:%(scope)s:%(ident)s"
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        self.now = self.timer()
+        window = int(self.now // self.duration)
+        current_key = "%s:%d" % (self.key, window)
+        previous_key = "%s:%d" % (self.key, window - 1)
+        counts = self.cache.get_many([current_key, previous_key])
+        self.current = counts.get(current_key, 0)
+        self.previous = counts.get(previous_key, 0)
+        self.elapsed = self.now % self.duration / self.duration
+
+        if self.previous * (1 - self.elapsed) + self.current >= self.num_requests:
+            return self.throttle_failure()
+
+        # Kept while it's the current or the previous window
+        self.cache.add(current_key, 0, self.duration * 2)
+        try:
+            self.cache.incr(current_key)
+        except ValueError:
+            # Expired in between
+            self.cache.set(current_key, 1, self.duration * 2)
+        return True
+
+    def wait(self):
+        """Seconds until the weighted count is under the rate"""
+        free = self.num_requests - self.current
+        if free > 0 and self.previous:
+            # previous * (1 - elapsed) < free
+            elapsed = 1 - free / self.previous
+            return max((elapsed - self.elapsed) * self.duration, 0)
+        return (1 - self.elapsed) * self.duration
+
+    def get_cache_key(self, request, view):
+        ident = self.get_key(request, view)
+        if not ident:
+            return None
+        # Any length or character is sent by the clients
+        ident = hashlib.sha1(ident.encode()).hexdigest()
+        return self.cache_format % {"scope": self.scope, "ident": ident}
+
+    def get_key(self, request, view):
+        raise NotImplementedError(".get_key() must be overridden")
+
+    @staticmethod
+    def get_value(request, name):
+        data = request.data
+        value = data.get(name) if hasattr(data, "get") else None
+        return value if isinstance(value, str) else None
+
+
+class IPThrottle(SlidingWindowThrottle):
+    """Requests per client IP to the authentication endpoints"""
+    scope = "auth_ip"
+
+    def get_key(self, request, view):
+        return self.get_ident(request)
+
+
+class AccountThrottle(SlidingWindowThrottle):
+    """
+    Attempts per account: the `username` sent, or the account of the
+    `uidb64` of the reset password links
+    """
+    scope = "auth_account"
+
+    def get_key(self, request, view):
+        username = self.get_value(request, "username")
+        if username:
+            return "u:" + username.lower()
+        uidb64 = view.kwargs.get("uidb64")
+        if uidb64:
+            return "id:" + uidb64
+        return None
+
+
+class EmailThrottle(SlidingWindowThrottle):
+    """Requests per `email` sent, which receive an email"""
+    scope = "auth_email"
+
+    def get_key(self, request, view):
+        email = self.get_value(request, "email")
+        if email:
+            return email.strip().lower()
+        return None
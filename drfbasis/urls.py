@@ -22,6 +22,7 @@ from rest_framework_simplejwt.views import (
 )
 from authentication.views import UserViewSet, GroupViewSet
 from entities.views import EntityViewSet
+from drfbasis.views import MetricsView
 from django.conf import settings
 from django.conf.urls.static import static
 
@@ -34,7 +35,8 @@ urlpatterns = [
     path('api/', include(router.urls)),
     path('admin/', admin.site.urls),
     path('api-auth/', include('rest_framework.urls', namespace='rest_framework')),
-    path('auth/', include('authentication.urls'))
+    path('auth/', include('authentication.urls')),
+    path('metrics', MetricsView.as_view(), name='metrics')
 ]
 
 if settings.DEBUG:
@@ -0,0 +1,34 @@
+"""
+Views shared by the apps: the metrics endpoint.
+"""
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.crypto import constant_time_compare
+from rest_framework import permissions
+from rest_framework.views import APIView
+
+from drfbasis.metrics import registry
+
+
+class MetricsPermission(permissions.BasePermission):
+    """
+    Staff users, or the scraper sending `Authorization: Token <METRICS_TOKEN>`
+    """
+
+    def has_permission(self, request, view):
+        token = settings.METRICS_TOKEN
+        header = request.META.get("HTTP_AUTHORIZATION", "")
+        if token and constant_time_compare(header, "Token " + token):
+            return True
+        return bool(request.user and request.user.is_staff)
+
+
+class MetricsView(APIView):
+    """Metrics of this process in the Prometheus text format"""
+    permission_classes = [MetricsPermission]
+
+    def get(self, request):
+        return HttpResponse(
+            registry.render(),
+            content_type="text/plain; version=0.0.4; charset=utf-8"
+        )
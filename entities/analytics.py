@@ -0,0 +1,128 @@
+"""
+View analytics of the entities by time buckets.
+
+Each flush of the view counter appends one minute bucket per entity viewed:
+the rows are only inserted, so recording views never locks. The rollup job
+(`manage.py rollup_views`) sums the minute buckets in hour buckets and the
+hours in day buckets, prunes the buckets older than their retention and
+stores the trending entities of every window in the cache, so the
+`trending` action reads K ids and K entities.
+"""
+import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Max, Min, Sum
+from django.db.models.functions import Trunc
+from django.utils import timezone
+
+from entities.models import EntityViewBucket
+
+MINUTE = EntityViewBucket.MINUTE
+HOUR = EntityViewBucket.HOUR
+DAY = EntityViewBucket.DAY
+
+# Trending windows: the buckets summed and how many of them
+WINDOWS = {
+    "hour": (MINUTE, 60),
+    "day": (HOUR, 24),
+    "week": (DAY, 7),
+}
+# Period rolled up into the next one, with the kind of Trunc
+ROLLUPS = [(MINUTE, HOUR, "hour"), (HOUR, DAY, "day")]
+
+TRENDING_KEY = "entities:trending:%s"
+
+
+def floor(moment, period):
+    seconds = moment.timestamp() // period * period
+    return datetime.datetime.fromtimestamp(seconds, datetime.timezone.utc)
+
+
+def record(views, now=None):
+    """Append the minute buckets of `views`, {entity id: views}"""
+    start = floor(now or timezone.now(), MINUTE)
+    EntityViewBucket.objects.bulk_create([
+        EntityViewBucket(entity_id=entity_id, period=MINUTE, start=start, views=count)
+        for entity_id, count in views.items()
+    ], batch_size=settings.BULK_BATCH_SIZE)
+
+
+def roll(source, target, kind):
+    """
+    Recompute the `target` buckets from the last one, possibly partial,
+    summing the `source` buckets
+    """
+    buckets = EntityViewBucket.objects.filter(period=target)
+    since = buckets.aggregate(start=Max("start"))["start"]
+    if since is None:
+        since = (
+            EntityViewBucket.objects
+            .filter(period=source)
+            .aggregate(start=Min("start"))["start"]
+        )
+        if since is None:
+            return 0
+    since = floor(since, target)
+
+    rows = (
+        EntityViewBucket.objects
+        .filter(period=source, start__gte=since)
+        .values("entity_id", bucket=Trunc("start", kind, tzinfo=datetime.timezone.utc))
+        .annotate(total=Sum("views"))
+        .order_by()
+    )
+    buckets.filter(start__gte=since).delete()
+    return len(EntityViewBucket.objects.bulk_create([
+        EntityViewBucket(
+            entity_id=row["entity_id"],
+            period=target,
+            start=row["bucket"],
+            views=row["total"]
+        ) for row in rows.iterator()
+    ], batch_size=settings.BULK_BATCH_SIZE))
+
+
+def compute_trending(window, now=None):
+    """The [entity id, views] most viewed in the `window`, descending"""
+    period, count = WINDOWS[window]
+    since = floor(now or timezone.now(), period) - datetime.timedelta(
+        seconds=period * (count - 1)
+    )
+    return [
+        [row["entity_id"], row["total"]] for row in (
+            EntityViewBucket.objects
+            .filter(period=period, start__gte=since)
+            .values("entity_id")
+            .annotate(total=Sum("views"))
+            .order_by("-total", "entity_id")[:settings.ENTITY_TRENDING_SIZE]
+        )
+    ]
+
+
+def rollup(now=None):
+    """Roll up and prune the buckets and cache the trending entities"""
+    now = now or timezone.now()
+    with transaction.atomic():
+        for source, target, kind in ROLLUPS:
+            roll(source, target, kind)
+        for period, retention in settings.ENTITY_VIEWS_RETENTION.items():
+            EntityViewBucket.objects.filter(
+                period=period,
+                start__lt=now - datetime.timedelta(seconds=retention)
+            ).delete()
+    trending = {window: compute_trending(window, now) for window in WINDOWS}
+    cache.set_many({
+        TRENDING_KEY % window: top for window, top in trending.items()
+    }, settings.ENTITY_TRENDING_CACHE_TIMEOUT)
+    return trending
+
+
+def get_trending(window):
+    """The trending entities of the last rollup, computed if missing"""
+    top = cache.get(TRENDING_KEY % window)
+    if top is None:
+        top = compute_trending(window)
+        cache.set(TRENDING_KEY % window, top, settings.ENTITY_TRENDING_CACHE_TIMEOUT)
+    return top
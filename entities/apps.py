@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class EntitiesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'entities'
+
+    def ready(self):
+        # Register the signal receivers
+        from entities import cache, leaderboard, validation  # noqa: F401
+        from drfbasis import search
+        search.register(self, self.get_model('Entity'), ('name', 'link'))
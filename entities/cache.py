@@ -0,0 +1,135 @@
+"""
+Response cache for the entity listings.
+
+The shared state (a version and the last modification date of the
+entities) changes whenever an entity is saved or deleted. Cached
+responses are keyed by that version, so they are never served stale,
+and the same values produce the ETag and Last-Modified headers. The view
+counts are the exception: the flushes of the view counter only change the
+version once it's `ENTITY_LIST_CACHE_TIMEOUT` seconds old, so the `views`
+of the lists lag behind up to that long.
+"""
+import datetime
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Max
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+from rest_framework import response
+from rest_framework.authentication import SessionAuthentication
+
+from drfbasis import routers
+from entities.models import Entity
+
+STATE_KEY = "entities:state"
+
+
+def get_state():
+    state = cache.get(STATE_KEY)
+    if state is None:
+        modified = Entity.objects.aggregate(modified=Max("updated"))["modified"]
+        now = timezone.now()
+        state = {
+            "version": uuid.uuid4().hex,
+            "modified": modified or now,
+            "created": now
+        }
+        if not cache.add(STATE_KEY, state, None):
+            # Set by another request meanwhile
+            state = cache.get(STATE_KEY, state)
+    return state
+
+
+def invalidate(modified=None):
+    now = timezone.now()
+    cache.set(STATE_KEY, {
+        "version": uuid.uuid4().hex,
+        "modified": modified or now,
+        "created": now
+    }, None)
+
+
+def views_changed():
+    """Invalidate the lists for new view counts, if the version is old enough"""
+    created = get_state().get("created")
+    max_age = datetime.timedelta(seconds=settings.ENTITY_LIST_CACHE_TIMEOUT)
+    if created is None or timezone.now() - created >= max_age:
+        invalidate()
+
+
+# After the commit: a response cached meanwhile under the new version
+# would hold the rows before the change
+
+@receiver(post_save, sender=Entity)
+def entity_saved(sender, instance, **kwargs):
+    modified = instance.updated
+    transaction.on_commit(lambda: invalidate(modified))
+
+
+@receiver(post_delete, sender=Entity)
+def entity_deleted(sender, instance, **kwargs):
+    transaction.on_commit(invalidate)
+
+
+class CachedListMixin:
+    """
+    Cache the list responses of a viewset by serializer class, format,
+    query params, the scheme and host of the absolute URLs and the database
+    read, so a lagging replica never fills the entries the clients reading
+    from the primary get. Conditional requests matching the current ETag or
+    Last-Modified get a 304 without running the query.
+    """
+    list_cache_prefix = "entities:list"
+
+    def get_list_cache_key(self, request, state):
+        params = sorted(
+            (k, v) for k, values in request.query_params.lists() for v in values
+        )
+        digest = hashlib.md5(repr((
+            self.get_serializer_class().__name__,
+            request.accepted_renderer.format,
+            params,
+            # The hyperlinks and pagination links are absolute
+            request.scheme,
+            request.get_host(),
+            routers.current_alias()
+        )).encode()).hexdigest()
+        return "%s:%s:%s" % (self.list_cache_prefix, state["version"], digest)
+
+    def list(self, request, *args, **kwargs):
+        state = get_state()
+        key = self.get_list_cache_key(request, state)
+        etag = quote_etag(hashlib.md5(key.encode()).hexdigest())
+        last_modified = int(state["modified"].timestamp())
+
+        not_modified = get_conditional_response(
+            request,
+            etag=etag,
+            last_modified=last_modified
+        )
+        if not_modified is not None:
+            not_modified["ETag"] = etag
+            return not_modified
+
+        data = cache.get(key)
+        if data is None:
+            res = super().list(request, *args, **kwargs)
+            cache.set(key, res.data, settings.ENTITY_LIST_CACHE_TIMEOUT)
+        else:
+            res = response.Response(data)
+
+        res["ETag"] = etag
+        res["Last-Modified"] = http_date(last_modified)
+        vary = ["Authorization"]
+        if any(issubclass(auth, SessionAuthentication)
+               for auth in self.authentication_classes):
+            vary.append("Cookie")
+        patch_vary_headers(res, vary)
+        return res
@@ -0,0 +1,104 @@
+"""
+Buffered view counter for entities.
+
+Recording a view only increments an in-process counter. The buffered
+increments are written by a timer thread `ENTITY_VIEWS_FLUSH_INTERVAL`
+seconds after the first one (or when `ENTITY_VIEWS_FLUSH_SIZE` entities are
+pending) as one
+`UPDATE ... SET views = views + delta` per entity, all of them in the same
+transaction, so concurrent views of a popular entity do not queue on
+its row lock. The views of the existing entities are also appended to the
+minute buckets of `entities.analytics` and merged in the leaderboard.
+"""
+import atexit
+import collections
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F
+
+from entities import analytics, cache
+from entities.leaderboard import leaderboard
+from entities.models import Entity
+
+logger = logging.getLogger(__name__)
+
+
+class ViewCounter:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = collections.Counter()
+        self.last_flush = time.monotonic()
+        # Flushes the views of a process that doesn't get more of them
+        self.timer = None
+
+    def add(self, entity_id, count=1):
+        with self.lock:
+            self.pending[entity_id] += count
+            due = (
+                len(self.pending) >= settings.ENTITY_VIEWS_FLUSH_SIZE
+                or time.monotonic() - self.last_flush
+                >= settings.ENTITY_VIEWS_FLUSH_INTERVAL
+            )
+            if not due:
+                self.schedule()
+        if due:
+            self.flush()
+
+    def schedule(self):
+        """Start the flush timer if it isn't running, holding the lock"""
+        if self.timer is None:
+            self.timer = threading.Timer(
+                settings.ENTITY_VIEWS_FLUSH_INTERVAL, self.flush_on_timer
+            )
+            self.timer.daemon = True
+            self.timer.start()
+
+    def flush_on_timer(self):
+        try:
+            self.flush()
+        finally:
+            # The connections of the timer thread
+            connections.close_all()
+
+    def flush(self):
+        """Write the pending increments. Returns the entities updated."""
+        with self.lock:
+            pending, self.pending = self.pending, collections.Counter()
+            self.last_flush = time.monotonic()
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+        if not pending:
+            return {}
+
+        try:
+            with transaction.atomic():
+                # Always the same order to avoid deadlocks between processes
+                viewed = {}
+                for entity_id in sorted(pending):
+                    if Entity.objects.filter(pk=entity_id).update(
+                        views=F("views") + pending[entity_id]
+                    ):
+                        viewed[entity_id] = pending[entity_id]
+                analytics.record(viewed)
+        except Exception:
+            logger.exception("Error flushing the entity views")
+            with self.lock:
+                self.pending.update(pending)
+                self.schedule()
+            return {}
+
+        # Updates do not send the post_save signal. The view counts of the
+        # cached lists may lag behind, so they keep their ETag meanwhile
+        cache.views_changed()
+        leaderboard.update(ids=list(viewed))
+        return dict(pending)
+
+
+view_counter = ViewCounter()
+atexit.register(view_counter.flush)
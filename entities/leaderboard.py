@@ -0,0 +1,197 @@
+"""
+Leaderboard of the most viewed entities.
+
+The top `ENTITY_LEADERBOARD_SIZE` rows by `(-views, -id)` are kept in the
+shared cache, so the first page of `?ordering=-views` is served without
+querying the entities. The board is an exact prefix of the ranking: the
+flushes of the view counter and the saved or deleted entities merge their
+rows in it, and a row that drops below the last one leaves the board,
+which is rebuilt from the `(views, id)` index once it's too short.
+
+Updates take a lock in the cache. An update that can't take it deletes the
+board and flags the conflict, so the holder doesn't write a board missing
+that update.
+"""
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework import response
+from rest_framework.utils.urls import replace_query_param
+
+from entities.models import Entity
+
+BOARD_KEY = "entities:leaderboard"
+LOCK_KEY = "entities:leaderboard:lock"
+CONFLICT_KEY = "entities:leaderboard:conflict"
+# Seconds an update can hold the lock
+LOCK_TIMEOUT = 30
+
+FIELDS = [field.attname for field in Entity._meta.concrete_fields]
+
+
+def rank(row):
+    return (-row["views"], -row["id"])
+
+
+def row_of(entity):
+    return {name: getattr(entity, name) for name in FIELDS}
+
+
+class Leaderboard:
+
+    @property
+    def size(self):
+        return settings.ENTITY_LEADERBOARD_SIZE
+
+    def get(self):
+        """
+        The board, `{"rows": [...], "complete": bool}`, where `complete`
+        means it holds every entity. Rebuilt if missing, None while another
+        process updates it.
+        """
+        board = cache.get(BOARD_KEY)
+        if board is None:
+            board = self.rebuild()
+        return board
+
+    def top(self, n):
+        """The first `n` rows, or None when the board can't tell them"""
+        board = self.get()
+        if board is None or (len(board["rows"]) < n and not board["complete"]):
+            return None
+        return board["rows"][:n]
+
+    def rebuild(self):
+        if not cache.add(LOCK_KEY, 1, LOCK_TIMEOUT):
+            return None
+        try:
+            # From the primary database, a replica may lag behind the updates
+            rows = list(
+                Entity.objects.using(DEFAULT_DB_ALIAS)
+                .order_by("-views", "-id")
+                .values(*FIELDS)[:self.size]
+            )
+            board = {"rows": rows, "complete": len(rows) < self.size}
+            self.save(board)
+        finally:
+            self.unlock()
+        return board
+
+    def update(self, rows=(), ids=(), deleted=()):
+        """
+        Merge the current `rows` of some entities, the entities of `ids` as
+        they are in the database, and remove the `deleted` ids
+        """
+        # Without a board nor a rebuild running there's nothing to update
+        if not cache.get_many([BOARD_KEY, LOCK_KEY]):
+            return
+        if not self.lock():
+            return
+        try:
+            board = cache.get(BOARD_KEY)
+            if board is None:
+                return
+            rows = list(rows)
+            if ids:
+                rows.extend(
+                    Entity.objects.using(DEFAULT_DB_ALIAS).filter(pk__in=ids).values(*FIELDS)
+                )
+            self.save(self.merge(board, rows, deleted))
+        finally:
+            self.unlock()
+
+    def merge(self, board, rows, deleted):
+        removed = set(deleted) | {row["id"] for row in rows}
+        current = board["rows"]
+        complete = board["complete"]
+        last = rank(current[-1]) if current else None
+        merged = [row for row in current if row["id"] not in removed]
+        # Rows ranked after the last one might be behind entities outside
+        # the board
+        merged.extend(
+            row for row in rows if complete or (last is not None and rank(row) < last)
+        )
+        merged.sort(key=rank)
+        if len(merged) > self.size:
+            merged = merged[:self.size]
+            complete = False
+        if not complete and len(merged) < self.size // 2:
+            return None
+        return {"rows": merged, "complete": complete}
+
+    def save(self, board):
+        if board is None:
+            cache.delete(BOARD_KEY)
+        else:
+            cache.set(BOARD_KEY, board, settings.ENTITY_LEADERBOARD_TIMEOUT)
+        if cache.get(CONFLICT_KEY):
+            cache.delete_many([BOARD_KEY, CONFLICT_KEY])
+
+    def lock(self):
+        if cache.add(LOCK_KEY, 1, LOCK_TIMEOUT):
+            return True
+        # The holder may be writing a board without this update
+        cache.set(CONFLICT_KEY, 1, LOCK_TIMEOUT)
+        cache.delete(BOARD_KEY)
+        return False
+
+    def unlock(self):
+        cache.delete(LOCK_KEY)
+
+
+leaderboard = Leaderboard()
+
+
+@receiver(post_save, sender=Entity)
+def entity_saved(sender, instance, **kwargs):
+    row = row_of(instance)
+    transaction.on_commit(lambda: leaderboard.update([row]))
+
+
+@receiver(post_delete, sender=Entity)
+def entity_deleted(sender, instance, **kwargs):
+    pk = instance.pk
+    transaction.on_commit(lambda: leaderboard.update(deleted=[pk]))
+
+
+class LeaderboardMixin:
+    """
+    Serve the first page of `?ordering=-views` of the page number
+    pagination from the leaderboard
+    """
+    leaderboard_ordering = "-views"
+    # Query params that keep the whole list in the same order
+    leaderboard_params = {"ordering", "page", "format"}
+
+    def list(self, request, *args, **kwargs):
+        params = request.query_params
+        queryset = self.get_queryset()
+        if (params.get("ordering") == self.leaderboard_ordering
+                and params.get("page", "1") == "1"
+                and set(params) <= self.leaderboard_params
+                and not queryset.query.is_sliced):
+            page_size = self.paginator.get_page_size(request)
+            rows = leaderboard.top(page_size + 1)
+            if rows is not None:
+                return self.get_leaderboard_response(request, queryset, rows, page_size)
+        return super().list(request, *args, **kwargs)
+
+    def get_leaderboard_response(self, request, queryset, rows, page_size):
+        entities = [Entity(**row) for row in rows[:page_size]]
+        # Estimated for big tables
+        count = self.paginator.django_paginator_class(queryset, page_size).count
+        next_link = None
+        if len(rows) > page_size:
+            next_link = replace_query_param(
+                request.build_absolute_uri(), self.paginator.page_query_param, 2
+            )
+        return response.Response(OrderedDict([
+            ("count", count),
+            ("next", next_link),
+            ("previous", None),
+            ("results", self.get_serializer(entities, many=True).data),
+        ]))
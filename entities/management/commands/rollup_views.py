@@ -0,0 +1,37 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from entities import analytics
+
+
+class Command(BaseCommand):
+    help = (
+        "Rolls up the entity view buckets, prunes the old ones and caches "
+        "the trending entities"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep rolling up instead of exiting"
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=settings.ENTITY_VIEWS_ROLLUP_INTERVAL,
+            help="Seconds between rollups"
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            trending = analytics.rollup()
+            self.stdout.write(", ".join(
+                "%d trending this %s" % (len(top), window)
+                for window, top in trending.items()
+            ))
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
@@ -0,0 +1,97 @@
+import random
+import uuid
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.token_blacklist.models import OutstandingToken
+
+from authentication.models import User
+from entities import cache
+from entities.models import Entity
+
+
+class Command(BaseCommand):
+    help = (
+        "Generates users, entities and refresh tokens for the benchmarks and "
+        "load tests. Users are named <prefix><n> and share the same password"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=100)
+        parser.add_argument("--entities", type=int, default=1000)
+        parser.add_argument(
+            "--tokens",
+            type=int,
+            default=1,
+            help="Outstanding refresh tokens per user"
+        )
+        parser.add_argument("--prefix", default="seed")
+        parser.add_argument("--password", default="seed-password")
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=settings.BULK_BATCH_SIZE,
+            help="Rows per insert"
+        )
+        parser.add_argument(
+            "--random-seed",
+            type=int,
+            default=0,
+            help="Seed of the entity views, for reproducible data"
+        )
+
+    def handle(self, *args, **options):
+        prefix = options["prefix"]
+        batch_size = options["batch_size"]
+        rand = random.Random(options["random_seed"])
+
+        # Hashed once, it's the slow part of creating users
+        password = make_password(options["password"])
+        start = User.objects.filter(username__startswith=prefix).count()
+        users = User.objects.bulk_create([
+            User(
+                uid=str(uuid.uuid4()),
+                username="%s%d" % (prefix, i),
+                alt_name="%s%d" % (prefix, i),
+                email="%s%d@seed.test" % (prefix, i),
+                password=password
+            ) for i in range(start, start + options["users"])
+        ], batch_size=batch_size)
+        author_ids = [user.pk for user in users] or list(
+            User.objects.values_list("pk", flat=True)[:1000]
+        )
+
+        entities = 0
+        if author_ids:
+            base_link = "https://seed.test/%s/" % prefix
+            start = Entity.objects.filter(link__startswith=base_link).count()
+            entities = len(Entity.objects.bulk_create([
+                Entity(
+                    uid=str(uuid.uuid4()),
+                    name="%s entity %d" % (prefix, i),
+                    link="%s%d" % (base_link, i),
+                    views=rand.randint(0, 1000),
+                    author_id=author_ids[i % len(author_ids)]
+                ) for i in range(start, start + options["entities"])
+            ], batch_size=batch_size))
+            cache.invalidate()
+
+        now = timezone.now()
+        expires = now + jwt_settings.REFRESH_TOKEN_LIFETIME
+        tokens = len(OutstandingToken.objects.bulk_create([
+            OutstandingToken(
+                user_id=user.pk,
+                jti=uuid.uuid4().hex,
+                token="seed",
+                created_at=now,
+                expires_at=expires
+            ) for user in users for _ in range(options["tokens"])
+        ], batch_size=batch_size))
+
+        self.stdout.write(self.style.SUCCESS(
+            "%d users, %d entities and %d tokens created"
+            % (len(users), entities, tokens)
+        ))
@@ -62,7 +62,44 @@ class Entity(BaseEntity):
 
     class Meta:
         app_label = "entities"
-        ordering = ["views"]
-        
-    
-    
\ No newline at end of file
+        # Total order, read through the (views, id) index
+        ordering = ["views", "id"]
+        indexes = [
+            # Keyset pagination
+            models.Index(fields=["views", "id"]),
+            # Incremental exports
+            models.Index(fields=["updated", "id"]),
+        ]
+
+
+class EntityViewBucket(models.Model):
+    """
+    Views of an entity during a period. The view counter appends minute
+    buckets, `manage.py rollup_views` sums them in hour and day buckets.
+    """
+    MINUTE = 60
+    HOUR = 3600
+    DAY = 86400
+    PERIOD_CHOICES = [
+        (MINUTE, "minute"),
+        (HOUR, "hour"),
+        (DAY, "day"),
+    ]
+
+    entity = models.ForeignKey(
+        Entity,
+        on_delete=models.CASCADE,
+        related_name="view_buckets"
+    )
+    period = models.PositiveIntegerField(
+        choices=PERIOD_CHOICES,
+        help_text=_("Seconds of the bucket")
+    )
+    start = models.DateTimeField()
+    views = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        app_label = "entities"
+        indexes = [
+            models.Index(fields=["period", "start"]),
+        ]
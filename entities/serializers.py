@@ -1,24 +1,177 @@
+import copy
+import uuid
+
+from django.conf import settings
+from django.db import models
+from django.utils import timezone
+from entities import cache, validation
+from entities.leaderboard import leaderboard, row_of
 from entities.models import Entity
-from rest_framework import serializers
+from rest_framework import serializers, validators
+from rest_framework.settings import api_settings
+from drfbasis.relations import HyperlinkedModelSerializer
+
+
+class BulkEntityListSerializer(serializers.ListSerializer):
+    """
+    Validates and writes a list of entities with a fixed number of queries:
+    the authors are loaded at once, the unique links are checked with one
+    `IN` query and the entities are written with `bulk_create` or
+    `bulk_update`. The errors of every item are returned together.
+    With `partial=True` every item must include the `id` of the entity to
+    update.
+    """
+    link_unique_message = validation.LINK_UNIQUE_MESSAGE
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Checked for all the items at once in `check_links`
+        link = self.child.fields['link']
+        link.validators = [
+            v for v in link.validators
+            if not isinstance(v, validators.UniqueValidator)
+        ]
+
+    def to_internal_value(self, data):
+        if not isinstance(data, list):
+            raise serializers.ValidationError({
+                api_settings.NON_FIELD_ERRORS_KEY: ["Expected a list of items."]
+            }, code='not_a_list')
+
+        items = [item if isinstance(item, dict) else {} for item in data]
+        self.child.fields['author'].prefetch([i.get('author') for i in items])
+        if self.partial:
+            instances = self.get_instances(items)
+
+        ret = []
+        errors = []
+        for i, item in enumerate(data):
+            error = {}
+            if self.partial and instances[i] is None:
+                error['id'] = ["Not found."]
+            try:
+                ret.append(self.child.run_validation(item))
+            except serializers.ValidationError as exc:
+                ret.append(None)
+                error.update(exc.detail)
+            errors.append(error)
+
+        self.check_links(ret, errors, instances if self.partial else [])
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        if self.partial:
+            self.instance = instances
+        return ret
+
+    def get_instances(self, items):
+        ids = []
+        for item in items:
+            try:
+                ids.append(int(item.get('id')))
+            except (TypeError, ValueError):
+                ids.append(None)
+        entities = Entity.objects.in_bulk([pk for pk in ids if pk is not None])
+        return [entities.get(pk) for pk in ids]
+
+    def check_links(self, ret, errors, instances):
+        links = [attrs['link'] for attrs in ret if attrs and 'link' in attrs]
+        if not links:
+            return
+        holders = validation.link_filter.holders(links)
+        pks = [e.pk if e is not None else None for e in instances] or [None] * len(ret)
 
+        seen = set()
+        for attrs, error, pk in zip(ret, errors, pks):
+            if not attrs or 'link' not in attrs:
+                continue
+            # Also when another item leaves it: the unique constraint is
+            # checked row by row, in the order the UPDATE writes them
+            holder = holders.get(attrs['link'])
+            taken = holder is not None and holder != pk
+            if taken or attrs['link'] in seen:
+                error.setdefault('link', []).append(self.link_unique_message)
+            seen.add(attrs['link'])
+
+    def create(self, validated_data):
+        entities = [
+            Entity(uid=str(uuid.uuid4()), **attrs) for attrs in validated_data
+        ]
+        links = [entity.link for entity in entities]
+        with validation.unique_links(links, many=True):
+            Entity.objects.bulk_create(entities, batch_size=settings.BULK_BATCH_SIZE)
+        # bulk_create does not send the post_save signal
+        cache.invalidate()
+        validation.link_filter.add(links)
+        leaderboard.update([row_of(entity) for entity in entities])
+        return entities
+
+    def update(self, instances, validated_data):
+        now = timezone.now()
+        fields = {'updated'}
+        for entity, attrs in zip(instances, validated_data):
+            for name, value in attrs.items():
+                setattr(entity, name, value)
+            entity.updated = now
+            fields.update(attrs)
+        links = [attrs.get('link') for attrs in validated_data]
+        with validation.unique_links(links, [e.pk for e in instances], many=True):
+            Entity.objects.bulk_update(
+                instances,
+                sorted(fields),
+                batch_size=settings.BULK_BATCH_SIZE
+            )
+        cache.invalidate(now)
+        validation.link_filter.add([link for link in links if link])
+        leaderboard.update([row_of(entity) for entity in instances])
+        return instances
+
+
+class EntitySerializer(HyperlinkedModelSerializer):
+    serializer_field_mapping = {
+        **HyperlinkedModelSerializer.serializer_field_mapping,
+        models.URLField: validation.LinkField
+    }
 
-class EntitySerializer(serializers.HyperlinkedModelSerializer):
     class Meta:
         model = Entity
         fields = ['name', 'author', 'views', 'link']
         # fields = '__all__' to return all fields
         # read_only_fields = ['name'] same as editable=False in the model field
+        list_serializer_class = BulkEntityListSerializer
+        # The unique links are pre-checked with a Bloom filter
+        extra_kwargs = {
+            'link': {'validators': [validation.UniqueLinkValidator()]}
+        }
+
+    # Built once from the model and copied for each serializer
+    fields_cache = {}
+
+    def get_fields(self):
+        fields = self.fields_cache.get(type(self))
+        if fields is None:
+            fields = self.fields_cache[type(self)] = super().get_fields()
+        return copy.deepcopy(fields)
 
     # Validations are entirely done in serializers
     def validate_name(self, value):
-        if ' ' not in value.lower():
+        if ' ' not in value:
             raise serializers.ValidationError("error message")
         return value
     
     def validate(self, data):
-        if int(data['views']) < 0:
+        # Already an int
+        if data.get('views', 0) < 0:
             raise serializers.ValidationError("finish must occur after start")
         return data
+
+    def create(self, validated_data):
+        # Links created meanwhile by another process
+        with validation.unique_links([validated_data.get('link')]):
+            return super().create(validated_data)
+
+    def update(self, instance, validated_data):
+        with validation.unique_links([validated_data.get('link')], [instance.pk]):
+            return super().update(instance, validated_data)
     
     # Methods to create and update entities can be overrided
     '''def create(self, validated_data):
@@ -31,7 +184,7 @@ class EntitySerializer(serializers.HyperlinkedModelSerializer):
         return instance'''
 
 
-class PublicEntitySerializer(serializers.HyperlinkedModelSerializer):
+class PublicEntitySerializer(HyperlinkedModelSerializer):
     class Meta:
         model = Entity
         fields = ['name', 'author']
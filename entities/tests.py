@@ -1,3 +1,975 @@
-from django.test import TestCase
+import base64
+import datetime
+import io
+import json
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.test import SimpleTestCase, override_settings
+from unittest import mock
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth.models import Group
+from rest_framework import relations
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, APITestCase
+from rest_framework_simplejwt.token_blacklist.models import OutstandingToken
+
+from authentication.blacklist import RefreshToken
+from authentication.models import User
+from entities import analytics
+from entities import cache as list_cache
+from entities.counters import view_counter
+from entities.leaderboard import BOARD_KEY, LOCK_KEY, leaderboard
+from entities.models import Entity, EntityViewBucket
+from entities.serializers import EntitySerializer
+from entities import validation
+from entities.validation import BloomFilter, is_valid_url, link_filter
+from drfbasis.db.postgresql_pool.base import ConnectionPool
+from drfbasis.relations import HyperlinkedRelatedField
+from drfbasis.routers import STICKY_COOKIE, lag_monitor
+
+
+class EntityTestCase(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        link_filter.reset()
+        self.user = User.objects.create(
+            username='john',
+            alt_name='Johnny',
+            email='john@test.com'
+        )
+        self.client.force_authenticate(self.user)
+
+    def create_entities(self, n):
+        # Run the on_commit receivers
+        with self.captureOnCommitCallbacks(execute=True):
+            return [
+                Entity.objects.create(
+                    name=f'entity {i}',
+                    link=f'https://test.com/{i}',
+                    views=i % 7,
+                    author=self.user
+                ) for i in range(n)
+            ]
+
+
+class KeysetPaginationTests(EntityTestCase):
+
+    def test_walk_forward_and_back(self):
+        self.create_entities(45)
+        expected = list(
+            Entity.objects.order_by('views', 'id').values_list('name', flat=True)
+        )
+
+        pages = []
+        url = '/api/entities/?cursor='
+        while url:
+            res = self.client.get(url)
+            self.assertEqual(res.status_code, 200)
+            self.assertNotIn('count', res.data)
+            pages.append([e['name'] for e in res.data['results']])
+            url = res.data['next']
+        self.assertEqual([len(p) for p in pages], [20, 20, 5])
+        self.assertEqual(sum(pages, []), expected)
+
+        url = res.data['previous']
+        self.assertEqual(
+            [e['name'] for e in self.client.get(url).data['results']],
+            pages[1]
+        )
+
+    def test_cursor_with_ordering(self):
+        for i, entity in enumerate(self.create_entities(45)):
+            entity.views = i % 4
+            entity.save()
+        for ordering, order_by in (('-views', ('-views', '-id')), ('updated', ('updated', 'id'))):
+            expected = list(Entity.objects.order_by(*order_by).values_list('name', flat=True))
+            names = []
+            url = '/api/entities/?ordering=%s&cursor=' % ordering
+            while url:
+                res = self.client.get(url)
+                names.extend(e['name'] for e in res.data['results'])
+                url = res.data['next']
+            self.assertEqual(names, expected)
+
+    def test_anonymous_ordering(self):
+        self.create_entities(3)
+        self.client.force_authenticate(None)
+        for query in ('?ordering=views', '?ordering=-views', '?ordering=-views&cursor='):
+            res = self.client.get('/api/entities/' + query)
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(len(res.data['results']), 1)
+
+    def test_count(self):
+        self.create_entities(3)
+        res = self.client.get('/api/entities/?cursor=&count=exact')
+        self.assertEqual(res.data['count'], 3)
+        # SQLite has no estimation, it's counted
+        res = self.client.get('/api/entities/?cursor=&count=estimate')
+        self.assertEqual(res.data['count'], 3)
+
+    def test_invalid_cursor(self):
+        res = self.client.get('/api/entities/?cursor=invalid')
+        self.assertEqual(res.status_code, 404)
+
+    def test_invalid_cursor_values(self):
+        for position in (['many', 1], [0, None], [[0], 1]):
+            cursor = base64.urlsafe_b64encode(json.dumps({'p': position}).encode()).decode()
+            res = self.client.get('/api/entities/', {'cursor': cursor})
+            self.assertEqual(res.status_code, 404)
+
+    def test_page_number_pagination(self):
+        self.create_entities(25)
+        res = self.client.get('/api/entities/?page=2')
+        self.assertEqual(res.data['count'], 25)
+        self.assertEqual(len(res.data['results']), 5)
+
+    @override_settings(PAGINATION_ESTIMATE_COUNT_ABOVE=1)
+    def test_estimated_count_pages(self):
+        self.create_entities(45)
+        # An estimation under the real count doesn't hide the last pages
+        with mock.patch('drfbasis.pagination.estimate_count', return_value=10):
+            res = self.client.get('/api/entities/?page=2')
+            self.assertEqual(res.data['count'], 10)
+            self.assertEqual(len(res.data['results']), 20)
+            self.assertIsNotNone(res.data['next'])
+            res = self.client.get(res.data['next'])
+            self.assertEqual(len(res.data['results']), 5)
+            self.assertIsNone(res.data['next'])
+            self.assertEqual(self.client.get('/api/entities/?page=4').status_code, 404)
+
+    def test_users_cursor(self):
+        res = self.client.get('/api/users/?cursor=')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(res.data['results']), 1)
+        self.assertIsNone(res.data['next'])
+
+
+@override_settings(ENTITY_VIEWS_FLUSH_INTERVAL=3600, ENTITY_VIEWS_FLUSH_SIZE=2)
+class ViewCounterTests(EntityTestCase):
+
+    def setUp(self):
+        super().setUp()
+        view_counter.flush()
+        self.client.force_authenticate(None)
+
+    def test_views_are_buffered(self):
+        entity, other = self.create_entities(2)
+        for _ in range(3):
+            res = self.client.post(f'/api/entities/{entity.pk}/view/')
+            self.assertEqual(res.status_code, 202)
+        entity.refresh_from_db()
+        self.assertEqual(entity.views, 0)
+
+        # Second entity pending triggers the flush, one UPDATE per entity
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.post(f'/api/entities/{other.pk}/view/')
+        updates = [q for q in ctx.captured_queries if q['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 2)
+        entity.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(entity.views, 3)
+        self.assertEqual(other.views, 2)
+
+    def test_flush(self):
+        entity = self.create_entities(1)[0]
+        view_counter.add(entity.pk, 5)
+        self.assertEqual(view_counter.flush(), {entity.pk: 5})
+        entity.refresh_from_db()
+        self.assertEqual(entity.views, 5)
+        self.assertEqual(view_counter.flush(), {})
+
+    def test_flush_timer(self):
+        entity = self.create_entities(1)[0]
+        with mock.patch('entities.counters.threading.Timer') as timer:
+            view_counter.add(entity.pk)
+            view_counter.add(entity.pk)
+        # One timer for the views pending, without waiting for more of them
+        timer.assert_called_once_with(3600, view_counter.flush_on_timer)
+        timer.return_value.start.assert_called_once()
+        view_counter.flush()
+        timer.return_value.cancel.assert_called_once()
+        self.assertIsNone(view_counter.timer)
+
+
+class AnalyticsTests(EntityTestCase):
+    now = datetime.datetime(2022, 10, 3, 12, 30, 15, tzinfo=datetime.timezone.utc)
+
+    def buckets(self, period):
+        return list(
+            EntityViewBucket.objects
+            .filter(period=period)
+            .order_by('start', 'entity_id')
+            .values_list('entity_id', 'start', 'views')
+        )
+
+    def test_flush_appends_minute_buckets(self):
+        entity = self.create_entities(1)[0]
+        view_counter.flush()
+        view_counter.add(entity.pk, 3)
+        view_counter.add(999999)
+        view_counter.flush()
+        view_counter.add(entity.pk, 2)
+        view_counter.flush()
+        buckets = self.buckets(EntityViewBucket.MINUTE)
+        self.assertEqual([views for _, _, views in buckets], [3, 2])
+        self.assertEqual(buckets[0][1].second, 0)
+
+    def test_rollup(self):
+        first, second = self.create_entities(2)
+        minute = datetime.timedelta(minutes=1)
+        analytics.record({first.pk: 2, second.pk: 1}, self.now - 40 * minute)
+        analytics.record({first.pk: 1}, self.now - 40 * minute)
+        analytics.record({second.pk: 5}, self.now)
+        analytics.record({first.pk: 7}, self.now - datetime.timedelta(days=3))
+
+        trending = analytics.rollup(self.now)
+        hour = datetime.datetime(2022, 10, 3, 11, tzinfo=datetime.timezone.utc)
+        day = datetime.datetime(2022, 10, 3, tzinfo=datetime.timezone.utc)
+        old = datetime.datetime(2022, 9, 30, 12, tzinfo=datetime.timezone.utc)
+        self.assertEqual(self.buckets(EntityViewBucket.HOUR), [
+            (first.pk, old, 7),
+            (first.pk, hour, 3),
+            (second.pk, hour, 1),
+            (second.pk, hour + datetime.timedelta(hours=1), 5),
+        ])
+        self.assertEqual(self.buckets(EntityViewBucket.DAY), [
+            (first.pk, old.replace(hour=0), 7),
+            (first.pk, day, 3),
+            (second.pk, day, 6),
+        ])
+        # The minute buckets older than the retention are pruned
+        self.assertEqual(len(self.buckets(EntityViewBucket.MINUTE)), 4)
+        self.assertEqual(trending['hour'], [[second.pk, 6], [first.pk, 3]])
+        self.assertEqual(trending['day'], [[second.pk, 6], [first.pk, 3]])
+        self.assertEqual(trending['week'], [[first.pk, 10], [second.pk, 6]])
+
+        # Rolling up again recomputes the last buckets
+        analytics.record({first.pk: 10}, self.now)
+        trending = analytics.rollup(self.now)
+        self.assertEqual(self.buckets(EntityViewBucket.HOUR)[3:], [
+            (first.pk, hour + datetime.timedelta(hours=1), 10),
+            (second.pk, hour + datetime.timedelta(hours=1), 5),
+        ])
+        self.assertEqual(self.buckets(EntityViewBucket.DAY)[1:], [
+            (first.pk, day, 13),
+            (second.pk, day, 6),
+        ])
+        self.assertEqual(trending['hour'], [[first.pk, 13], [second.pk, 6]])
+
+    def test_trending(self):
+        entities = self.create_entities(3)
+        analytics.record({entities[0].pk: 1, entities[1].pk: 5, entities[2].pk: 3})
+        analytics.rollup()
+        entities[2].delete()
+
+        res = self.client.get('/api/entities/trending/')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data['window'], 'hour')
+        self.assertEqual(
+            [(item['name'], item['window_views']) for item in res.data['results']],
+            [('entity 1', 5), ('entity 0', 1)]
+        )
+        res = self.client.get('/api/entities/trending/?window=week&limit=1')
+        self.assertEqual(len(res.data['results']), 1)
+        res = self.client.get('/api/entities/trending/?window=year')
+        self.assertEqual(res.status_code, 400)
+
+        self.client.force_authenticate(None)
+        res = self.client.get('/api/entities/trending/?window=day')
+        self.assertEqual(list(res.data['results'][0]), ['name', 'author', 'window_views'])
+        self.assertEqual(len(res.data['results']), 1)
+
+
+@override_settings(ENTITY_LEADERBOARD_SIZE=30)
+class LeaderboardTests(EntityTestCase):
+
+    def top_page(self):
+        # Not served from the list cache
+        list_cache.invalidate()
+        res = self.client.get('/api/entities/?ordering=-views')
+        self.assertEqual(res.status_code, 200)
+        return [item['name'] for item in res.data['results']]
+
+    def expected(self):
+        return list(
+            Entity.objects.order_by('-views', '-id').values_list('name', flat=True)[:20]
+        )
+
+    def test_first_page(self):
+        self.create_entities(40)
+        self.assertEqual(self.top_page(), self.expected())
+        with CaptureQueriesContext(connection) as ctx:
+            res = self.client.get('/api/entities/?ordering=-views&page=1')
+        # Only the count
+        queries = [q['sql'] for q in ctx.captured_queries if 'entities_entity' in q['sql']]
+        self.assertEqual(len(queries), 1)
+        self.assertIn('COUNT', queries[0])
+        self.assertEqual(res.data['count'], 40)
+        self.assertIn('page=2', res.data['next'])
+        self.assertEqual(
+            [item['name'] for item in res.data['results']], self.expected()
+        )
+
+        # The other pages and orderings are read from the table, with the
+        # id as tiebreaker
+        res = self.client.get('/api/entities/?ordering=-views&page=2')
+        self.assertEqual(
+            [item['name'] for item in res.data['results']],
+            list(Entity.objects.order_by('-views', '-id').values_list('name', flat=True)[20:])
+        )
+        res = self.client.get('/api/entities/?ordering=views')
+        self.assertEqual(
+            [item['name'] for item in res.data['results']],
+            list(Entity.objects.order_by('views', 'id').values_list('name', flat=True)[:20])
+        )
+
+    @override_settings(ENTITY_VIEWS_FLUSH_INTERVAL=3600)
+    def test_updates(self):
+        entities = self.create_entities(40)
+        self.top_page()
+        board = cache.get(BOARD_KEY)
+        self.assertFalse(board['complete'])
+
+        # Views flushed
+        view_counter.add(entities[0].pk, 100)
+        view_counter.flush()
+        self.assertEqual(self.top_page()[0], 'entity 0')
+
+        # Saved, deleted and bulk created entities
+        with self.captureOnCommitCallbacks(execute=True):
+            res = self.client.patch('/api/entities/%s/' % entities[0].pk, {'views': 0})
+        self.assertEqual(res.status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            entities[6].delete()
+        res = self.client.post('/api/entities/bulk/', [{
+            'name': 'new entity',
+            'author': 'http://testserver/api/users/%s/' % self.user.pk,
+            'views': 50,
+            'link': 'https://test.com/new'
+        }], format='json')
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(self.top_page(), self.expected())
+        self.assertEqual(self.top_page()[0], 'new entity')
+        # Updated, not rebuilt
+        self.assertEqual(len(cache.get(BOARD_KEY)['rows']), 29)
+
+    def test_conflict(self):
+        entities = self.create_entities(10)
+        self.top_page()
+        self.assertTrue(cache.get(BOARD_KEY)['complete'])
+
+        # Another process holds the lock: the board is dropped
+        cache.set(LOCK_KEY, 1)
+        leaderboard.update(ids=[entities[0].pk])
+        self.assertIsNone(cache.get(BOARD_KEY))
+        self.assertIsNone(leaderboard.top(20))
+        self.assertEqual(self.top_page(), self.expected()[:10])
+
+        # The holder doesn't write its board
+        leaderboard.save({'rows': [], 'complete': True})
+        self.assertIsNone(cache.get(BOARD_KEY))
+        cache.delete(LOCK_KEY)
+        self.assertEqual(len(leaderboard.top(20)), 10)
+
+
+class ListCacheTests(EntityTestCase):
+
+    def test_cached_until_saved(self):
+        entity = self.create_entities(1)[0]
+        res = self.client.get('/api/entities/')
+        self.assertEqual(res.status_code, 200)
+        with self.assertNumQueries(0):
+            cached = self.client.get('/api/entities/')
+        self.assertEqual(cached.content, res.content)
+        self.assertEqual(cached['ETag'], res['ETag'])
+
+        entity.name = 'new name'
+        with self.captureOnCommitCallbacks(execute=True):
+            entity.save()
+        res = self.client.get('/api/entities/')
+        self.assertEqual(res.data['results'][0]['name'], 'new name')
+        self.assertNotEqual(cached['ETag'], res['ETag'])
+
+    def test_invalidated_on_commit(self):
+        entity = self.create_entities(1)[0]
+        self.client.get('/api/entities/')
+        # A list cached before the commit isn't kept under a new version
+        with self.captureOnCommitCallbacks(execute=True):
+            entity.name = 'new name'
+            entity.save()
+            self.client.get('/api/entities/')
+        res = self.client.get('/api/entities/')
+        self.assertEqual(res.data['results'][0]['name'], 'new name')
+
+    def test_keyed_by_host(self):
+        self.create_entities(1)
+        self.client.get('/api/entities/', HTTP_HOST='evil.example')
+        res = self.client.get('/api/entities/')
+        self.assertEqual(
+            res.data['results'][0]['author'],
+            'http://testserver/api/users/%s/' % self.user.pk
+        )
+        self.assertIn('Cookie', res['Vary'])
+
+    def test_keyed_by_serializer_and_params(self):
+        self.create_entities(2)
+        full = self.client.get('/api/entities/')
+        self.assertIn('views', full.data['results'][0])
+        self.assertEqual(len(self.client.get('/api/entities/?cursor=').data['results']), 2)
+
+        self.client.force_authenticate(None)
+        public = self.client.get('/api/entities/')
+        self.assertNotIn('views', public.data['results'][0])
+        self.assertNotEqual(public['ETag'], full['ETag'])
+
+    def test_conditional_requests(self):
+        self.create_entities(1)
+        res = self.client.get('/api/entities/')
+        with self.assertNumQueries(0):
+            not_modified = self.client.get(
+                '/api/entities/',
+                HTTP_IF_NONE_MATCH=res['ETag']
+            )
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.content, b'')
+
+        not_modified = self.client.get(
+            '/api/entities/',
+            HTTP_IF_MODIFIED_SINCE=res['Last-Modified']
+        )
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_recorded_views_invalidate_old_versions(self):
+        entity = self.create_entities(1)[0]
+        etag = self.client.get('/api/entities/')['ETag']
+        # The view counts lag behind a recent version
+        view_counter.add(entity.pk, 10)
+        view_counter.flush()
+        res = self.client.get('/api/entities/')
+        self.assertEqual(res['ETag'], etag)
+        self.assertEqual(res.data['results'][0]['views'], 0)
+
+        state = cache.get(list_cache.STATE_KEY)
+        state['created'] -= datetime.timedelta(seconds=settings.ENTITY_LIST_CACHE_TIMEOUT)
+        cache.set(list_cache.STATE_KEY, state, None)
+        view_counter.add(entity.pk, 5)
+        view_counter.flush()
+        res = self.client.get('/api/entities/')
+        self.assertNotEqual(res['ETag'], etag)
+        self.assertEqual(res.data['results'][0]['views'], 15)
+
+
+class HyperlinkQueriesTests(EntityTestCase):
+
+    def test_entity_list_queries(self):
+        self.create_entities(30)
+        # COUNT and SELECT, whatever the page size
+        with self.assertNumQueries(2):
+            res = self.client.get('/api/entities/')
+        self.assertEqual(len(res.data['results']), 20)
+        self.assertEqual(
+            res.data['results'][0]['author'],
+            'http://testserver/api/users/%s/' % self.user.pk
+        )
+
+    def test_user_list_queries(self):
+        group = Group.objects.create(name='group')
+        for i in range(30):
+            user = User.objects.create(
+                username=f'user{i}',
+                alt_name=f'user{i}',
+                email=f'user{i}@test.com'
+            )
+            user.groups.add(group)
+        # COUNT, SELECT and the groups prefetch
+        with self.assertNumQueries(3):
+            res = self.client.get('/api/users/')
+        self.assertEqual(len(res.data['results']), 20)
+        self.assertEqual(
+            res.data['results'][0]['groups'],
+            ['http://testserver/api/groups/%s/' % group.pk]
+        )
+
+    def test_same_urls_as_reverse(self):
+        entity = self.create_entities(1)[0]
+        request = APIRequestFactory().get('/api/entities/', {'format': 'json'})
+        context = {'request': Request(request)}
+        field = HyperlinkedRelatedField(view_name='user-detail', read_only=True)
+        field.bind('author', EntitySerializer(context=context))
+        default = relations.HyperlinkedRelatedField(view_name='user-detail', read_only=True)
+        default.bind('author', EntitySerializer(context=context))
+        self.assertEqual(
+            field.to_representation(entity.author),
+            default.to_representation(entity.author)
+        )
+
+
+class FastListTests(EntityTestCase):
+
+    def assert_same_content(self, url):
+        cache.clear()
+        fast = self.client.get(url)
+        cache.clear()
+        with self.settings(FAST_LIST_SERIALIZATION=False):
+            default = self.client.get(url)
+        self.assertEqual(fast.status_code, 200)
+        self.assertEqual(fast.content, default.content)
+
+    def test_entities(self):
+        self.create_entities(25)
+        self.assert_same_content('/api/entities/')
+        self.assert_same_content('/api/entities/?page=2&format=json')
+        self.assert_same_content('/api/entities/?cursor=')
+        self.client.force_authenticate(None)
+        self.assert_same_content('/api/entities/')
+
+    def test_users(self):
+        groups = [Group.objects.create(name=f'group{i}') for i in range(3)]
+        for i in range(5):
+            user = User.objects.create(
+                username=f'user{i}',
+                alt_name=f'user{i}',
+                email=f'user{i}@test.com'
+            )
+            user.groups.add(*groups[i % 2:])
+        self.assert_same_content('/api/users/')
+        self.assert_same_content('/api/users/?cursor=')
+
+
+@override_settings(EXPORT_CHUNK_SIZE=7)
+class ExportTests(EntityTestCase):
+
+    def read(self, res):
+        self.assertEqual(res.status_code, 200)
+        return b''.join(res.streaming_content).decode()
+
+    def test_ndjson(self):
+        self.create_entities(20)
+        res = self.client.get('/api/entities/export/')
+        self.assertEqual(res['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in self.read(res).splitlines()]
+        self.assertEqual(len(rows), 20)
+        self.assertEqual(
+            list(rows[0]),
+            ['name', 'author', 'views', 'link', 'updated']
+        )
+        self.assertEqual(rows[0]['name'], 'entity 0')
+
+        # Incremental pull from the last watermark received
+        Entity.objects.filter(name='entity 3').update(name='changed')
+        entity = Entity.objects.get(name='changed')
+        entity.save()
+        res = self.client.get('/api/entities/export/', {
+            'updated__gt': rows[-1]['updated']
+        })
+        rows = [json.loads(line) for line in self.read(res).splitlines()]
+        self.assertEqual([r['name'] for r in rows], ['changed'])
+
+    def test_csv(self):
+        self.create_entities(3)
+        res = self.client.get('/api/entities/export/', {'output': 'csv'})
+        lines = self.read(res).splitlines()
+        self.assertEqual(lines[0], 'name,author,views,link,updated')
+        self.assertEqual(len(lines), 4)
+
+    def test_users(self):
+        group = Group.objects.create(name='group')
+        self.user.groups.add(group)
+        res = self.client.get('/api/users/export/', {'output': 'csv'})
+        lines = self.read(res).splitlines()
+        self.assertEqual(lines[0], 'url,uid,username,alt_name,email,is_staff,groups,date_joined')
+        self.assertIn('http://testserver/api/groups/%s/' % group.pk, lines[1])
+
+    def test_authentication_required(self):
+        self.client.force_authenticate(None)
+        res = self.client.get('/api/entities/export/')
+        self.assertIn(res.status_code, (401, 403))
+
+    def test_invalid_output(self):
+        res = self.client.get('/api/entities/export/', {'output': 'xml'})
+        self.assertEqual(res.status_code, 400)
+
+
+class BulkTests(EntityTestCase):
+
+    def payload(self, n, start=0):
+        author = 'http://testserver/api/users/%s/' % self.user.pk
+        return [{
+            'name': f'entity {i}',
+            'author': author,
+            'views': i,
+            'link': f'https://test.com/{i}'
+        } for i in range(start, start + n)]
+
+    def test_create(self):
+        link_filter.get_filter()
+        for n in (10, 100):
+            with CaptureQueriesContext(connection) as ctx:
+                res = self.client.post(
+                    '/api/entities/bulk/',
+                    self.payload(n, start=n),
+                    format='json'
+                )
+            self.assertEqual(res.status_code, 201)
+            self.assertEqual(len(res.data), n)
+            # Authors and the INSERT, plus savepoints: the new links
+            # aren't in the filter
+            queries = [q for q in ctx.captured_queries if 'SAVEPOINT' not in q['sql']]
+            self.assertEqual(len(queries), 2)
+        self.assertEqual(Entity.objects.count(), 110)
+        self.assertFalse(Entity.objects.filter(uid=None).exists())
+
+    def test_errors_per_item(self):
+        self.create_entities(1)
+        payload = self.payload(4)
+        payload[1]['name'] = 'noname'
+        payload[3]['link'] = payload[2]['link']
+        res = self.client.post('/api/entities/bulk/', payload, format='json')
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(list(res.data[0]), ['link'])
+        self.assertEqual(list(res.data[1]), ['name'])
+        self.assertEqual(res.data[2], {})
+        self.assertEqual(list(res.data[3]), ['link'])
+        self.assertEqual(Entity.objects.count(), 1)
+
+    def test_update(self):
+        entities = self.create_entities(3)
+        res = self.client.patch('/api/entities/bulk/', [
+            {'id': entities[0].pk, 'name': 'new name'},
+            {'id': entities[1].pk, 'views': 50, 'link': entities[1].link},
+        ], format='json')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(Entity.objects.get(pk=entities[0].pk).name, 'new name')
+        self.assertEqual(Entity.objects.get(pk=entities[1].pk).views, 50)
+
+        res = self.client.patch('/api/entities/bulk/', [
+            {'id': 0, 'name': 'new name'},
+            {'id': entities[1].pk, 'link': entities[2].link},
+        ], format='json')
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(list(res.data[0]), ['id'])
+        self.assertEqual(list(res.data[1]), ['link'])
+
+    def test_update_link_of_another_item(self):
+        a, b = self.create_entities(2)
+        res = self.client.patch('/api/entities/bulk/', [
+            {'id': a.pk, 'link': b.link},
+            {'id': b.pk, 'name': 'x y'},
+        ], format='json')
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(list(res.data[0]), ['link'])
+        self.assertEqual(res.data[1], {})
+
+        # Left by another item of the same request: still taken, whatever
+        # the order the rows would be written in
+        res = self.client.patch('/api/entities/bulk/', [
+            {'id': b.pk, 'link': 'https://test.com/new'},
+            {'id': a.pk, 'link': b.link},
+        ], format='json')
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(res.data[0], {})
+        self.assertEqual(res.data[1], {'link': [validation.LINK_UNIQUE_MESSAGE]})
+        res = self.client.patch('/api/entities/bulk/', [
+            {'id': a.pk, 'link': b.link},
+            {'id': b.pk, 'link': a.link},
+        ], format='json')
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(res.data, [{'link': [validation.LINK_UNIQUE_MESSAGE]}] * 2)
+        self.assertEqual(
+            dict(Entity.objects.values_list('pk', 'link')),
+            {a.pk: a.link, b.pk: b.link}
+        )
+
+    def test_delete(self):
+        entities = self.create_entities(3)
+        analytics.record({entities[0].pk: 1, entities[1].pk: 2})
+        res = self.client.delete('/api/entities/bulk/', {
+            'ids': [entities[0].pk, entities[1].pk]
+        }, format='json')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data['message'], '2 entities deleted')
+        self.assertEqual(list(Entity.objects.all()), [entities[2]])
+        res = self.client.delete('/api/entities/bulk/', {'ids': 'all'}, format='json')
+        self.assertEqual(res.status_code, 400)
+
+
+class ValidationTests(EntityTestCase):
+
+    def post(self, link, name='new entity'):
+        return self.client.post('/api/entities/', {
+            'name': name,
+            'link': link,
+            'author': 'http://testserver/api/users/%s/' % self.user.pk
+        })
+
+    def test_bloom_filter(self):
+        bloom = BloomFilter(1000, 0.01)
+        links = [f'https://test.com/{i}' for i in range(1000)]
+        for link in links:
+            bloom.add(link)
+        self.assertTrue(all(link in bloom for link in links))
+        false_positives = sum(f'https://other.com/{i}' in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+    def test_unique_link(self):
+        entity = self.create_entities(1)[0]
+        link_filter.get_filter()
+        with CaptureQueriesContext(connection) as ctx:
+            res = self.post('https://test.com/new')
+        self.assertEqual(res.status_code, 201)
+        self.assertFalse([q for q in ctx.captured_queries if 'link' in q['sql'] and 'SELECT' in q['sql']])
+
+        # Saved entities are added to the filter
+        for link in (entity.link, 'https://test.com/new'):
+            res = self.post(link)
+            self.assertEqual(res.status_code, 400)
+            self.assertEqual(res.data['link'][0].code, 'unique')
+
+        res = self.client.patch('/api/entities/%s/' % entity.pk, {'link': entity.link})
+        self.assertEqual(res.status_code, 200)
+
+    def test_link_created_by_another_process(self):
+        link_filter.get_filter()
+        Entity.objects.bulk_create([
+            Entity(name='entity 0', link='https://test.com/0', author=self.user)
+        ])
+        res = self.post('https://test.com/0')
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(list(res.data), ['link'])
+
+        res = self.client.post('/api/entities/bulk/', [{
+            'name': 'entity 1',
+            'link': link,
+            'author': 'http://testserver/api/users/%s/' % self.user.pk
+        } for link in ('https://test.com/1', 'https://test.com/0')], format='json')
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(res.data[0], {})
+        self.assertEqual(list(res.data[1]), ['link'])
+        self.assertEqual(Entity.objects.count(), 1)
+
+    @override_settings(ENTITY_LINK_FILTER_REFRESH=0)
+    def test_stale_filter_rebuild(self):
+        stale = link_filter.get_filter()
+        # Rebuilt by another thread: the stale filter is used meanwhile
+        with link_filter.rebuilding:
+            with self.assertNumQueries(0):
+                self.assertIs(link_filter.get_filter(), stale)
+
+        def load():
+            link_filter.add(['https://test.com/saved'])
+            return BloomFilter(10)
+
+        with mock.patch.object(link_filter, 'load', side_effect=load):
+            bloom = link_filter.get_filter()
+        self.assertIsNot(bloom, stale)
+        # The links saved while loading are kept
+        self.assertIn('https://test.com/saved', bloom)
+        self.assertIsNone(link_filter.pending)
+
+    def test_invalid(self):
+        self.assertTrue(is_valid_url('https://test.com/0'))
+        res = self.post('not a link')
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(res.data['link'][0].code, 'invalid')
+        res = self.post('https://test.com/' + 'a' * 200)
+        self.assertEqual(res.data['link'][0].code, 'max_length')
+        res = self.post('https://test.com/0', name='noname')
+        self.assertEqual(list(res.data), ['name'])
+
+
+class SearchTests(EntityTestCase):
+
+    def names(self, res):
+        self.assertEqual(res.status_code, 200)
+        return [item['name'] for item in res.data['results']]
+
+    def test_ranked_search(self):
+        self.create_entities(3)
+        Entity.objects.create(
+            name='alpha', link='https://alpha.com/alpha', author=self.user
+        )
+        Entity.objects.create(
+            name='beta', link='https://alpha.com/beta', author=self.user
+        )
+        res = self.client.get('/api/entities/', {'search': 'alpha'})
+        self.assertEqual(self.names(res), ['alpha', 'beta'])
+        res = self.client.get('/api/entities/', {'search': 'ALPHA', 'cursor': ''})
+        self.assertEqual(sorted(self.names(res)), ['alpha', 'beta'])
+        # Short terms fall back to a plain contains filter
+        res = self.client.get('/api/entities/', {'search': 'ta'})
+        self.assertEqual(self.names(res), ['beta'])
+
+    def test_index_follows_changes(self):
+        entity = self.create_entities(1)[0]
+        entity.name = 'renamed'
+        with self.captureOnCommitCallbacks(execute=True):
+            entity.save()
+        res = self.client.get('/api/entities/', {'search': 'renamed'})
+        self.assertEqual(self.names(res), ['renamed'])
+        with self.captureOnCommitCallbacks(execute=True):
+            entity.delete()
+        res = self.client.get('/api/entities/', {'search': 'renamed'})
+        self.assertEqual(self.names(res), [])
+
+    def test_user_search(self):
+        User.objects.create(username='mary', alt_name='Mar', email='mary@x.com')
+        res = self.client.get('/api/users/', {'search': 'john@'})
+        self.assertEqual(
+            [item['username'] for item in res.data['results']], ['john']
+        )
+
+
+@override_settings(DATABASE_REPLICAS=['sqlite'])
+class ReplicaRoutingTests(EntityTestCase):
+    # The sqlite alias stands for a replica without replication
+    databases = {'default', 'sqlite'}
+
+    def setUp(self):
+        super().setUp()
+        lag_monitor.reset()
+        self.create_entities(2)
+
+    def count(self):
+        cache.clear()
+        res = self.client.get('/api/entities/')
+        self.assertEqual(res.status_code, 200)
+        return res.data['count']
+
+    def test_reads_from_replica(self):
+        self.assertEqual(self.count(), 0)
+        self.assertEqual(self.client.get('/api/groups/').data['count'], 0)
+
+    def test_primary_after_write(self):
+        res = self.client.post('/api/entities/', {
+            'name': 'new entity', 'link': 'https://new.com',
+            'author': 'http://testserver/api/users/%s/' % self.user.pk
+        })
+        self.assertEqual(res.status_code, 201, res.data)
+        self.assertIn(STICKY_COOKIE, res.cookies)
+        self.assertEqual(self.count(), 3)
+        del self.client.cookies[STICKY_COOKIE]
+        self.assertEqual(self.count(), 0)
+
+    def test_list_cache_keyed_by_database(self):
+        # Cached from the replica, after the version changed
+        self.client.get('/api/entities/')
+        with self.captureOnCommitCallbacks(execute=True):
+            res = self.client.post('/api/entities/', {
+                'name': 'new entity', 'link': 'https://new.com',
+                'author': 'http://testserver/api/users/%s/' % self.user.pk
+            })
+        cookie = self.client.cookies.pop(STICKY_COOKIE)
+        self.assertEqual(self.client.get('/api/entities/').data['count'], 0)
+        self.client.cookies[STICKY_COOKIE] = cookie.value
+        self.assertEqual(self.client.get('/api/entities/').data['count'], 3)
+
+    def test_lagging_replica_skipped(self):
+        with mock.patch.object(lag_monitor, 'get_lag', return_value=60):
+            self.assertEqual(self.count(), 2)
+        # Not checked again until the interval passes
+        self.assertEqual(self.count(), 2)
+        lag_monitor.reset()
+        self.assertEqual(self.count(), 0)
+
+
+class ConnectionPoolTests(SimpleTestCase):
+
+    def connect(self):
+        conn = mock.Mock(closed=0)
+        conn.info.transaction_status = 0
+        conn.close.side_effect = lambda: setattr(conn, 'closed', 1)
+        return conn
+
+    def test_reuse_and_limit(self):
+        pool = ConnectionPool(self.connect, size=2, timeout=0.01)
+        first, second = pool.get(), pool.get()
+        self.assertIsNot(first, second)
+        with self.assertRaises(OperationalError):
+            pool.get()
+
+        first.info.transaction_status = 2  # in transaction
+        pool.put(first)
+        first.rollback.assert_called_once()
+        self.assertIs(pool.get(), first)
+
+        pool.put(second, discard=True)
+        second.close.assert_called_once()
+        self.assertIsNot(pool.get(), second)
+
+
+class InstrumentationTests(EntityTestCase):
+
+    def test_metrics(self):
+        self.create_entities(3)
+        self.client.get('/api/entities/')
+        self.client.generic('BREW', '/api/entities/')
+
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        with override_settings(METRICS_TOKEN='secret'):
+            self.client.force_authenticate(None)
+            res = self.client.get('/metrics', HTTP_AUTHORIZATION='Token secret')
+        self.assertEqual(res.status_code, 200)
+        content = res.content.decode()
+        self.assertIn(
+            'http_request_duration_seconds_count{route="entity-list",method="GET",status="200"}',
+            content
+        )
+        self.assertIn(
+            'http_request_duration_seconds_count{route="entity-list",method="other",status="405"}',
+            content
+        )
+        self.assertNotIn('BREW', content)
+        self.assertIn('http_request_db_queries_bucket{route="entity-list",le=', content)
+        self.assertIn('http_request_serializer_duration_seconds_sum{route="entity-list"}', content)
+        self.assertIn('password_hash_queue_depth 0', content)
+
+    def test_server_timing_staff_only(self):
+        self.assertNotIn('Server-Timing', self.client.get('/api/entities/'))
+        with override_settings(DEBUG=True):
+            self.assertIn('db;dur=', self.client.get('/api/entities/')['Server-Timing'])
+        self.user.is_staff = True
+        self.user.save()
+        self.assertIn('db;dur=', self.client.get('/api/entities/')['Server-Timing'])
+
+    @override_settings(PROFILING_ENABLED=True)
+    def test_profile_staff_only(self):
+        res = self.client.get('/api/entities/', HTTP_X_PROFILE='1')
+        self.assertEqual(res['Content-Type'], 'application/json')
+
+        self.user.is_staff = True
+        self.user.save()
+        # The middleware reads the staff claim of the token
+        token = RefreshToken.for_user(self.user).access_token
+        self.client.force_authenticate(None)
+        res = self.client.get(
+            '/api/entities/',
+            HTTP_X_PROFILE='1',
+            HTTP_AUTHORIZATION='Bearer %s' % token
+        )
+        self.assertEqual(res['X-Profiled-Status'], '200')
+        self.assertIn(b'function calls', res.content)
+
+
+class SeedDataTests(EntityTestCase):
+
+    def test_seed_data(self):
+        self.create_entities(1)
+        self.client.get('/api/entities/')
+        call_command(
+            'seed_data', users=3, entities=10, tokens=2, stdout=io.StringIO()
+        )
+        self.assertEqual(User.objects.filter(username__startswith='seed').count(), 3)
+        self.assertEqual(Entity.objects.filter(link__startswith='https://seed.test/').count(), 10)
+        self.assertEqual(OutstandingToken.objects.filter(token='seed').count(), 6)
+        # The users share the password and the cached list was invalidated
+        res = self.client.post('/auth/login/', {'username': 'seed2', 'password': 'seed-password'})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(self.client.get('/api/entities/').data['count'], 11)
+
+        # Numbered after the existing ones
+        call_command('seed_data', users=1, entities=1, stdout=io.StringIO())
+        self.assertTrue(User.objects.filter(username='seed3').exists())
@@ -0,0 +1,211 @@
+"""
+Validation of the entity writes.
+
+The unique links are pre-checked against a Bloom filter of the known links,
+loaded per process from the database: a link that isn't in the filter is
+new and costs no query, only the possible hits are looked up. The filter
+doesn't see the links created by other processes until it's rebuilt (every
+`ENTITY_LINK_FILTER_REFRESH` seconds), the unique constraint of the table
+catches them when writing (`unique_links`).
+"""
+import contextlib
+import functools
+import hashlib
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.validators import URLValidator
+from django.db import IntegrityError, transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from rest_framework import serializers, validators
+
+from entities.models import Entity
+
+LINK_UNIQUE_MESSAGE = "entity with this link already exists."
+
+
+class BloomFilter:
+    """Set membership with false positives at `error_rate` and no false negatives"""
+
+    def __init__(self, capacity, error_rate=0.01):
+        self.capacity = capacity
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def positions(self, value):
+        # Double hashing: the k positions from the two halves of one digest
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, value):
+        for position in self.positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value):
+        bits = self.bits
+        return all(
+            bits[position >> 3] & (1 << (position & 7))
+            for position in self.positions(value)
+        )
+
+
+class LinkFilter:
+    """
+    The links of the entities, loaded on first use. A stale filter is
+    rebuilt by one thread while the others keep using it.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.rebuilding = threading.Lock()
+        self.filter = None
+        self.loaded = 0
+        # Links added while rebuilding, None when not rebuilding
+        self.pending = None
+
+    def get_filter(self):
+        bloom = self.filter
+        if (bloom is None
+                or bloom.count > bloom.capacity
+                or time.monotonic() - self.loaded > settings.ENTITY_LINK_FILTER_REFRESH):
+            # Only the first load waits
+            if self.rebuilding.acquire(blocking=bloom is None):
+                try:
+                    if bloom is self.filter:
+                        self.rebuild()
+                finally:
+                    self.rebuilding.release()
+            bloom = self.filter
+        return bloom
+
+    def rebuild(self):
+        with self.lock:
+            self.pending = []
+        bloom = None
+        try:
+            bloom = self.load()
+        finally:
+            with self.lock:
+                if bloom is not None:
+                    for link in self.pending:
+                        bloom.add(link)
+                    self.filter = bloom
+                    self.loaded = time.monotonic()
+                self.pending = None
+
+    def load(self):
+        links = Entity.objects.values_list("link", flat=True)
+        # Room to grow until the next rebuild
+        bloom = BloomFilter(
+            max(links.count() * 2, settings.ENTITY_LINK_FILTER_CAPACITY),
+            settings.ENTITY_LINK_FILTER_ERROR_RATE
+        )
+        for link in links.iterator(chunk_size=settings.BULK_BATCH_SIZE):
+            bloom.add(link)
+        return bloom
+
+    def add(self, links):
+        with self.lock:
+            if self.pending is not None:
+                self.pending.extend(links)
+            if self.filter is not None:
+                for link in links:
+                    self.filter.add(link)
+
+    def reset(self):
+        with self.lock:
+            self.filter = None
+
+    def holders(self, links, known=False):
+        """
+        The id of the entity using each of the `links` used. Only the
+        possible hits of the filter are queried, all of them when `known`.
+        """
+        if not known:
+            bloom = self.get_filter()
+            links = [link for link in links if link in bloom]
+        if not links:
+            return {}
+        return dict(
+            Entity.objects.filter(link__in=links).values_list("link", "pk")
+        )
+
+
+link_filter = LinkFilter()
+
+
+@receiver(post_save, sender=Entity)
+def entity_saved(sender, instance, **kwargs):
+    link_filter.add([instance.link])
+
+
+url_validator = URLValidator()
+
+
+@functools.lru_cache(maxsize=4096)
+def is_valid_url(value):
+    try:
+        url_validator(value)
+    except ValidationError:
+        return False
+    return True
+
+
+class LinkField(serializers.CharField):
+    """`URLField` with the validation results cached by value"""
+    default_error_messages = serializers.URLField.default_error_messages
+
+    def run_validators(self, value):
+        if not is_valid_url(value):
+            raise serializers.ValidationError(self.error_messages["invalid"], code="invalid")
+        super().run_validators(value)
+
+
+class UniqueLinkValidator(validators.UniqueValidator):
+    """Queries the links the filter may have seen"""
+
+    def __init__(self):
+        super().__init__(Entity.objects.all(), LINK_UNIQUE_MESSAGE)
+
+    def __call__(self, value, serializer_field):
+        instance = getattr(serializer_field.parent, "instance", None)
+        holder = link_filter.holders([value]).get(value)
+        if holder is not None and (instance is None or holder != instance.pk):
+            raise serializers.ValidationError(self.message, code="unique")
+
+
+@contextlib.contextmanager
+def unique_links(links, pks=None, many=False):
+    """
+    Turn the unique constraint violations of the writes of `links`, by the
+    entities of `pks` (None when created), into a validation error of the
+    link, per item of the list when `many`
+    """
+    try:
+        with transaction.atomic():
+            yield
+    except IntegrityError:
+        holders = link_filter.holders([link for link in links if link], known=True)
+        pks = pks or [None] * len(links)
+        taken = [
+            link in holders and holders[link] != pk
+            for link, pk in zip(links, pks)
+        ]
+        if not any(taken):
+            raise
+        link_filter.add(holders)
+        if not many:
+            raise serializers.ValidationError({"link": [LINK_UNIQUE_MESSAGE]})
+        raise serializers.ValidationError([
+            {"link": [LINK_UNIQUE_MESSAGE]} if item_taken else {}
+            for item_taken in taken
+        ])
@@ -1,13 +1,33 @@
+from entities import analytics
 from entities.models import Entity
-from rest_framework import viewsets
+from entities.cache import CachedListMixin
+from entities.leaderboard import LeaderboardMixin
+from entities.counters import view_counter
+from rest_framework import permissions, response, status, viewsets
+from rest_framework.decorators import action
+from rest_framework.settings import api_settings
 from entities.serializers import EntitySerializer, PublicEntitySerializer
+from drfbasis.export import ExportMixin
+from drfbasis.fastlist import FastListMixin
+from drfbasis.filters import OrderingFilter
+from drfbasis.pagination import HybridPagination
 
 
-class EntityViewSet(viewsets.ModelViewSet):
+class EntityPagination(HybridPagination):
+    ordering = ("views", "id")
+
+
+class EntityViewSet(CachedListMixin, LeaderboardMixin, FastListMixin,
+                    ExportMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows entities to be viewed or edited.
     """
     queryset = Entity.objects.all()
+    pagination_class = EntityPagination
+    filter_backends = api_settings.DEFAULT_FILTER_BACKENDS + [OrderingFilter]
+    # Indexed with the id
+    ordering_fields = ['views', 'updated']
+    read_from_replica = True
 
     def get_queryset(self):
         user = self.request.user
@@ -23,4 +43,83 @@ class EntityViewSet(viewsets.ModelViewSet):
         user = self.request.user
         if user.is_authenticated:
           return EntitySerializer
-        return PublicEntitySerializer
\ No newline at end of file
+        return PublicEntitySerializer
+
+    @action(detail=True, methods=['post'], url_path='view',
+            permission_classes=[permissions.AllowAny])
+    def record_view(self, request, pk=None):
+        """
+        Count a view of the entity. It's buffered and written in batches,
+        so the entity is not read nor locked here.
+        """
+        try:
+            entity_id = int(pk)
+        except ValueError:
+            return response.Response({
+                "message": "Invalid entity id"
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        view_counter.add(entity_id)
+        return response.Response(status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=False, methods=['get'])
+    def trending(self, request):
+        """
+        The most viewed entities in the last `window` (hour, day or week)
+        with their `window_views`, ranked by the last rollup
+        """
+        window = request.query_params.get('window', 'hour')
+        if window not in analytics.WINDOWS:
+            return response.Response({
+                "message": "The window must be one of %s" % ", ".join(analytics.WINDOWS)
+            }, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = int(request.query_params.get('limit', 10))
+        except ValueError:
+            limit = 10
+        if not request.user.is_authenticated:
+            # Less entities returned if it's not authenticated
+            limit = 1
+
+        top = analytics.get_trending(window)[:max(limit, 0)]
+        entities = Entity.objects.in_bulk([entity_id for entity_id, _ in top])
+        # Without the ones deleted since the rollup
+        ranked = [(entities[pk], views) for pk, views in top if pk in entities]
+        results = self.get_serializer([e for e, _ in ranked], many=True).data
+        for data, (_, views) in zip(results, ranked):
+            data['window_views'] = views
+        return response.Response({"window": window, "results": results})
+
+    @action(detail=False, methods=['post', 'patch', 'delete'],
+            permission_classes=[permissions.IsAuthenticated])
+    def bulk(self, request):
+        """
+        POST a list of entities to create them, PATCH a list of entities
+        with their `id` to update them or DELETE `{"ids": [...]}`.
+        """
+        if request.method == 'DELETE':
+            ids = request.data.get('ids') if isinstance(request.data, dict) else None
+            if (not isinstance(ids, list)
+                    or not all(isinstance(pk, int) for pk in ids)):
+                return response.Response({
+                    "message": "Send the list of ids to delete"
+                }, status=status.HTTP_400_BAD_REQUEST)
+            # The count is without the view buckets deleted in cascade
+            _, deleted = Entity.objects.filter(pk__in=ids).delete()
+            return response.Response({
+                "message": "%d entities deleted" % deleted.get(Entity._meta.label, 0)
+            }, status=status.HTTP_200_OK)
+
+        partial = request.method == 'PATCH'
+        serializer = EntitySerializer(
+            data=request.data,
+            many=True,
+            partial=partial,
+            context=self.get_serializer_context()
+        )
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return response.Response(
+            serializer.data,
+            status=status.HTTP_200_OK if partial else status.HTTP_201_CREATED
+        )